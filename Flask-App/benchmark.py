@@ -0,0 +1,449 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-10-02 20:14:45 @PyCharm
+Description:
+worker 调度策略基准测试：按可复现的到达分布生成订单，驱动 worker 处理，统计吞吐量、排队等待与端到端延迟
+MySQL 由 SQLite 内存库代替；Redis 默认使用 fakeredis（需安装 fakeredis 与 lupa），也可用 --redis-url 指定本地 redis-server
+每个策略在独立的子进程中运行，互不影响，例如:
+python benchmark.py --orders 500 --rate 100 --strategy thread --strategy thread+reliable --strategy batch+coalesce
+python benchmark.py --strategy thread --strategy thread+QUEUE_SCHEDULER=fair --users 20
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import threading
+import subprocess
+import contextlib
+
+# 基准测试默认参数
+BENCH_ORDERS = 200  # 订单总数
+BENCH_RATE = 50  # 平均到达速率（个/秒）
+BENCH_ARRIVAL = "poisson"  # poisson: 指数分布间隔，uniform: 固定间隔，burst: 全部在开始时到达
+BENCH_SERVICE = 0.05  # 单个订单的平均执行耗时（秒，指数分布）
+BENCH_COUNT = 1  # 每个订单的 count
+BENCH_USERS = 5  # 下单用户数（均匀分布）
+BENCH_DUPLICATE_RATIO = 0.0  # 与已到达订单 url 相同的订单占比（用于评估合并执行）
+BENCH_FAIL_RATIO = 0.0  # 首次执行失败的订单占比（用于评估重试）
+BENCH_SEED = 42  # 随机种子，相同参数生成相同的到达序列与执行耗时
+BENCH_TIMEOUT = 300  # 单个策略的最长运行时间（秒）
+BENCH_CONCURRENCY = 4  # worker 并发数
+BENCH_BATCH_SIZE = 50  # batch 模式下单次出队的最大订单数
+BENCH_STRATEGY_MODES = ("single", "thread", "batch")  # 可测试的执行模式（进程池与 async 依赖真实的 MySQL）
+BENCH_STRATEGY_FLAGS = ("reliable", "coalesce", "write-behind")
+
+# 子进程输出结果的行前缀，其余输出（worker 日志）被丢弃
+RESULT_PREFIX = "BENCH_RESULT "
+
+ORDER_TABLE_SQL = """
+create table `order` (
+    `id` integer primary key autoincrement,
+    `order_identity` varchar(64) not null,
+    `create_time` datetime default current_timestamp,
+    `url` varchar(255) not null,
+    `count` integer not null,
+    `user_identity` varchar(64) not null,
+    `status` integer not null default 1
+)
+"""
+
+
+# ---------------- 替身：SQLite 内存库代替 MySQL 连接池 ----------------
+
+class SQLiteCursor:
+    """兼容 pymysql 游标的用法：%s 占位符，按游标类型返回字典行或元组行"""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock, dict_rows: bool = True):
+        self._cursor = conn.cursor()
+        self._lock = lock
+        self._row = dict if dict_rows else tuple
+        self.lastrowid = None
+        self.rowcount = 0
+
+    def execute(self, sql, param=None):
+        # 与 pymysql 一致：不带参数时不处理占位符（批量写入已渲染好的 SQL）
+        if param is not None:
+            sql = sql.replace("%s", "?")
+        with self._lock:
+            self._cursor.execute(sql, list(param or []))
+            self.rowcount = self._cursor.rowcount
+            # 与 MySQL 一致：多行插入返回第一行的自增编号
+            self.lastrowid = self._cursor.lastrowid - max(self.rowcount - 1, 0) if self._cursor.lastrowid else None
+        return self.rowcount
+
+    def executemany(self, sql, params):
+        with self._lock:
+            self._cursor.executemany(sql.replace("%s", "?"), [list(param) for param in params])
+            self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def fetchone(self):
+        with self._lock:
+            row = self._cursor.fetchone()
+        return self._row(row) if row is not None else None
+
+    def fetchall(self):
+        with self._lock:
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size):
+        with self._lock:
+            return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def mogrify(self, sql, param=None):
+        """按 SQLite 的字面量规则渲染参数（批量写入拼接 SQL 时使用）"""
+        def literal(value):
+            if value is None:
+                return "NULL"
+            if isinstance(value, (int, float)):
+                return str(value)
+            return "'" + str(value).replace("'", "''") + "'"
+        return sql % tuple(literal(value) for value in (param or []))
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLitePool:
+    """与 PooledDB 接口一致的替身：所有连接共用一个 SQLite 内存库（自动提交，commit/rollback 不生效）"""
+
+    def __init__(self, *args, **kwargs):
+        self.conn = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.conn.execute(ORDER_TABLE_SQL)
+
+    def connection(self, *args, **kwargs):
+        return self
+
+    def cursor(self, cursor_class=None):
+        return SQLiteCursor(self.conn, self.lock, cursor_class is None or "Dict" in cursor_class.__name__)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def install_stand_ins(redis_url: str | None):
+    """
+    安装替身，需在导入 worker 之前调用（utils.db 在导入时创建连接池）
+    :param redis_url: 本地 redis-server 地址（会清空对应的库），None 时使用 fakeredis
+    :return: (utils.db 模块, utils.cache 模块)
+    """
+    from dbutils import pooled_db
+    pooled_db.PooledDB = SQLitePool
+    import redis
+    from utils import db, cache
+    if redis_url:
+        pool = redis.ConnectionPool.from_url(redis_url, decode_responses=True)
+        redis.Redis(connection_pool=pool).flushdb()
+    else:
+        try:
+            import fakeredis
+        except ImportError:
+            raise SystemExit("未安装 fakeredis，请 pip install fakeredis lupa，或使用 --redis-url 指定本地 redis-server")
+        pool = redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection, server=fakeredis.FakeServer(), decode_responses=True
+        )
+    cache.RedisPool._instance = pool
+    db.MYSQL_MAX_ALLOWED_PACKET = 4 * 1024 * 1024
+    return db, cache
+
+
+# ---------------- 负载：可复现的订单到达序列 ----------------
+
+def generate_workload(args) -> list[dict]:
+    """
+    生成订单到达序列
+    :return: [{"at": 相对开始的到达时间, "url": ..., "count": ..., "user_identity": ..., "service": 执行耗时, "fail": 首次执行是否失败}, ...]
+    """
+    rng = random.Random(args.seed)
+    workload = []
+    at = 0.0
+    for index in range(args.orders):
+        if args.arrival == "poisson":
+            at += rng.expovariate(args.rate)
+        elif args.arrival == "uniform":
+            at = index / args.rate
+        if workload and rng.random() < args.duplicate_ratio:
+            url = rng.choice(workload)["url"]
+        else:
+            url = f"http://bench.local/{index}"
+        workload.append({
+            "at": at,
+            "url": url,
+            "count": args.count,
+            "user_identity": f"user{rng.randrange(args.users)}",
+            "service": rng.expovariate(1 / args.service) if args.service > 0 else 0.0,
+            "fail": rng.random() < args.fail_ratio,
+        })
+    return workload
+
+
+def percentile(values: list[float], p: float) -> float:
+    """最近秩法百分位数"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+# ---------------- 子进程：运行单个策略 ----------------
+
+def parse_strategy(strategy: str):
+    """
+    解析策略：执行模式 + 开关 + 环境变量，以 + 分隔，如 thread+reliable、batch+coalesce、thread+QUEUE_SCHEDULER=fair
+    :return: (执行模式, 开关集合, 环境变量字典)
+    """
+    mode, *items = strategy.split("+")
+    if mode not in BENCH_STRATEGY_MODES:
+        raise ValueError(f"不支持的执行模式: {mode}，可选 {list(BENCH_STRATEGY_MODES)}")
+    flags, env = set(), {}
+    for item in items:
+        if "=" in item:
+            name, value = item.split("=", 1)
+            env[name] = value
+        elif item in BENCH_STRATEGY_FLAGS:
+            flags.add(item)
+        else:
+            raise ValueError(f"不支持的策略开关: {item}，可选 {list(BENCH_STRATEGY_FLAGS)} 或 环境变量=值")
+    return mode, flags, env
+
+
+def run_strategy(args) -> dict:
+    """在当前进程中运行一个策略（策略中的环境变量已由父进程设置）"""
+    mode, flags, _ = parse_strategy(args.child)
+    db, cache = install_stand_ins(args.redis_url)
+    import worker
+    from utils import message, task_executor
+
+    workload = generate_workload(args)
+    arrived, started, finished = {}, {}, {}
+    services, failures = {}, set()
+    lock = threading.Lock()
+    all_finished = threading.Event()
+
+    current = threading.local()
+
+    class SimExecutor:
+        """按负载中预先生成的耗时执行，订单编号由 execute_order 记录在线程局部变量中"""
+
+        def execute(self, url, count, progress=None):
+            order_id = current.order_id
+            with lock:
+                fail = order_id in failures
+                failures.discard(order_id)
+            time.sleep(services[order_id])
+            result = task_executor.ExecutionResult(count)
+            result.elapsed = services[order_id]
+            if fail:
+                result.failed = count
+            else:
+                result.succeeded = count
+                if progress is not None and count:
+                    progress(count)
+            return result
+
+        def close(self):
+            pass
+
+    execute_order = worker.execute_order
+
+    def record_started(order):
+        with lock:
+            started.setdefault(order["id"], time.perf_counter())
+        current.order_id = order["id"]
+        return execute_order(order)
+
+    write_orders_status = worker._write_orders_status
+
+    write_status_map = worker._write_status_map
+
+    def mark_finished(status_map):
+        now = time.perf_counter()
+        with lock:
+            for order_id, status in status_map.items():
+                if status in (3, 4):
+                    finished.setdefault(order_id, (now, status))
+            if len(finished) >= len(workload):
+                all_finished.set()
+
+    def record_finished(status, order_ids, tx=None):
+        write_orders_status(status, order_ids, tx)
+        mark_finished(dict.fromkeys(order_ids, status))
+
+    def record_status_map(status_map):
+        write_status_map(status_map)
+        mark_finished(status_map)
+
+    worker.execute_order = record_started
+    worker._write_orders_status = record_finished
+    worker._write_status_map = record_status_map
+    worker._task_executor = SimExecutor()
+    worker.RETRY_BASE_DELAY = args.retry_delay
+    if "write-behind" in flags:
+        worker.enable_write_behind()
+
+    def produce():
+        begin = time.perf_counter()
+        for item in workload:
+            delay = begin + item["at"] - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            order_id = db.insert_one(
+                "insert into `order` (`order_identity`, `url`, `count`, `user_identity`, `status`) "
+                "values (%s, %s, %s, %s, 1)",
+                [os.urandom(32).hex(), item["url"], item["count"], item["user_identity"]],
+            )
+            with lock:
+                services[order_id] = item["service"]
+                if item["fail"]:
+                    failures.add(order_id)
+                arrived[order_id] = time.perf_counter()
+            order = db.fetch_one("select * from `order` where `id`=%s", [order_id])
+            cache.push_queue(message.encode_task(order), "task_queue")
+
+    def watchdog():
+        if not all_finished.wait(args.timeout):
+            print(f"策略 {args.child} 超时: {len(finished)}/{len(workload)}", file=sys.stderr)
+        worker._stop_event.set()
+
+    producer = threading.Thread(target=produce, name="bench-producer", daemon=True)
+    threading.Thread(target=watchdog, name="bench-watchdog", daemon=True).start()
+    begin = time.perf_counter()
+    producer.start()
+    # worker 在主线程运行（需要安装退出信号处理），日志丢弃
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "single":
+            worker.run()
+        elif mode == "batch":
+            worker.run_batch(args.batch_size, args.concurrency, "coalesce" in flags)
+        else:
+            worker.run_pool("thread", args.concurrency, None, "reliable" in flags)
+
+    waits = [started[order_id] - arrived[order_id] for order_id in started if order_id in arrived]
+    latencies = [at - arrived[order_id] for order_id, (at, _) in finished.items() if order_id in arrived]
+    elapsed = max((at for at, _ in finished.values()), default=time.perf_counter()) - begin
+    return {
+        "strategy": args.child,
+        "orders": len(workload),
+        "finished": len(finished),
+        "failed": sum(1 for _, status in finished.values() if status == 4),
+        "executed": len(started),
+        "elapsed": elapsed,
+        "throughput": len(finished) / elapsed if elapsed > 0 else 0.0,
+        "wait_p50": percentile(waits, 50),
+        "wait_p99": percentile(waits, 99),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p99": percentile(latencies, 99),
+    }
+
+
+# ---------------- 父进程：逐个策略启动子进程并汇总 ----------------
+
+def spawn_strategy(strategy: str, argv: list[str]) -> dict | None:
+    _, _, env = parse_strategy(strategy)
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *argv, "--child", strategy],
+        env={**os.environ, **env}, capture_output=True, text=True,
+    )
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"策略 {strategy} 运行失败(code={process.returncode}):\n{process.stderr[-2000:]}", file=sys.stderr)
+    return None
+
+
+def format_report(results: list[dict]) -> str:
+    header = ("策略", "完成/总数", "失败", "执行次数", "吞吐(个/秒)", "等待p50(ms)", "等待p99(ms)", "延迟p50(ms)", "延迟p99(ms)")
+    rows = [header]
+    for result in results:
+        rows.append((
+            result["strategy"],
+            f"{result['finished']}/{result['orders']}",
+            str(result["failed"]),
+            str(result["executed"]),
+            f"{result['throughput']:.1f}",
+            *(f"{result[name] * 1000:.1f}" for name in ("wait_p50", "wait_p99", "latency_p50", "latency_p99")),
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="worker 调度策略基准测试")
+    parser.add_argument("--strategy", action="append", default=None,
+                        help=f"要测试的策略，可重复指定：执行模式{list(BENCH_STRATEGY_MODES)} + 开关{list(BENCH_STRATEGY_FLAGS)} "
+                             f"或 环境变量=值，以 + 分隔，默认 thread")
+    parser.add_argument("--orders", type=int, default=BENCH_ORDERS, help="订单总数")
+    parser.add_argument("--rate", type=float, default=BENCH_RATE, help="平均到达速率（个/秒）")
+    parser.add_argument("--arrival", choices=["poisson", "uniform", "burst"], default=BENCH_ARRIVAL, help="到达分布")
+    parser.add_argument("--service", type=float, default=BENCH_SERVICE, help="单个订单的平均执行耗时（秒）")
+    parser.add_argument("--count", type=int, default=BENCH_COUNT, help="每个订单的 count")
+    parser.add_argument("--users", type=int, default=BENCH_USERS, help="下单用户数")
+    parser.add_argument("--duplicate-ratio", type=float, default=BENCH_DUPLICATE_RATIO, help="重复 url 的订单占比")
+    parser.add_argument("--fail-ratio", type=float, default=BENCH_FAIL_RATIO, help="首次执行失败的订单占比")
+    parser.add_argument("--retry-delay", type=float, default=0.1, help="首次重试的退避上限（秒）")
+    parser.add_argument("--seed", type=int, default=BENCH_SEED, help="随机种子")
+    parser.add_argument("-c", "--concurrency", type=int, default=BENCH_CONCURRENCY, help="worker 并发数")
+    parser.add_argument("--batch-size", type=int, default=BENCH_BATCH_SIZE, help="batch 模式下单次出队的最大订单数")
+    parser.add_argument("--timeout", type=float, default=BENCH_TIMEOUT, help="单个策略的最长运行时间（秒）")
+    parser.add_argument("--redis-url", default=None,
+                        help="本地 redis-server 地址，如 redis://127.0.0.1:6379/15（会清空该库），默认使用 fakeredis")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        print(RESULT_PREFIX + json.dumps(run_strategy(args)), flush=True)
+        return
+    strategies = args.strategy or ["thread"]
+    for strategy in strategies:
+        parse_strategy(strategy)
+    # 透传给子进程的公共参数
+    argv = [arg for arg in sys.argv[1:] if arg != "--json"]
+    while "--strategy" in argv:
+        index = argv.index("--strategy")
+        del argv[index:index + 2]
+    argv = [arg for arg in argv if not arg.startswith("--strategy=")]
+    results = []
+    for strategy in strategies:
+        print(f"运行策略: {strategy}", file=sys.stderr)
+        result = spawn_strategy(strategy, argv)
+        if result is not None:
+            results.append(result)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(results))
+
+
+if __name__ == '__main__':
+    main()
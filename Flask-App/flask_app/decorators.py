@@ -12,8 +12,17 @@ Description:
 Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
 """
 from functools import wraps
-from flask import abort, g
+from flask import abort, g, request, session, jsonify
 from flask_app.models import User
+from utils import cache
+from utils.logger import LOG
+
+# 准入控制配置（按 task_queue 积压量）
+ADMISSION_SOFT_WATERMARK = 5000  # 软水位：超过后每个用户限流
+ADMISSION_HARD_WATERMARK = 20000  # 硬水位：超过后拒绝创建订单
+ADMISSION_USER_LIMIT = 10  # 软水位以上，每个用户每个窗口允许创建的订单数
+ADMISSION_USER_WINDOW = 60  # 限流窗口（秒）
+ADMISSION_RETRY_AFTER = 60  # 超过硬水位时建议的重试间隔（秒）
 
 
 def admin_required(f):
@@ -27,4 +36,34 @@ def admin_required(f):
         if g.user.role != 1:
             abort(403)  # 权限不足
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+
+def _too_many_requests(error, retry_after):
+    response = jsonify({"success": False, "error": error, "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def admission_control(f):
+    """订单入队前的准入控制：队列积压超过软水位时按用户限流，超过硬水位时拒绝（429 + Retry-After）"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # 仅拦截会写入队列的请求
+        if request.method != 'POST':
+            return f(*args, **kwargs)
+        user_info = session.get('user_info') or {}
+        state, depth = cache.admission_state("task_queue", ADMISSION_SOFT_WATERMARK, ADMISSION_HARD_WATERMARK)
+        if state == "reject":
+            LOG.warning(f"队列积压 {depth}，拒绝用户:{user_info.get('user_identity')}创建订单")
+            return _too_many_requests("当前订单过多，请稍后再试", ADMISSION_RETRY_AFTER)
+        # 管理员不受软水位限流
+        if state == "throttle" and user_info.get('role') != 1:
+            allowed, retry_after = cache.rate_limit(
+                "task_queue", user_info.get('user_identity'), ADMISSION_USER_LIMIT, ADMISSION_USER_WINDOW
+            )
+            if not allowed:
+                return _too_many_requests("提交过于频繁，请稍后再试", retry_after)
+        return f(*args, **kwargs)
+    return decorated_function
@@ -4,7 +4,13 @@ function createOrder(formData) {
         method: 'POST',
         body: formData, // 将表单数据作为请求
     })
-    .then(response => {
+    .then(async response => {
+        if (response.status === 429) {
+            // 队列繁忙：服务端返回错误信息与建议的重试间隔
+            const data = await response.json();
+            const retryAfter = response.headers.get('Retry-After') || data.retry_after;
+            throw new Error(`${data.error}（约 ${retryAfter} 秒后可重试）`);
+        }
         if (!response.ok) {
             throw new Error('网络响应不正常');
         }
@@ -38,6 +44,20 @@ function deleteOrder(orderIdentity) {
     })
 }
 
+function getOrderProgress(orderIds) {
+    // 批量查询订单进度
+    return fetch(`/order/progress?ids=${orderIds.join(',')}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            return data.data;
+        }
+    })
+    .catch(error => {
+        console.error('请求失败：', error)
+    })
+}
+
 function deleteUser(userId) {
     // 使用 DELETE 方法
     return fetch(`/user/delete/${userId}`, {method: 'DELETE'})
@@ -84,6 +104,7 @@ function logoutAccount(userId) {
 const API = {
     createOrder,
     deleteOrder,
+    getOrderProgress,
     deleteUser,
     restoreUser,
     logoutAccount,
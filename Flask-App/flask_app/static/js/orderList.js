@@ -31,4 +31,36 @@ function showOrderDeleteConfirmModal(itemID, orderIdentity) {
 }
 
 
-window.showOrderDeleteConfirmModal = showOrderDeleteConfirmModal
\ No newline at end of file
+window.showOrderDeleteConfirmModal = showOrderDeleteConfirmModal
+
+
+// 处理中的订单定时刷新进度，订单结束后刷新页面显示最终状态
+const PROGRESS_REFRESH_INTERVAL = 3000;
+
+async function refreshOrderProgress() {
+    const elements = document.querySelectorAll('.order-progress');
+    if (elements.length === 0) {
+        return;
+    }
+    const orderIds = Array.from(elements, element => element.dataset.orderId);
+    const progress = await API.getOrderProgress(orderIds);
+    if (!progress) {
+        return;
+    }
+    let finished = false;
+    elements.forEach(element => {
+        const item = progress[element.dataset.orderId];
+        if (!item) {
+            return;
+        }
+        element.textContent = `${item.done}/${item.total}`;
+        if (item.status !== 2) {
+            finished = true;
+        }
+    });
+    if (finished) {
+        location.reload();
+    }
+}
+
+setInterval(refreshOrderProgress, PROGRESS_REFRESH_INTERVAL);
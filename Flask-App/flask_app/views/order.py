@@ -12,9 +12,10 @@ Description:
 Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
 """
 from flask import Blueprint, session, redirect, render_template, request, jsonify
-from utils import cache, func
+from utils import cache, func, message
 from utils.logger import LOG
 from flask_app.models import db, text, select, User, Order
+from flask_app.decorators import admission_control
 
 ORDER_STATUS = {
     1: '待处理',
@@ -23,6 +24,9 @@ ORDER_STATUS = {
     4: '失败',
 }
 
+# 单次进度查询的最大订单数
+ORDER_PROGRESS_MAX_IDS = 200
+
 # 创建蓝图对象
 order_bp = Blueprint('order', __name__)
 
@@ -64,10 +68,41 @@ def order_list():
             Order.user_identity == user_identity,
         )
         data_list = db.session.execute(query).mappings().all()
-    return render_template('order_list.html', data_list=data_list)
+    # 处理中的订单一次 MGET 读取进度
+    progress = cache.get_progress("task_queue", [item.order_id for item in data_list if item.status == 2])
+    return render_template('order_list.html', data_list=data_list, progress=progress)
+
+
+@order_bp.route('/order/progress', methods=['GET', ])
+def order_progress():
+    """批量查询订单进度：/order/progress?ids=1,2,3"""
+    user_info = session.get('user_info')
+    try:
+        order_ids = [int(order_id) for order_id in request.args.get('ids', '').split(',') if order_id]
+    except ValueError:
+        return jsonify({"success": False, "error": "订单编号格式错误"}), 400
+    if len(order_ids) > ORDER_PROGRESS_MAX_IDS:
+        return jsonify({"success": False, "error": f"单次最多查询{ORDER_PROGRESS_MAX_IDS}个订单"}), 400
+    if not order_ids:
+        return jsonify({"success": True, "data": {}})
+    query = select(Order.id, Order.count, Order.status).where(Order.id.in_(order_ids))
+    if user_info['role'] != 1: # 客户只能查询自己的订单
+        query = query.where(Order.user_identity == user_info['user_identity'])
+    rows = db.session.execute(query).mappings().all()
+    progress = cache.get_progress("task_queue", [row.id for row in rows])
+    data = {
+        row.id: {
+            "status": row.status,
+            "done": row.count if row.status == 3 else min(progress[row.id], row.count),
+            "total": row.count,
+        }
+        for row in rows
+    }
+    return jsonify({"success": True, "data": data})
 
 
 @order_bp.route('/order/create', methods=['GET', 'POST'])
+@admission_control
 def order_create():
     if request.method == 'GET':
         return render_template('order_create.html')
@@ -79,15 +114,18 @@ def order_create():
         # 生成唯一ID
         order_id = func.generate_sha256_identifier(f"{user_info['user_identity']}_{url}_{count}")
         # 写入数据库
-        Order.create(
+        order, error = Order.create(
             order_identity=order_id,
             url=url,
             count=count,
             user_identity=user_info['user_identity'],
             status=1,
         )
-        # 写入 redis 队列
-        cache.push_queue(order_id, "task_queue")
+        if not order:
+            LOG.error(f"用户:{user_info['user_identity']}创建订单失败:{error}")
+            return jsonify({"success": False, "error": "订单创建失败"}), 500
+        # 写入 redis 队列：消息携带执行所需的全部字段，worker 无需再查询数据库；管理员创建的订单进入高优先级通道
+        cache.push_queue(message.encode_task(order), "task_queue", priority=user_info['role'] == 1)
         LOG.info(f"用户:{user_info['user_identity']}成功创建了订单:{order_id}")
         return jsonify({"success": True, "msg": f"订单创建成功"})
     else:
@@ -0,0 +1,248 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-09-24 21:16:52 @PyCharm
+Description:
+worker 进程管理：根据 task_queue 的积压量与消化速度，在上下限之间增减 worker 进程
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import os
+import sys
+import math
+import time
+import signal
+import argparse
+import platform
+import threading
+import subprocess
+
+from utils import cache
+
+# 需要连接 Flask-app 的 redis
+cache.start_redis_service()
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+IS_WINDOWS = platform.system() == "Windows"
+
+# 扩缩容配置
+MIN_WORKERS = 1  # 最少 worker 数
+MAX_WORKERS = 8  # 最多 worker 数
+CHECK_INTERVAL = 5  # 检查间隔（秒）
+SCALE_UP_DEPTH = 100  # 积压超过该值才考虑扩容
+SCALE_DOWN_DEPTH = 10  # 积压低于该值才考虑缩容（与扩容阈值拉开距离，避免来回抖动）
+TARGET_DRAIN_SECONDS = 60  # 期望在该时长内消化完积压，按当前消化速度预计超时则扩容
+SCALE_UP_CHECKS = 2  # 连续满足扩容条件的检查次数
+SCALE_DOWN_CHECKS = 6  # 连续满足缩容条件的检查次数
+COOLDOWN_SECONDS = 30  # 两次扩缩容之间的最短间隔（秒）
+RETIRE_TIMEOUT = 120  # 退役 worker 排空在途订单的最长等待时间（秒），超时强制结束
+RATE_SMOOTHING = 0.3  # 消化速度的指数平滑系数
+
+_stop_event = threading.Event()
+
+
+class WorkerProcess:
+    """一个 worker 子进程"""
+
+    def __init__(self, worker_args: list[str]):
+        kwargs = {}
+        if IS_WINDOWS:
+            # 独立进程组，才能单独向其发送 CTRL_BREAK_EVENT
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        # 同一主机上的多个 worker 不启动指标服务，避免端口冲突
+        self.popen = subprocess.Popen([sys.executable, WORKER_SCRIPT, *worker_args, "--metrics-port", "0"], **kwargs)
+        self.started_at = time.time()
+        self.retire_at = None
+
+    @property
+    def pid(self):
+        return self.popen.pid
+
+    def alive(self) -> bool:
+        return self.popen.poll() is None
+
+    def retire(self):
+        """通知 worker 停止出队并排空在途订单后退出"""
+        if self.retire_at is not None:
+            return
+        self.retire_at = time.time()
+        if IS_WINDOWS:
+            self.popen.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            self.popen.send_signal(signal.SIGTERM)
+
+    def kill_if_overdue(self, timeout: float) -> bool:
+        """退役超时仍未退出时强制结束（在途订单由可靠队列的回收器放回队列）"""
+        if self.retire_at is not None and self.alive() and time.time() - self.retire_at > timeout:
+            self.popen.kill()
+            return True
+        return False
+
+
+class Supervisor:
+    """
+    按积压量扩缩容：
+    - 扩容：积压 > SCALE_UP_DEPTH，且按平滑后的消化速度预计无法在 TARGET_DRAIN_SECONDS 内消化完，连续 SCALE_UP_CHECKS 次；
+      按预计所需的 worker 数一次扩到位（不超过上限）
+    - 缩容：积压 < SCALE_DOWN_DEPTH，连续 SCALE_DOWN_CHECKS 次，每次退役一个
+    - 每次扩缩容后进入冷却期
+    """
+
+    def __init__(self, worker_args: list[str], min_workers: int = MIN_WORKERS, max_workers: int = MAX_WORKERS):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError(f"worker 数量上下限不合法: min={min_workers} max={max_workers}")
+        self.worker_args = worker_args
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.workers: list[WorkerProcess] = []
+        self.retiring: list[WorkerProcess] = []
+        self.last_depth = None
+        self.last_check = None
+        self.drain_rate = 0.0  # 每秒净消化量（出队 - 入队），可能为负
+        self.up_streak = 0
+        self.down_streak = 0
+        self.last_scale = 0.0
+
+    def active_count(self) -> int:
+        return len(self.workers)
+
+    def spawn(self, count: int):
+        for _ in range(count):
+            worker = WorkerProcess(self.worker_args)
+            self.workers.append(worker)
+            print(f"启动 worker: pid={worker.pid}")
+
+    def retire(self, count: int):
+        # 优先退役最新启动的 worker
+        for _ in range(min(count, len(self.workers))):
+            worker = self.workers.pop()
+            worker.retire()
+            self.retiring.append(worker)
+            print(f"退役 worker: pid={worker.pid}")
+
+    def reap(self):
+        """清理已退出的进程，意外退出的 worker 会在下一步补足到下限"""
+        for worker in list(self.workers):
+            if not worker.alive():
+                self.workers.remove(worker)
+                print(f"worker 意外退出: pid={worker.pid} code={worker.popen.returncode}")
+        for worker in list(self.retiring):
+            if worker.kill_if_overdue(RETIRE_TIMEOUT):
+                print(f"worker 退役超时，已强制结束: pid={worker.pid}")
+            if not worker.alive():
+                self.retiring.remove(worker)
+                print(f"worker 已退出: pid={worker.pid}")
+
+    def observe(self, depth: int):
+        """更新消化速度"""
+        now = time.time()
+        if self.last_depth is not None:
+            elapsed = max(now - self.last_check, 1e-6)
+            rate = (self.last_depth - depth) / elapsed
+            self.drain_rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.drain_rate
+        self.last_depth = depth
+        self.last_check = now
+
+    def desired_count(self, depth: int) -> int:
+        """根据积压量与消化速度计算期望的 worker 数"""
+        current = self.active_count()
+        if depth > SCALE_UP_DEPTH:
+            self.down_streak = 0
+            eta = depth / self.drain_rate if self.drain_rate > 0 else math.inf
+            if eta > TARGET_DRAIN_SECONDS:
+                self.up_streak += 1
+            else:
+                self.up_streak = 0
+            if self.up_streak >= SCALE_UP_CHECKS:
+                # 按单个 worker 的消化速度估算所需数量；速度未知时扩容一个
+                per_worker = self.drain_rate / current if current and self.drain_rate > 0 else 0
+                if per_worker > 0:
+                    needed = math.ceil(depth / (per_worker * TARGET_DRAIN_SECONDS))
+                else:
+                    needed = current + 1
+                return max(current + 1, needed)
+        elif depth < SCALE_DOWN_DEPTH:
+            self.up_streak = 0
+            self.down_streak += 1
+            if self.down_streak >= SCALE_DOWN_CHECKS:
+                return current - 1
+        else:
+            self.up_streak = 0
+            self.down_streak = 0
+        return current
+
+    def step(self):
+        self.reap()
+        # 1.补足下限（含意外退出的 worker）
+        if self.active_count() < self.min_workers:
+            self.spawn(self.min_workers - self.active_count())
+        # 2.采集积压量
+        depth = cache.queue_length("task_queue")
+        self.observe(depth)
+        # 3.冷却期内只采集不调整
+        if time.time() - self.last_scale < COOLDOWN_SECONDS:
+            return
+        desired = min(max(self.desired_count(depth), self.min_workers), self.max_workers)
+        current = self.active_count()
+        if desired == current:
+            return
+        print(f"调整 worker 数: {current} -> {desired} (积压 {depth}，消化速度 {self.drain_rate:.2f}/s)")
+        if desired > current:
+            self.spawn(desired - current)
+        else:
+            self.retire(current - desired)
+        self.up_streak = 0
+        self.down_streak = 0
+        self.last_scale = time.time()
+
+    def shutdown(self):
+        """退役全部 worker 并等待退出"""
+        self.retire(len(self.workers))
+        while self.retiring:
+            self.reap()
+            time.sleep(1)
+
+    def run(self):
+        print(f"supervisor 已启动: min={self.min_workers} max={self.max_workers} worker 参数={self.worker_args}")
+        try:
+            while not _stop_event.is_set():
+                try:
+                    self.step()
+                except Exception as e:
+                    print(f"supervisor 检查异常: {e}")
+                _stop_event.wait(CHECK_INTERVAL)
+        finally:
+            self.shutdown()
+            print("supervisor 已退出")
+
+
+def _handle_stop_signal(signum, frame):
+    print(f"收到退出信号({signum})，等待全部 worker 排空后退出...")
+    _stop_event.set()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="worker 自动扩缩容",
+        epilog="'--' 之后的参数原样传给 worker.py，例如: python supervisor.py --max 16 -- --mode thread -c 8 --reliable",
+    )
+    parser.add_argument("--min", type=int, default=MIN_WORKERS, help="最少 worker 数")
+    parser.add_argument("--max", type=int, default=MAX_WORKERS, help="最多 worker 数")
+    parser.add_argument("worker_args", nargs=argparse.REMAINDER, help="传给 worker.py 的参数")
+    args = parser.parse_args()
+    if args.worker_args and args.worker_args[0] == "--":
+        args.worker_args = args.worker_args[1:]
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if "--reliable" not in args.worker_args:
+        print("提示: 建议 worker 使用 --reliable，退役超时被强制结束时在途订单可由回收器放回队列")
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, _handle_stop_signal)
+    Supervisor(args.worker_args, args.min, args.max).run()
@@ -0,0 +1,144 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+测试公共配置：把 Flask-App 加入导入路径；连接池启动时不预建连接，导入 utils.db 无需 MySQL；
+fake_pool 替换 utils.db 的连接池，记录执行的语句，用于检查生成的 SQL；
+fake_redis 把 utils.cache 的连接池换成 fakeredis（需安装 fakeredis 与 lupa，用于执行 Lua 脚本）
+"""
+import os
+import sys
+
+os.environ.setdefault("MYSQL_POOL_MIN_CACHED", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pymysql  # noqa: E402
+import pytest  # noqa: E402
+from pymysql import converters, cursors  # noqa: E402
+
+
+class FakeCursor:
+    """记录执行的语句；查询结果取自连接池预置的行（字典），按游标类型返回字典或元组"""
+
+    def __init__(self, conn, cursor_class):
+        self.conn = conn
+        self.cursor_class = cursor_class
+        self.rowcount = 0
+        self.lastrowid = 0
+        self.description = None
+        self.closed = False
+        self._rows = []
+
+    def mogrify(self, query, args=None):
+        if args is None:
+            return query
+        return query % tuple(converters.escape_item(arg, "utf8") for arg in args)
+
+    def execute(self, sql, param=None):
+        self.conn.pool.log.append(("execute", self.mogrify(sql, param)))
+        error = self.conn.pool.fail_on
+        if error and error in sql:
+            raise pymysql.err.OperationalError(1205, "Lock wait timeout exceeded")
+        rows = list(self.conn.pool.rows)
+        if sql.startswith("select @@max_allowed_packet"):
+            rows = [{"packet": self.conn.pool.max_allowed_packet}]
+        self.rowcount, self.lastrowid = self.conn.pool.on_execute(sql)
+        if sql.startswith("select"):
+            columns = list(rows[0]) if rows else []
+            self.description = [(column,) for column in columns]
+            if not issubclass(self.cursor_class, cursors.DictCursorMixin):
+                rows = [tuple(row[column] for column in columns) for row in rows]
+            self._rows = rows
+            self.rowcount = 2 ** 64 - 1 if issubclass(self.cursor_class, cursors.SSCursor) else len(rows)
+        return self.rowcount
+
+    def executemany(self, sql, params):
+        self.conn.pool.log.append(("executemany", sql, list(params)))
+        self.rowcount = len(params)
+        return self.rowcount
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = False
+        self.cursors = []
+
+    def cursor(self, cursor_class=cursors.Cursor):
+        cursor = FakeCursor(self, cursor_class)
+        self.cursors.append(cursor)
+        return cursor
+
+    def begin(self):
+        self.pool.log.append(("begin",))
+
+    def commit(self):
+        self.pool.log.append(("commit",))
+
+    def rollback(self):
+        self.pool.log.append(("rollback",))
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    """
+    替代 PooledDB：记录每个连接上的操作
+    - rows: 查询返回的行（字典列表）
+    - on_execute(sql) -> (rowcount, lastrowid): 写入语句的影响行数与自增编号
+    - fail_on: 语句中包含该片段时抛出 OperationalError
+    """
+
+    def __init__(self):
+        self.log = []
+        self.connections = []
+        self.rows = []
+        self.max_allowed_packet = 4 * 1024 * 1024
+        self.fail_on = None
+        self.on_execute = lambda sql: (0, 0)
+
+    def connection(self):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+    def statements(self):
+        return [entry[1] for entry in self.log if entry[0] == "execute"]
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    from utils import db
+    pool = FakePool()
+    monkeypatch.setattr(db, "MYSQL_CONN_POOL", pool)
+    monkeypatch.setattr(db, "MYSQL_MAX_ALLOWED_PACKET", None)
+    return pool
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import redis
+    from utils import cache
+    pool = redis.ConnectionPool(
+        connection_class=fakeredis.FakeRedisConnection, server=fakeredis.FakeServer(), decode_responses=True
+    )
+    monkeypatch.setattr(cache.RedisPool, "_instance", pool)
+    monkeypatch.setattr(cache, "QUEUE_BACKEND", "list")
+    monkeypatch.setattr(cache, "QUEUE_SCHEDULER", "fifo")
+    monkeypatch.setattr(cache, "QUEUE_SHARDS", 1)
+    return redis.Redis(connection_pool=pool)
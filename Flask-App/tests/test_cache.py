@@ -0,0 +1,95 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+Redis 侧的 Lua 逻辑（fakeredis）：认领与结束标记、延迟重试、分块完成、可靠队列的确认与回收
+"""
+import time
+
+from utils import cache, message
+
+KEY = "task_queue"
+
+
+def _task(order_id, **fields):
+    return message.encode_task({
+        "id": order_id, "order_identity": f"o{order_id}", "url": "http://x", "count": 1, "user_identity": "u",
+        **fields,
+    })
+
+
+def test_claim_skips_finished_and_defers_claimed_tasks(fake_redis):
+    assert cache.claim_tasks(KEY, [("1", "w1"), ("2", "w1")]) == [True, True]
+    # 其它执行者认领中：返回剩余秒数；同一执行者可以重复认领
+    other, again = cache.claim_tasks(KEY, [("1", "w2"), ("1", "w1")])
+    assert 0 < other <= 600 and again is True
+    cache.release_tasks(KEY, [("1", "w1", "done"), ("2", "w1", "retry")])
+    assert cache.claim_tasks(KEY, [("1", "w2"), ("2", "w2")]) == [None, True]
+
+
+def test_release_outcomes_update_queued_set(fake_redis):
+    values = [_task(order_id) for order_id in (1, 2, 3, 4)]
+    assert cache.push_queue_many(values, KEY) == 4
+    assert cache.push_queue_many(values, KEY) == 0
+    cache.release_tasks(KEY, [("1", "w1", "done"), ("2", "w1", "retry"), ("3", "w1", "dead"), ("4", "w1", "drop")])
+    assert fake_redis.smembers(cache.queued_key(KEY)) == {"2"}
+    assert fake_redis.exists(cache.done_key(KEY, "1"), cache.done_key(KEY, "3"), cache.done_key(KEY, "4")) == 2
+    # 已注销的任务可以重新入队，等待重试的不会重复入队
+    assert cache.push_queue_many(values, KEY) == 3
+
+
+def test_release_keeps_claim_of_other_holder(fake_redis):
+    cache.claim_tasks(KEY, [("1", "w2")])
+    cache.release_tasks(KEY, [("1", "w1", "retry")])
+    assert fake_redis.get(cache.claim_key(KEY, "1")) == "w2"
+
+
+def test_promote_due_retries(fake_redis):
+    cache.schedule_retry(KEY, {"due": time.time() - 1, "later": time.time() + 60})
+    assert cache.promote_due_retries(KEY) == 1
+    assert fake_redis.lrange(KEY, 0, -1) == ["due"]
+    assert fake_redis.zrange(cache.retry_key(KEY), 0, -1) == ["later"]
+
+
+def test_complete_chunks_reports_parent_after_last_chunk(fake_redis):
+    assert cache.init_chunks(KEY, 7, 3) == [0, 1, 2]
+    assert cache.complete_chunks(KEY, [(7, 0, True), (7, 1, False)]) == ([], [])
+    # 父订单被重复投递时只入队未结束的分块
+    assert cache.init_chunks(KEY, 7, 3) == [2]
+    assert cache.complete_chunks(KEY, [(7, 2, True)]) == ([], [7])
+    # 回写父订单失败后重放：结果以各分块最后一次记录为准
+    assert cache.complete_chunks(KEY, [(7, 1, True), (7, 2, True)]) == ([7], [])
+    cache.clear_chunks(KEY, [7])
+    assert fake_redis.keys(f"{KEY}:chunks:*") == []
+    assert cache.complete_chunks(KEY, [(7, 2, True)]) == ([], [])
+
+
+def test_reliable_queue_requeues_only_unacked(fake_redis):
+    cache.push_queue_many([_task(1), _task(2)], KEY)
+    first = cache.pop_queue_reliable(KEY, "w1", 1, visibility_timeout=-1)
+    second = cache.pop_queue_reliable(KEY, "w1", 1, visibility_timeout=-1)
+    # 处理完成的确认；处理失败的不确认，租约到期后放回队列
+    cache.ack_queue(KEY, "w1", first)
+    assert cache.requeue_expired(KEY) == 1
+    assert fake_redis.lrange(KEY, 0, -1) == [second]
+    assert fake_redis.llen(cache.processing_key(KEY, "w1")) == 0
+    assert fake_redis.zcard(cache.lease_key(KEY)) == 0
+    assert cache.requeue_expired(KEY) == 0
+
+
+def test_requeue_dead_workers_drops_claims(fake_redis):
+    cache.push_queue_many([_task(1)], KEY)
+    cache.heartbeat(KEY, "w1", 60)
+    value = cache.pop_queue_reliable(KEY, "w1", 1)
+    cache.claim_tasks(KEY, [("1", "w1:run")])
+    fake_redis.delete(cache.heartbeat_key(KEY, "w1"))
+    assert cache.requeue_dead_workers(KEY) == 1
+    assert fake_redis.lrange(KEY, 0, -1) == [value]
+    assert cache.claim_tasks(KEY, [("1", "w2")]) == [True]
+    assert fake_redis.smembers(cache.workers_key(KEY)) == set()
+
+
+def test_reset_tasks_clears_done_markers_and_claims(fake_redis):
+    cache.claim_tasks(KEY, [("1", "w1"), ("2", "w1")])
+    cache.release_tasks(KEY, [("1", "w1", "done")])
+    cache.reset_tasks(KEY, ["1", "2"])
+    assert cache.claim_tasks(KEY, [("1", "w2"), ("2", "w2")]) == [True, True]
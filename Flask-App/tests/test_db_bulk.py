@@ -0,0 +1,133 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+批量写入：生成的 SQL、按行数与 max_allowed_packet 拆分、逐条提交与出错回滚
+"""
+import math
+
+import pymysql
+import pytest
+
+from utils import db
+
+
+def _counting_ids(start=100):
+    """按语句中的行数返回影响行数，自增编号从 start 起连续分配"""
+    next_id = [start]
+
+    def on_execute(sql):
+        if not sql.startswith("insert"):
+            return sql.count(" when ") or 0, 0
+        rows = sql.count("),(") + 1
+        first, next_id[0] = next_id[0], next_id[0] + rows
+        return rows, first
+
+    return on_execute
+
+
+def test_insert_many_sql_and_ids(fake_pool):
+    fake_pool.on_execute = _counting_ids()
+    rowcount, ids = db.insert_many("user", ["name", "age"], [("a", 1), ("b'c", None)])
+    assert fake_pool.statements() == [
+        "select @@max_allowed_packet as `packet`",
+        "insert into `user` (`name`,`age`) values ('a',1),('b\\'c',NULL)",
+    ]
+    assert rowcount == 2
+    assert ids == [100, 101]
+    assert fake_pool.log[-1] == ("commit",)
+    assert all(conn.closed for conn in fake_pool.connections)
+
+
+def test_insert_many_splits_by_max_rows(fake_pool):
+    fake_pool.on_execute = _counting_ids()
+    rowcount, ids = db.insert_many("t", ["v"], [(i,) for i in range(5)], max_rows=2)
+    assert fake_pool.statements()[1:] == [
+        "insert into `t` (`v`) values (0),(1)",
+        "insert into `t` (`v`) values (2),(3)",
+        "insert into `t` (`v`) values (4)",
+    ]
+    # 每条语句提交一次
+    assert [entry for entry in fake_pool.log if entry[0] == "commit"] == [("commit",)] * 3
+    assert rowcount == 5
+    assert ids == [100, 101, 102, 103, 104]
+
+
+def test_insert_many_splits_by_packet_size(fake_pool):
+    prefix = "insert into `t` (`v`) values "
+    # 每行渲染为 ('xxxxxxxx')，计 13 字节（含逗号）；可用字节数恰好容纳 3 行
+    fake_pool.max_allowed_packet = math.ceil((len(prefix) + 39) / db.BULK_PACKET_RATIO)
+    db.insert_many("t", ["v"], [("x" * 8,)] * 7)
+    statements = fake_pool.statements()[1:]
+    assert [statement.count("'xxxxxxxx'") for statement in statements] == [3, 3, 1]
+    assert all(len(statement) <= db._packet_limit(None) for statement in statements)
+
+
+def test_oversized_row_is_sent_alone(fake_pool):
+    fake_pool.max_allowed_packet = 200
+    db.insert_many("t", ["v"], [("a",), ("x" * 500,), ("b",)])
+    assert [statement.count("),(") for statement in fake_pool.statements()[1:]] == [0, 0, 0]
+
+
+def test_max_allowed_packet_is_read_once(fake_pool):
+    db.insert_many("t", ["v"], [(1,)])
+    db.insert_many("t", ["v"], [(2,)])
+    assert fake_pool.statements().count("select @@max_allowed_packet as `packet`") == 1
+
+
+def test_empty_rows_issue_no_statement(fake_pool):
+    assert db.insert_many("t", ["v"], []) == (0, [])
+    assert db.update_many("t", "id", ["v"], []) == 0
+    assert [statement for statement in fake_pool.statements() if not statement.startswith("select")] == []
+
+
+def test_upsert_many_sql(fake_pool):
+    db.upsert_many("stock", ["sku", "qty", "note"], [("a", 1, "x"), ("b", 2, "y")], update_columns=["qty"])
+    assert fake_pool.statements()[-1] == (
+        "insert into `stock` (`sku`,`qty`,`note`) values ('a',1,'x'),('b',2,'y') "
+        "on duplicate key update `qty`=values(`qty`)"
+    )
+
+    db.upsert_many("stock", ["sku", "qty"], [("a", 1)])
+    assert fake_pool.statements()[-1].endswith("on duplicate key update `sku`=values(`sku`),`qty`=values(`qty`)")
+
+
+def test_update_many_sql(fake_pool):
+    fake_pool.on_execute = _counting_ids()
+    rowcount = db.update_many("order", "id", ["status", "note"], [(1, 3, "ok"), (2, 4, None)])
+    assert fake_pool.statements()[-1] == (
+        "update `order` set "
+        "`status`=case `id` when 1 then 3 when 2 then 4 end,"
+        "`note`=case `id` when 1 then 'ok' when 2 then NULL end "
+        "where `id` in (1,2)"
+    )
+    assert rowcount == 4
+
+
+def test_update_many_splits_by_max_rows(fake_pool):
+    db.update_many("order", "id", ["status"], [(i, 3) for i in range(5)], max_rows=2)
+    assert [statement.split(" where ")[1] for statement in fake_pool.statements()[1:]] == [
+        "`id` in (0,1)", "`id` in (2,3)", "`id` in (4)",
+    ]
+
+
+def test_failed_chunk_rolls_back_and_keeps_earlier_commits(fake_pool):
+    fake_pool.fail_on = "(2),(3)"
+    with pytest.raises(pymysql.err.OperationalError):
+        db.insert_many("t", ["v"], [(i,) for i in range(6)], max_rows=2)
+    operations = [entry[0] for entry in fake_pool.log if entry[0] != "execute"]
+    assert operations == ["commit", "rollback"]
+    # 后续分块不再执行，连接归还连接池
+    assert fake_pool.statements()[-1] == "insert into `t` (`v`) values (2),(3)"
+    assert all(conn.closed for conn in fake_pool.connections)
+
+
+def test_transaction_execute_many(fake_pool):
+    with db.transaction() as tx:
+        assert tx.execute_many("insert into `t` (`v`) values (%s)", []) == 0
+        assert fake_pool.connections == []
+        assert tx.execute_many("insert into `t` (`v`) values (%s)", [(1,), (2,)]) == 2
+    assert fake_pool.log == [
+        ("begin",),
+        ("executemany", "insert into `t` (`v`) values (%s)", [(1,), (2,)]),
+        ("commit",),
+    ]
@@ -0,0 +1,51 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+查询统计：语句回调覆盖模块级函数、批量写入与事务内的语句
+"""
+import pytest
+
+from utils import db
+
+
+@pytest.fixture
+def observed(monkeypatch):
+    statements = []
+    monkeypatch.setattr(db.QUERY_STATS, "observers", [lambda statement, elapsed, error: statements.append(
+        (statement, error)
+    )])
+    return statements
+
+
+def test_observers_see_every_statement(fake_pool, observed):
+    db.update_one("update `order` set `status`=%s where `id`=%s", [3, 1])
+    db.update_many("order", "id", ["status"], [(1, 3), (2, 4)])
+    with db.transaction() as tx:
+        tx.fetch_one("select * from `order` where `id`=%s for update", [1])
+        with tx.savepoint():
+            tx.update_one("update `order` set `status`=%s where `id` in (%s,%s)", [3, 1, 2])
+    assert [statement for statement, _ in observed] == [
+        "update `order` set `status`=? where `id`=?",
+        "select @@max_allowed_packet as `packet`",
+        "update `order` set `status`=case `id` when ? then ? end where `id` in (...)",
+        "select * from `order` where `id`=? for update",
+        "savepoint sp_1",
+        "update `order` set `status`=? where `id` in (...)",
+        "release savepoint sp_1",
+    ]
+
+
+def test_observers_see_errors(fake_pool, observed):
+    fake_pool.fail_on = "`t`"
+    with pytest.raises(Exception):
+        db.delete_one("delete from `t` where `id`=%s", [1])
+    assert observed == [("delete from `t` where `id`=?", True)]
+
+
+def test_normalize_sql_drops_truncated_literals(monkeypatch):
+    monkeypatch.setattr(db, "QUERY_STATS_SQL_PREFIX", 48)
+    sql = "insert into `t` (`a`,`b`) values (1,'x'),(2,'secret-token-abcdef')"
+    assert db.normalize_sql(sql) == "insert into `t` (`a`,`b`) values (...),(?,?"
+    assert db.normalize_sql("select * from `t` where `a`='it''s' and `b`='x\\'") == (
+        "select * from `t` where `a`=? and `b`=?"
+    )
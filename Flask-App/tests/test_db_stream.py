@@ -0,0 +1,95 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+流式读取：三种行类型、分块大小，以及提前退出或生成器关闭时归还连接
+"""
+import gc
+
+import pytest
+from pymysql import cursors
+
+from utils import db
+
+ROWS = [{"id": i, "name": f"n{i}"} for i in range(1, 6)]
+
+
+@pytest.fixture
+def rows_pool(fake_pool):
+    fake_pool.rows = ROWS
+    return fake_pool
+
+
+def _cursor(pool):
+    return pool.connections[-1].cursors[-1]
+
+
+def test_dict_rows(rows_pool):
+    chunks = list(db.fetch_chunks("select `id`, `name` from `t`", None, chunk_size=2))
+    assert chunks == [ROWS[:2], ROWS[2:4], ROWS[4:]]
+    assert _cursor(rows_pool).cursor_class is cursors.SSDictCursor
+
+
+def test_tuple_rows(rows_pool):
+    chunks = list(db.fetch_chunks("select `id`, `name` from `t`", None, chunk_size=3, row_type="tuple"))
+    assert chunks == [[(1, "n1"), (2, "n2"), (3, "n3")], [(4, "n4"), (5, "n5")]]
+    assert _cursor(rows_pool).cursor_class is cursors.SSCursor
+
+
+def test_namedtuple_rows(rows_pool):
+    rows = list(db.fetch_iter("select `id`, `name` from `t`", None, chunk_size=2, row_type="namedtuple"))
+    assert [(row.id, row.name) for row in rows] == [(row["id"], row["name"]) for row in ROWS]
+    assert rows[0] == (1, "n1")
+    assert _cursor(rows_pool).cursor_class is cursors.SSCursor
+
+
+def test_invalid_row_type(rows_pool):
+    with pytest.raises(ValueError):
+        next(db.fetch_chunks("select 1", None, row_type="list"))
+    assert rows_pool.connections == []
+
+
+def test_released_after_exhausted(rows_pool):
+    assert sum(len(rows) for rows in db.fetch_chunks("select `id` from `t`", None, chunk_size=2)) == 5
+    assert _cursor(rows_pool).closed
+    assert rows_pool.connections[-1].closed
+
+
+def test_released_on_early_break(rows_pool):
+    def first_chunk():
+        for rows in db.fetch_chunks("select `id` from `t`", None, chunk_size=2):
+            return rows
+
+    assert first_chunk() == ROWS[:2]
+    gc.collect()
+    assert _cursor(rows_pool).closed
+    assert rows_pool.connections[-1].closed
+
+
+def test_released_on_generator_close(rows_pool):
+    chunks = db.fetch_chunks("select `id` from `t`", None, chunk_size=2)
+    assert next(chunks) == ROWS[:2]
+    assert not rows_pool.connections[-1].closed
+    chunks.close()
+    assert _cursor(rows_pool).closed
+    assert rows_pool.connections[-1].closed
+
+
+def test_released_on_error(rows_pool):
+    rows_pool.fail_on = "from `t`"
+    with pytest.raises(Exception):
+        next(db.fetch_chunks("select `id` from `t`", None))
+    assert _cursor(rows_pool).closed
+    assert rows_pool.connections[-1].closed
+
+
+def test_streamed_rows_are_counted(rows_pool):
+    before = _statement_rows("select `id` from `t` where `id`>?")
+    list(db.fetch_chunks("select `id` from `t` where `id`>%s", [0], chunk_size=2))
+    assert _statement_rows("select `id` from `t` where `id`>?") - before == 5
+
+
+def _statement_rows(statement):
+    for item in db.query_stats()["statements"]:
+        if item["statement"] == statement:
+            return item["rows"]
+    return 0
@@ -0,0 +1,125 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+事务：提交与回滚、保存点语句顺序、嵌套保存点、延迟取连接
+"""
+import pytest
+
+from utils import db
+
+
+def _operations(pool):
+    return [entry[1] if entry[0] == "execute" else entry[0] for entry in pool.log]
+
+
+def test_commit(fake_pool):
+    fake_pool.on_execute = lambda sql: (1, 7 if sql.startswith("insert") else 0)
+    with db.transaction() as tx:
+        assert tx.insert_one("insert into `t` (`v`) values (%s)", [1]) == 7
+        assert tx.update_one("update `t` set `v`=%s where `id`=%s", [2, 7]) == 1
+    assert _operations(fake_pool) == [
+        "begin",
+        "insert into `t` (`v`) values (1)",
+        "update `t` set `v`=2 where `id`=7",
+        "commit",
+    ]
+    # 一个事务只取一次连接，结束后归还
+    assert len(fake_pool.connections) == 1
+    assert fake_pool.connections[0].closed
+
+
+def test_rollback_on_error(fake_pool):
+    with pytest.raises(RuntimeError):
+        with db.transaction() as tx:
+            tx.delete_one("delete from `t` where `id`=%s", [1])
+            raise RuntimeError("boom")
+    assert _operations(fake_pool) == ["begin", "delete from `t` where `id`=1", "rollback"]
+    assert fake_pool.connections[0].closed
+
+
+def test_empty_transaction_takes_no_connection(fake_pool):
+    with db.transaction():
+        pass
+    assert fake_pool.connections == []
+    assert fake_pool.log == []
+
+
+def test_fetch_inside_transaction(fake_pool):
+    fake_pool.rows = [{"id": 1, "status": 1}]
+    with db.transaction() as tx:
+        assert tx.fetch_one("select * from `order` where `id`=%s for update", [1]) == {"id": 1, "status": 1}
+        assert tx.fetch_all("select * from `order`", None) == [{"id": 1, "status": 1}]
+    assert _operations(fake_pool)[-1] == "commit"
+
+
+def test_savepoint_release(fake_pool):
+    with db.transaction() as tx:
+        with tx.savepoint():
+            tx.update_one("update `t` set `v`=1", None)
+    assert _operations(fake_pool) == [
+        "begin", "savepoint sp_1", "update `t` set `v`=1", "release savepoint sp_1", "commit",
+    ]
+
+
+def test_savepoint_rollback_keeps_transaction(fake_pool):
+    with db.transaction() as tx:
+        tx.update_one("update `t` set `v`=1", None)
+        with pytest.raises(ValueError):
+            with tx.savepoint():
+                tx.update_one("update `t` set `v`=2", None)
+                raise ValueError("bad row")
+        tx.update_one("update `t` set `v`=3", None)
+    assert _operations(fake_pool) == [
+        "begin",
+        "update `t` set `v`=1",
+        "savepoint sp_1",
+        "update `t` set `v`=2",
+        "rollback to savepoint sp_1",
+        "update `t` set `v`=3",
+        "commit",
+    ]
+
+
+def test_nested_savepoints(fake_pool):
+    with db.transaction() as tx:
+        with tx.savepoint():
+            tx.update_one("update `t` set `v`=1", None)
+            with pytest.raises(ValueError):
+                with tx.savepoint():
+                    tx.update_one("update `t` set `v`=2", None)
+                    raise ValueError("inner")
+            with tx.savepoint():
+                tx.update_one("update `t` set `v`=3", None)
+    assert _operations(fake_pool) == [
+        "begin",
+        "savepoint sp_1",
+        "update `t` set `v`=1",
+        "savepoint sp_2",
+        "update `t` set `v`=2",
+        "rollback to savepoint sp_2",
+        "savepoint sp_3",
+        "update `t` set `v`=3",
+        "release savepoint sp_3",
+        "release savepoint sp_1",
+        "commit",
+    ]
+
+
+def test_error_escaping_savepoint_rolls_back_transaction(fake_pool):
+    with pytest.raises(ValueError):
+        with db.transaction() as tx:
+            with tx.savepoint():
+                tx.update_one("update `t` set `v`=1", None)
+                raise ValueError("fatal")
+    assert _operations(fake_pool)[-2:] == ["rollback to savepoint sp_1", "rollback"]
+    assert fake_pool.connections[0].closed
+
+
+def test_failed_statement_rolls_back(fake_pool):
+    fake_pool.fail_on = "`v`=2"
+    with pytest.raises(Exception):
+        with db.transaction() as tx:
+            tx.update_one("update `t` set `v`=1", None)
+            tx.update_one("update `t` set `v`=2", None)
+    assert _operations(fake_pool)[-1] == "rollback"
+    assert fake_pool.connections[0].closed
@@ -0,0 +1,209 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Description:
+http 执行器：基于替身 HTTP 服务验证成功/失败计数与主机之间的隔离（线程版与 asyncio 版）
+"""
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from utils import task_executor
+
+
+@pytest.fixture
+def stub():
+    """按参数启动替身服务，测试结束后全部停止"""
+    servers = []
+
+    def start(delay=0.0, status=200):
+        server = task_executor.serve_stub(0, delay=delay, status=status)
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/task"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def executor():
+    executor = task_executor.HttpExecutor(timeout=5, host_concurrency=2, max_workers=8)
+    yield executor
+    executor.close()
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_success_counts_and_progress(stub, executor):
+    url = stub()
+    progressed = []
+    result = executor.execute(url, 20, progressed.append)
+    assert (result.succeeded, result.failed) == (20, 0)
+    assert result.statuses == {200: 20}
+    assert sum(progressed) == 20
+    assert result.ok
+
+
+def test_failures_are_counted(stub, executor):
+    result = executor.execute(stub(status=500), 5)
+    assert (result.succeeded, result.failed) == (0, 5)
+    assert result.statuses == {500: 5}
+    assert not result.ok
+
+    result = executor.execute(f"http://127.0.0.1:{_closed_port()}/", 3)
+    assert result.failed == 3
+    assert result.statuses == {"ConnectionRefusedError": 3}
+
+    result = executor.execute("ftp://127.0.0.1/", 2)
+    assert result.statuses == {"InvalidURL": 2}
+
+
+def test_host_concurrency_limit(executor):
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    pool = executor._pool("http", "example", "example", None)
+
+    def fake_request(method, path, headers):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return 200
+
+    pool.request = fake_request
+    result = executor.execute("http://example/", 10)
+    assert result.succeeded == 10
+    assert peak[0] == 2
+
+
+def test_slow_host_does_not_block_other_hosts(stub, executor):
+    slow, fast = stub(delay=0.5), stub()
+    slow_result = {}
+    thread = threading.Thread(target=lambda: slow_result.update(result=executor.execute(slow, 8)))
+    thread.start()
+    time.sleep(0.1)  # 慢主机的名额已占满、其余请求在等待
+
+    started = time.perf_counter()
+    result = executor.execute(fast, 20)
+    elapsed = time.perf_counter() - started
+    thread.join()
+
+    assert result.succeeded == 20
+    assert elapsed < 0.5
+    assert slow_result["result"].succeeded == 8
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+async def _execute_async(executor, url, count, progress=None):
+    try:
+        return await executor.execute_async(url, count, progress)
+    finally:
+        await executor.close_async()
+
+
+def test_async_success_and_connection_reuse(stub, executor):
+    url = stub()
+    progressed = []
+
+    async def main():
+        try:
+            result = await executor.execute_async(url, 30, progressed.append)
+            # 请求结束后连接留在连接池中复用，数量不超过主机并发上限
+            idle = [len(pool._idle) for pool in executor._async_pools.values()]
+            return result, idle
+        finally:
+            await executor.close_async()
+
+    result, idle = _run(main())
+    assert (result.succeeded, result.failed) == (30, 0)
+    assert result.statuses == {200: 30}
+    assert sum(progressed) == 30
+    assert idle == [2]
+
+
+def test_async_failures_are_counted(stub, executor):
+    result = _run(_execute_async(executor, stub(status=503), 4))
+    assert result.statuses == {503: 4}
+    assert not result.ok
+
+    result = _run(_execute_async(executor, f"http://127.0.0.1:{_closed_port()}/", 3))
+    assert result.statuses == {"ConnectionRefusedError": 3}
+
+    result = _run(_execute_async(executor, "ftp://127.0.0.1/", 2))
+    assert result.statuses == {"InvalidURL": 2}
+
+
+def test_async_timeout(stub):
+    executor = task_executor.HttpExecutor(timeout=0.2, host_concurrency=2)
+    try:
+        result = _run(_execute_async(executor, stub(delay=1), 2))
+    finally:
+        executor.close()
+    assert result.statuses == {"TimeoutError": 2}
+
+
+def test_async_slow_host_does_not_block_other_hosts(stub, executor):
+    slow, fast = stub(delay=0.5), stub()
+
+    async def main():
+        try:
+            slow_task = asyncio.create_task(executor.execute_async(slow, 8))
+            await asyncio.sleep(0.1)
+            started = time.perf_counter()
+            result = await executor.execute_async(fast, 20)
+            elapsed = time.perf_counter() - started
+            return result, elapsed, await slow_task
+        finally:
+            await executor.close_async()
+
+    result, elapsed, slow_result = _run(main())
+    assert result.succeeded == 20
+    assert elapsed < 0.5
+    assert slow_result.succeeded == 8
+
+
+def test_async_chunked_and_close_delimited_bodies():
+    responses = [
+        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nok\r\n0\r\n\r\n",
+        b"HTTP/1.0 201 Created\r\n\r\nbody until close",
+    ]
+
+    async def handle(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        response = responses.pop(0)
+        writer.write(response)
+        await writer.drain()
+        if response.startswith(b"HTTP/1.0"):
+            writer.close()
+            return
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(responses.pop(0))
+        await writer.drain()
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+        executor = task_executor.HttpExecutor(timeout=2, host_concurrency=1)
+        try:
+            return await _execute_async(executor, url, 2)
+        finally:
+            executor.close()
+            server.close()
+            await server.wait_closed()
+
+    result = _run(main())
+    assert result.statuses == {200: 1, 201: 1}
@@ -0,0 +1,80 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-09-20 10:12:37 @PyCharm
+Description: 
+db 模块的 asyncio 版本，供异步 worker 使用
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import aiomysql
+
+from utils.db import MYSQL_CONN_PARAMS
+
+AIO_MYSQL_POOL_PARAMS = {
+    'minsize': 2,
+    'maxsize': 20,  # 异步连接池最大连接数，DB 操作很短，少量连接即可支撑大量并发订单
+    'autocommit': False,
+    'pool_recycle': 3600,  # 连接回收时间（秒）
+}
+
+
+# 异步连接池需在事件循环内创建，单例模式：
+class AioMySQLPool:
+    _instance = None
+
+    @classmethod
+    async def get_instance(cls) -> aiomysql.Pool:
+        """获取连接池实例"""
+        if cls._instance is None:
+            cls._instance = await aiomysql.create_pool(**AIO_MYSQL_POOL_PARAMS, **MYSQL_CONN_PARAMS)
+        return cls._instance
+
+    @classmethod
+    async def close(cls):
+        """关闭连接池"""
+        if cls._instance is not None:
+            cls._instance.close()
+            await cls._instance.wait_closed()
+            cls._instance = None
+
+
+async def fetch_one(sql, param) -> dict | None:
+    pool = await AioMySQLPool.get_instance()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, param)
+            return await cursor.fetchone()
+
+async def fetch_all(sql, param) -> list[dict] | None:
+    pool = await AioMySQLPool.get_instance()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, param)
+            return await cursor.fetchall()
+
+async def insert_one(sql, param):
+    pool = await AioMySQLPool.get_instance()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, param)
+            await conn.commit()
+            return cursor.lastrowid
+
+async def update_one(sql, param):
+    pool = await AioMySQLPool.get_instance()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, param)
+            await conn.commit()
+
+async def delete_one(sql, param):
+    pool = await AioMySQLPool.get_instance()
+    async with pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(sql, param)
+            await conn.commit()
@@ -12,10 +12,19 @@ Description:
 Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
 """
 import os
+import time
+import zlib
 import redis
+import socket
+import asyncio
 import platform
+import threading
 import subprocess
+from collections import defaultdict, deque
 from redis import ConnectionPool
+from redis import asyncio as aioredis
+
+from utils import message
 
 REDIS_INSTALL_PATH = r"F:\Redis-x64-3.2.100"
 REDIS_SERVER_EXE = os.path.join(REDIS_INSTALL_PATH, "redis-server")
@@ -29,6 +38,22 @@ REDIS_CONNPOOL_PARAMS = {
     'max_connections': 10  # 连接池最大连接数
 }
 
+# 任务队列后端：list: Redis 列表；stream: Redis Streams 消费组（需 Redis >= 6.2，支持多节点按消费者统计与空闲回收）
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "list")
+STREAM_GROUP = "task_workers"  # 消费组名称
+STREAM_CONSUMER = f"{socket.gethostname()}:{os.getpid()}"  # 未指定 worker 时使用的消费者名称
+
+# 任务调度：fifo: 单一先进先出队列；fair: 按 user_identity 拆分子队列轮询出队，并提供高优先级通道（仅 list 后端）
+QUEUE_SCHEDULER = os.environ.get("QUEUE_SCHEDULER", "fifo")
+FAIR_DEFAULT_WEIGHT = 1  # 用户默认权重：每轮连续出队的订单数
+
+# 队列分片数：大于 1 时按订单标识哈希到多个列表，分散单个热点键的竞争（仅 list 后端 + fifo 调度）
+QUEUE_SHARDS = int(os.environ.get("QUEUE_SHARDS", "1"))
+# 额外的分片节点连接参数（覆盖 REDIS_CONNPOOL_PARAMS 中的同名项），分片 i 位于节点 i % (len + 1)，节点 0 为默认节点
+REDIS_SHARD_NODES = [
+    # {'host': '127.0.0.1', 'port': 6380},
+]
+
 
 # 一般一个项目仅需一个连接池，单例模式的连接池：
 class RedisPool:
@@ -45,6 +70,29 @@ def get_conn():
     conn = redis.Redis(connection_pool=RedisPool.get_instance())
     return conn
 
+
+class AsyncRedisPool:
+    """asyncio 连接池，需在事件循环内使用"""
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """获取异步连接池实例"""
+        if cls._instance is None:
+            cls._instance = aioredis.ConnectionPool(**REDIS_CONNPOOL_PARAMS)
+        return cls._instance
+
+    @classmethod
+    async def close(cls):
+        """关闭异步连接池"""
+        if cls._instance is not None:
+            await cls._instance.disconnect()
+            cls._instance = None
+
+def get_async_conn():
+    conn = aioredis.Redis(connection_pool=AsyncRedisPool.get_instance())
+    return conn
+
 def check_redis_service_status() -> (bool, str):
     """通过 Windows 的 sc 命令检查 Redis 服务状态（兼容旧版本）"""
     try:
@@ -115,15 +163,100 @@ def start_redis_service():
         return False
 
 
-def push_queue(value, key):
-    """入队"""
+def _use_fair():
+    return QUEUE_SCHEDULER == "fair" and QUEUE_BACKEND != "stream"
+
+
+def _use_shards():
+    return QUEUE_SHARDS > 1 and QUEUE_BACKEND != "stream" and not _use_fair()
+
+
+def push_queue(value, key, priority=False, dedup=True):
+    """
+    入队
+    :param priority: 是否进入高优先级通道（fifo 调度时插入队首）
+    :param dedup: 是否跳过已在队列中（含处理中、等待重试）的任务
+    :return: 是否入队
+    """
+    return push_queue_many([value], key, priority, dedup) == 1
+
+
+def push_queue_many(values, key, priority=False, dedup=True):
+    """
+    批量入队
+    :param dedup: 是否跳过已在队列中（含处理中、等待重试）的任务；False 时仍登记任务，用于对账补齐
+    :return: 入队的元素个数
+    """
+    if not values:
+        return 0
     conn = redis.Redis(connection_pool=RedisPool.get_instance())
-    conn.lpush(key, value)
+    values = _mark_queued(conn, key, values, dedup)
+    if not values:
+        return 0
+    if QUEUE_BACKEND == "stream":
+        _stream_push(conn, key, values)
+    elif _use_fair():
+        _fair_push(conn, key, values, priority)
+    elif _use_shards():
+        _shard_push(key, values, priority)
+    elif priority:
+        conn.rpush(key, *values)
+    else:
+        conn.lpush(key, *values)
+    return len(values)
+
+
+def queue_lists(key):
+    """list 后端下承载队列元素的全部列表（fair 调度时包含高优先级通道与各用户子队列，分片时为各分片）"""
+    if _use_shards():
+        return [shard_key(key, index) for index in range(QUEUE_SHARDS)]
+    if not _use_fair():
+        return [key]
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    users = conn.lrange(fair_ring_key(key), 0, -1)
+    return [fair_high_key(key), key, *[fair_user_key(key, user) for user in users]]
+
+
+def queue_items(key):
+    """队列中尚未被取走的元素"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return [fields["value"] for _, fields in conn.xrange(stream_key(key))]
+    if _use_shards():
+        return [item for items in _shard_each_node(key, "lrange", 0, -1) for item in items]
+    pipe = conn.pipeline(transaction=False)
+    for name in queue_lists(key):
+        pipe.lrange(name, 0, -1)
+    return [item for items in pipe.execute() for item in items]
+
+
+def queue_length(key):
+    """队列长度"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return conn.xlen(stream_key(key))
+    if _use_shards():
+        return sum(_shard_each_node(key, "llen"))
+    if not _use_fair():
+        return conn.llen(key)
+    pipe = conn.pipeline(transaction=False)
+    for name in queue_lists(key):
+        pipe.llen(name)
+    return sum(pipe.execute())
 
 
 def pop_queue(key, timeout=10):
     """出队"""
     conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        items = _stream_pop_noack(conn, key, 1, timeout)
+        return items[0] if items else None
+    if _use_fair():
+        items = _fair_pop(conn, key, 1, timeout)
+        return items[0] if items else None
+    if _use_shards():
+        items = _shard_pop(key, 1, timeout)
+        return items[0] if items else None
     data = conn.brpop(key, timeout=timeout)
     # print(data)
     if not data:
@@ -132,6 +265,1583 @@ def pop_queue(key, timeout=10):
     return data[1]
 
 
+def pop_queue_batch(key, count, timeout=10):
+    """
+    批量出队：一次网络往返取出最多 count 个元素
+    :param key: 队列名称
+    :param count: 单次最多取出的元素个数
+    :param timeout: 队列为空时的阻塞等待时间（秒）
+    :return: 元素列表，队列为空时返回空列表
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return _stream_pop_noack(conn, key, count, timeout)
+    if _use_fair():
+        return _fair_pop(conn, key, count, timeout)
+    if _use_shards():
+        return _shard_pop(key, count, timeout)
+    # 1.管道批量 RPOP，兼容不支持 RPOP count / LMPOP 的旧版本 Redis
+    pipe = conn.pipeline(transaction=False)
+    for _ in range(count):
+        pipe.rpop(key)
+    items = [item for item in pipe.execute() if item is not None]
+    if items:
+        return items
+    # 2.队列为空时阻塞等待第一个元素，避免空转
+    data = conn.brpop(key, timeout=timeout)
+    if not data:
+        return []
+    items = [data[1]]
+    if count > 1:
+        pipe = conn.pipeline(transaction=False)
+        for _ in range(count - 1):
+            pipe.rpop(key)
+        items.extend(item for item in pipe.execute() if item is not None)
+    return items
+
+
+# ---------------- 可靠队列：处理中列表 + 租约 + 确认 ----------------
+# 出队时原子地把元素移入 worker 自己的处理中列表，并登记租约（到期时间）；
+# 处理完成后确认（从处理中列表与租约中移除）；租约到期或 worker 心跳丢失时，由回收器放回任务队列。
+
+# 回收租约已到期的元素
+# KEYS[1]: 任务队列 KEYS[2]: 租约有序集合 ARGV[1]: 当前时间 ARGV[2]: 单次回收上限
+# 返回: {放回队列的个数, 本次处理的租约个数}
+LUA_REQUEUE_EXPIRED = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local count = 0
+for _, member in ipairs(expired) do
+    local sep = string.find(member, '|', 1, true)
+    local processing = string.sub(member, 1, sep - 1)
+    local value = string.sub(member, sep + 1)
+    if redis.call('LREM', processing, 1, value) > 0 then
+        redis.call('RPUSH', KEYS[1], value)
+        count = count + 1
+    end
+    redis.call('ZREM', KEYS[2], member)
+end
+return {count, #expired}
+"""
+
+# 回收失联 worker 的整个处理中列表
+# KEYS[1]: 任务队列 KEYS[2]: 处理中列表 KEYS[3]: 租约有序集合
+# 返回: 放回队列的元素列表
+LUA_REQUEUE_PROCESSING = """
+local moved = {}
+local value = redis.call('RPOP', KEYS[2])
+while value do
+    redis.call('RPUSH', KEYS[1], value)
+    redis.call('ZREM', KEYS[3], KEYS[2] .. '|' .. value)
+    moved[#moved + 1] = value
+    value = redis.call('RPOP', KEYS[2])
+end
+return moved
+"""
+
+
+def processing_key(key, worker_id):
+    """worker 的处理中列表"""
+    return f"{key}:processing:{worker_id}"
+
+
+def lease_key(key):
+    """租约有序集合：member 为 '处理中列表|元素'，score 为租约到期时间"""
+    return f"{key}:leases"
+
+
+def workers_key(key):
+    """登记过的 worker 集合"""
+    return f"{key}:workers"
+
+
+def heartbeat_key(key, worker_id):
+    """worker 心跳，过期即视为失联"""
+    return f"{key}:heartbeat:{worker_id}"
+
+
+def pop_queue_reliable(key, worker_id, timeout=10, visibility_timeout=60):
+    """
+    可靠出队：元素原子地移入处理中列表并登记租约，处理完成后需调用 ack_queue 确认
+    :param key: 队列名称
+    :param worker_id: worker 标识
+    :param timeout: 队列为空时的阻塞等待时间（秒）
+    :param visibility_timeout: 租约时长（秒），到期未确认的元素会被回收器放回队列
+    :return: 元素，队列为空时返回 None
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return _stream_pop_reliable(conn, key, worker_id, timeout)
+    if _use_shards():
+        return _shard_pop_reliable(key, worker_id, timeout, visibility_timeout)
+    processing = processing_key(key, worker_id)
+    if _use_fair():
+        items = _fair_pop(conn, key, 1, timeout, processing)
+        value = items[0] if items else None
+    else:
+        value = conn.brpoplpush(key, processing, timeout=timeout)
+    if value is None:
+        return None
+    conn.zadd(lease_key(key), {f"{processing}|{value}": time.time() + visibility_timeout})
+    return value
+
+
+def ack_queue(key, worker_id, value):
+    """确认元素已处理完成"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return _stream_ack(conn, key, worker_id, value)
+    if _use_shards():
+        index = _shard_take(key, worker_id, value)
+        conn, key = _shard_conn(index), shard_key(key, index)
+    processing = processing_key(key, worker_id)
+    pipe = conn.pipeline(transaction=True)
+    pipe.lrem(processing, 1, value)
+    pipe.zrem(lease_key(key), f"{processing}|{value}")
+    pipe.execute()
+
+
+def extend_lease(key, worker_id, values, visibility_timeout=60):
+    """为处理中的元素续约，仅更新仍登记在租约中的元素"""
+    if not values:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return _stream_touch(conn, key, worker_id, values)
+    deadline = time.time() + visibility_timeout
+    for shard_conn, name, shard_values in _shard_group_inflight(key, worker_id, values):
+        processing = processing_key(name, worker_id)
+        shard_conn.zadd(lease_key(name), {f"{processing}|{value}": deadline for value in shard_values}, xx=True)
+
+
+def heartbeat(key, worker_id, ttl):
+    """登记 worker 并刷新心跳"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    pipe.sadd(workers_key(key), worker_id)
+    pipe.set(heartbeat_key(key, worker_id), 1, ex=ttl)
+    pipe.execute()
+
+
+def unregister_worker(key, worker_id):
+    """worker 正常退出时注销，处理中列表应已为空"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        # 未确认的消息留在消费组的待确认列表中，由回收器按空闲时长认领
+        if not _stream_pending_count(conn, key, worker_id):
+            conn.xgroup_delconsumer(stream_key(key), STREAM_GROUP, worker_id)
+    else:
+        for shard_conn, name in _queue_shards(key):
+            moved = shard_conn.register_script(LUA_REQUEUE_PROCESSING)(
+                keys=[name, processing_key(name, worker_id), lease_key(name)]
+            )
+            _drop_claims(conn, key, moved)
+    pipe = conn.pipeline(transaction=False)
+    pipe.delete(heartbeat_key(key, worker_id))
+    pipe.srem(workers_key(key), worker_id)
+    pipe.execute()
+
+
+def requeue_expired(key, limit=100, visibility_timeout=60):
+    """
+    回收租约到期的元素，开销与在途元素数量成正比
+    :param visibility_timeout: 仅 stream 后端使用，消息空闲超过该时长（秒）视为到期；list 后端以租约登记的到期时间为准
+    :return: 放回队列的元素个数
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    if QUEUE_BACKEND == "stream":
+        return _stream_requeue_idle(conn, key, visibility_timeout, limit)
+    total = 0
+    for shard_conn, name in _queue_shards(key):
+        script = shard_conn.register_script(LUA_REQUEUE_EXPIRED)
+        while True:
+            count, scanned = script(keys=[name, lease_key(name)], args=[time.time(), limit])
+            total += count
+            if scanned < limit:
+                break
+    return total
+
+
+def requeue_dead_workers(key):
+    """
+    回收心跳已过期的 worker 的处理中列表（含出队后、登记租约前就退出的元素），
+    同时删除这些任务的认领，放回的消息可以立即被其它 worker 认领
+    :return: 放回队列的元素个数
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    total = 0
+    for worker_id in conn.smembers(workers_key(key)):
+        if conn.exists(heartbeat_key(key, worker_id)):
+            continue
+        if QUEUE_BACKEND == "stream":
+            # 失联消费者的待确认消息会随空闲时长增长被 requeue_expired 回收，此处仅在回收完成后清理消费者
+            if _stream_pending_count(conn, key, worker_id):
+                continue
+            conn.xgroup_delconsumer(stream_key(key), STREAM_GROUP, worker_id)
+        else:
+            for shard_conn, name in _queue_shards(key):
+                moved = shard_conn.register_script(LUA_REQUEUE_PROCESSING)(
+                    keys=[name, processing_key(name, worker_id), lease_key(name)]
+                )
+                _drop_claims(conn, key, moved)
+                total += len(moved)
+        conn.srem(workers_key(key), worker_id)
+    return total
+
+
+# ---------------- fair 调度：按用户拆分子队列，加权轮询出队 ----------------
+# 出队顺序：高优先级通道 -> 基础队列（旧生产者写入、回收器放回的订单）-> 各用户子队列轮询。
+# 轮转列表记录有待处理订单的用户，右端为当前用户；用户连续出队达到权重后轮转到左端（加权轮询 / 赤字轮询），
+# 子队列为空时移出轮转列表。入队与出队均为 Lua 脚本，保证轮转状态与子队列一致。
+
+# KEYS[1]: 轮转列表 KEYS[2]: 活跃用户集合 KEYS[3]: 唤醒列表
+# ARGV[1]: 用户子队列键名前缀 ARGV[2..]: 用户、元素交替排列
+LUA_FAIR_PUSH = """
+for i = 2, #ARGV, 2 do
+    local user = ARGV[i]
+    redis.call('LPUSH', ARGV[1] .. user, ARGV[i + 1])
+    if redis.call('SADD', KEYS[2], user) == 1 then
+        redis.call('LPUSH', KEYS[1], user)
+    end
+end
+redis.call('LPUSH', KEYS[3], 1)
+redis.call('LTRIM', KEYS[3], 0, 999)
+return #ARGV / 2
+"""
+
+# KEYS[1]: 高优先级通道 KEYS[2]: 基础队列 KEYS[3]: 轮转列表 KEYS[4]: 活跃用户集合 KEYS[5]: 权重哈希 KEYS[6]: 剩余额度哈希
+# ARGV[1]: 用户子队列键名前缀 ARGV[2]: 出队个数 ARGV[3]: 默认权重 ARGV[4]: 处理中列表（为空时不移入）
+LUA_FAIR_POP = """
+local result = {}
+local function take(value)
+    if ARGV[4] ~= '' then
+        redis.call('LPUSH', ARGV[4], value)
+    end
+    result[#result + 1] = value
+end
+local function retire(user)
+    redis.call('RPOP', KEYS[3])
+    redis.call('SREM', KEYS[4], user)
+    redis.call('HDEL', KEYS[6], user)
+end
+local count = tonumber(ARGV[2])
+while #result < count do
+    local value = redis.call('RPOP', KEYS[1])
+    if not value then
+        value = redis.call('RPOP', KEYS[2])
+    end
+    if value then
+        take(value)
+    else
+        local user = redis.call('LINDEX', KEYS[3], -1)
+        if not user then
+            break
+        end
+        local sub_queue = ARGV[1] .. user
+        value = redis.call('RPOP', sub_queue)
+        if not value then
+            retire(user)
+        else
+            take(value)
+            local credit = tonumber(redis.call('HGET', KEYS[6], user) or 0)
+            if credit <= 0 then
+                credit = tonumber(redis.call('HGET', KEYS[5], user) or ARGV[3])
+            end
+            credit = credit - 1
+            if redis.call('LLEN', sub_queue) == 0 then
+                retire(user)
+            elseif credit <= 0 then
+                redis.call('RPOPLPUSH', KEYS[3], KEYS[3])
+                redis.call('HDEL', KEYS[6], user)
+            else
+                redis.call('HSET', KEYS[6], user, credit)
+            end
+        end
+    end
+end
+return result
+"""
+
+
+def fair_high_key(key):
+    """高优先级通道"""
+    return f"{key}:high"
+
+
+def fair_ring_key(key):
+    """轮转列表：有待处理订单的用户"""
+    return f"{key}:fair:ring"
+
+
+def fair_user_key(key, user_identity):
+    """用户子队列"""
+    return f"{key}:fair:user:{user_identity}"
+
+
+def _fair_keys(key):
+    return [
+        fair_high_key(key),
+        key,
+        fair_ring_key(key),
+        f"{key}:fair:active",
+        f"{key}:fair:weights",
+        f"{key}:fair:credits",
+    ]
+
+
+def _fair_signal_key(key):
+    """唤醒列表：入队时写入，空闲的消费者阻塞在该列表上"""
+    return f"{key}:fair:signal"
+
+
+def set_user_weight(key, user_identity, weight):
+    """设置用户权重：每轮连续出队的订单数，权重越大分到的吞吐越多"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.hset(f"{key}:fair:weights", user_identity, int(weight))
+
+
+def _fair_push(conn, key, values, priority):
+    if priority:
+        pipe = conn.pipeline(transaction=False)
+        pipe.lpush(fair_high_key(key), *values)
+        pipe.lpush(_fair_signal_key(key), 1)
+        pipe.ltrim(_fair_signal_key(key), 0, 999)
+        pipe.execute()
+        return
+    args = [fair_user_key(key, "")]
+    for value in values:
+        # 旧格式消息不含用户信息，统一归入空用户
+        args.extend([message.decode_task(value).get("user_identity", ""), value])
+    conn.register_script(LUA_FAIR_PUSH)(
+        keys=[fair_ring_key(key), f"{key}:fair:active", _fair_signal_key(key)], args=args
+    )
+
+
+def _fair_pop(conn, key, count, timeout, processing=""):
+    script = conn.register_script(LUA_FAIR_POP)
+    args = [fair_user_key(key, ""), count, FAIR_DEFAULT_WEIGHT, processing]
+    items = script(keys=_fair_keys(key), args=args)
+    if items:
+        return items
+    # 全部为空时阻塞在唤醒列表上，被唤醒或超时后再尝试一次
+    conn.brpop(_fair_signal_key(key), timeout=timeout)
+    return script(keys=_fair_keys(key), args=args)
+
+
+# ---------------- 分片队列：按订单标识哈希到多个列表，可分布在多个 Redis 节点 ----------------
+# 分片 0 即基础队列（旧生产者写入、延迟重试放回的订单），分片 i 位于节点 i % (len(REDIS_SHARD_NODES) + 1)。
+# worker 优先从负责的分片出队，负责的分片为空时按轮转顺序从其它分片窃取；
+# 全部分片为空时只在负责的分片上阻塞等待，其它分片的新元素最迟在一个等待周期后被窃取。
+# 可靠出队时处理中列表与租约按分片存放（与分片同节点），回收的元素放回原分片。
+
+# 可靠出队的元素所在分片：(队列, worker, 元素) -> 分片下标队列
+_shard_inflight = defaultdict(deque)
+_shard_lock = threading.Lock()
+_home_shards = None
+_steal_cursor = 0
+
+
+class ShardPools:
+    """各分片节点的连接池，节点 0 复用默认连接池"""
+    _instances = {}
+
+    @classmethod
+    def get_instance(cls, node):
+        if node == 0:
+            return RedisPool.get_instance()
+        if node not in cls._instances:
+            cls._instances[node] = ConnectionPool(**{**REDIS_CONNPOOL_PARAMS, **REDIS_SHARD_NODES[node - 1]})
+        return cls._instances[node]
+
+
+def shard_key(key, index):
+    """分片列表，分片 0 即基础队列"""
+    return key if index == 0 else f"{key}:shard:{index}"
+
+
+def shard_node(index):
+    """分片所在节点"""
+    return index % (len(REDIS_SHARD_NODES) + 1)
+
+
+def _node_conn(node):
+    return redis.Redis(connection_pool=ShardPools.get_instance(node))
+
+
+def _shard_conn(index):
+    return _node_conn(shard_node(index))
+
+
+def shard_of(value):
+    """元素所属分片：按订单标识（分块子任务加上分块下标）哈希，旧格式消息按其内容哈希"""
+    try:
+        task = message.decode_task(value)
+        identity = task.get("order_identity") or task.get("id")
+        if message.is_chunk(task):
+            # 同一订单的分块分散到不同分片
+            identity = f"{identity}:{task['chunk']}"
+    except ValueError:
+        identity = value
+    return zlib.crc32(str(identity).encode("utf-8")) % QUEUE_SHARDS
+
+
+def set_home_shards(shards):
+    """
+    指定当前进程负责的分片
+    :param shards: 分片下标列表，None 表示按消费者名称哈希分配一个
+    """
+    global _home_shards
+    if shards:
+        invalid = [index for index in shards if not 0 <= index < QUEUE_SHARDS]
+        if invalid:
+            raise ValueError(f"分片下标超出范围 0~{QUEUE_SHARDS - 1}: {invalid}")
+        shards = list(dict.fromkeys(shards))
+    _home_shards = shards or None
+
+
+def home_shards():
+    """当前进程负责的分片"""
+    if _home_shards:
+        return _home_shards
+    return [zlib.crc32(STREAM_CONSUMER.encode("utf-8")) % QUEUE_SHARDS]
+
+
+def _shard_order():
+    """出队顺序：负责的分片在前，其余分片从轮转游标开始，避免多个 worker 同时窃取同一个分片"""
+    global _steal_cursor
+    home = home_shards()
+    others = [index for index in range(QUEUE_SHARDS) if index not in home]
+    if others:
+        with _shard_lock:
+            _steal_cursor = (_steal_cursor + 1) % len(others)
+            start = _steal_cursor
+        others = others[start:] + others[:start]
+    return home + others
+
+
+def _shard_each_node(key, command, *args):
+    """在各节点上对该节点的全部分片执行只读命令，每个节点一次往返"""
+    names = defaultdict(list)
+    for index in range(QUEUE_SHARDS):
+        names[shard_node(index)].append(shard_key(key, index))
+    results = []
+    for node, node_names in names.items():
+        pipe = _node_conn(node).pipeline(transaction=False)
+        for name in node_names:
+            getattr(pipe, command)(name, *args)
+        results.extend(pipe.execute())
+    return results
+
+
+def _queue_shards(key):
+    """承载任务队列的 (连接, 列表)，未分片时只有基础队列"""
+    if not _use_shards():
+        return [(redis.Redis(connection_pool=RedisPool.get_instance()), key)]
+    return [(_shard_conn(index), shard_key(key, index)) for index in range(QUEUE_SHARDS)]
+
+
+def _shard_push(key, values, priority):
+    """按分片分组，每个节点一次往返"""
+    groups = defaultdict(list)
+    for value in values:
+        groups[shard_of(value)].append(value)
+    nodes = defaultdict(list)
+    for index, items in groups.items():
+        nodes[shard_node(index)].append((shard_key(key, index), items))
+    for node, shards in nodes.items():
+        pipe = _node_conn(node).pipeline(transaction=False)
+        for name, items in shards:
+            if priority:
+                pipe.rpush(name, *items)
+            else:
+                pipe.lpush(name, *items)
+        pipe.execute()
+
+
+def _shard_pop(key, count, timeout):
+    items = []
+    # 1.依次从负责的分片与其它分片非阻塞取出
+    for index in _shard_order():
+        pipe = _shard_conn(index).pipeline(transaction=False)
+        for _ in range(count - len(items)):
+            pipe.rpop(shard_key(key, index))
+        items.extend(item for item in pipe.execute() if item is not None)
+        if len(items) >= count:
+            break
+    if items:
+        return items
+    # 2.全部为空时在负责的分片上阻塞等待（BRPOP 多个键需位于同一节点）
+    home = home_shards()
+    node = shard_node(home[0])
+    conn = _node_conn(node)
+    data = conn.brpop([shard_key(key, index) for index in home if shard_node(index) == node], timeout=timeout)
+    if not data:
+        return []
+    name, item = data
+    items = [item]
+    if count > 1:
+        pipe = conn.pipeline(transaction=False)
+        for _ in range(count - 1):
+            pipe.rpop(name)
+        items.extend(item for item in pipe.execute() if item is not None)
+    return items
+
+
+def _shard_pop_reliable(key, worker_id, timeout, visibility_timeout):
+    for index in _shard_order():
+        name = shard_key(key, index)
+        value = _shard_conn(index).rpoplpush(name, processing_key(name, worker_id))
+        if value is not None:
+            break
+    else:
+        index = home_shards()[0]
+        name = shard_key(key, index)
+        value = _shard_conn(index).brpoplpush(name, processing_key(name, worker_id), timeout=timeout)
+        if value is None:
+            return None
+    processing = processing_key(name, worker_id)
+    _shard_conn(index).zadd(lease_key(name), {f"{processing}|{value}": time.time() + visibility_timeout})
+    with _shard_lock:
+        _shard_inflight[(key, worker_id, value)].append(index)
+    return value
+
+
+def _shard_take(key, worker_id, value):
+    """取出可靠出队时记录的分片，未记录时按元素哈希"""
+    with _shard_lock:
+        indexes = _shard_inflight.get((key, worker_id, value))
+        if not indexes:
+            return shard_of(value)
+        index = indexes.popleft()
+        if not indexes:
+            del _shard_inflight[(key, worker_id, value)]
+        return index
+
+
+def _shard_group_inflight(key, worker_id, values):
+    """按所在分片分组：[(连接, 列表, 元素列表), ...]，未分片时只有基础队列"""
+    if not _use_shards():
+        return [(redis.Redis(connection_pool=RedisPool.get_instance()), key, values)]
+    groups = defaultdict(list)
+    with _shard_lock:
+        for value in values:
+            indexes = _shard_inflight.get((key, worker_id, value))
+            groups[indexes[0] if indexes else shard_of(value)].append(value)
+    return [(_shard_conn(index), shard_key(key, index), items) for index, items in groups.items()]
+
+
+# ---------------- stream 后端：XADD / XREADGROUP / XACK / XAUTOCLAIM ----------------
+# 每个 worker 是消费组中的一个消费者，未确认的消息记录在消费组的待确认列表（PEL）中，
+# 可按消费者统计在途数量，空闲过久的消息由 XAUTOCLAIM 认领后重新投递，无需重启。
+# 确认时同时删除消息，流中只保留未投递与待确认的消息，因此不设 MAXLEN（近似裁剪会丢掉未投递的消息）。
+
+# 已读取未确认的消息编号：(流, 消费者, 元素) -> 消息编号队列
+_stream_inflight = defaultdict(deque)
+_stream_lock = threading.Lock()
+_stream_groups_ready = set()
+
+
+def stream_key(key):
+    """队列对应的流，与 list 后端的键名区分开，避免类型冲突"""
+    return f"{key}:stream"
+
+
+def _stream_ensure_group(conn, key):
+    """创建消费组（流不存在时一并创建）"""
+    skey = stream_key(key)
+    if skey in _stream_groups_ready:
+        return skey
+    try:
+        conn.xgroup_create(skey, STREAM_GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+    _stream_groups_ready.add(skey)
+    return skey
+
+
+def _stream_push(conn, key, values):
+    skey = _stream_ensure_group(conn, key)
+    pipe = conn.pipeline(transaction=False)
+    for value in values:
+        pipe.xadd(skey, {"value": value})
+    pipe.execute()
+
+
+def _stream_read(conn, key, consumer, count, timeout, noack):
+    skey = _stream_ensure_group(conn, key)
+    data = conn.xreadgroup(
+        STREAM_GROUP, consumer, {skey: ">"}, count=count, block=int(timeout * 1000), noack=noack
+    )
+    if not data:
+        return []
+    return data[0][1]
+
+
+def _stream_pop_noack(conn, key, count, timeout):
+    """与 BRPOP 语义一致：取出即删除，不进入待确认列表"""
+    entries = _stream_read(conn, key, STREAM_CONSUMER, count, timeout, noack=True)
+    if not entries:
+        return []
+    conn.xdel(stream_key(key), *[msg_id for msg_id, _ in entries])
+    return [fields["value"] for _, fields in entries]
+
+
+def _stream_pop_reliable(conn, key, worker_id, timeout):
+    entries = _stream_read(conn, key, worker_id, 1, timeout, noack=False)
+    if not entries:
+        return None
+    msg_id, fields = entries[0]
+    value = fields["value"]
+    with _stream_lock:
+        _stream_inflight[(key, worker_id, value)].append(msg_id)
+    return value
+
+
+def _stream_take_id(key, worker_id, value):
+    with _stream_lock:
+        ids = _stream_inflight.get((key, worker_id, value))
+        if not ids:
+            return None
+        msg_id = ids.popleft()
+        if not ids:
+            del _stream_inflight[(key, worker_id, value)]
+        return msg_id
+
+
+def _stream_ack(conn, key, worker_id, value):
+    msg_id = _stream_take_id(key, worker_id, value)
+    if msg_id is None:
+        return
+    skey = stream_key(key)
+    pipe = conn.pipeline(transaction=True)
+    pipe.xack(skey, STREAM_GROUP, msg_id)
+    pipe.xdel(skey, msg_id)
+    pipe.execute()
+
+
+def _stream_touch(conn, key, worker_id, values):
+    """续约：把消息重新认领给自己，重置空闲时长"""
+    with _stream_lock:
+        msg_ids = [msg_id for value in values for msg_id in _stream_inflight.get((key, worker_id, value), ())]
+    if msg_ids:
+        conn.xclaim(stream_key(key), STREAM_GROUP, worker_id, 0, msg_ids, justid=True)
+
+
+def _stream_requeue_idle(conn, key, visibility_timeout, limit):
+    """认领空闲超时的消息，重新投递到流尾部后确认并删除原消息"""
+    skey = _stream_ensure_group(conn, key)
+    total = 0
+    start_id = "0-0"
+    while True:
+        start_id, claimed, *_ = conn.xautoclaim(
+            skey, STREAM_GROUP, STREAM_CONSUMER, int(visibility_timeout * 1000),
+            start_id=start_id, count=limit
+        )
+        claimed = [(msg_id, fields) for msg_id, fields in claimed if fields]
+        if claimed:
+            pipe = conn.pipeline(transaction=True)
+            for msg_id, fields in claimed:
+                pipe.xadd(skey, fields)
+                pipe.xack(skey, STREAM_GROUP, msg_id)
+                pipe.xdel(skey, msg_id)
+            pipe.execute()
+            total += len(claimed)
+        if start_id in ("0-0", b"0-0"):
+            return total
+
+
+def _stream_pending_count(conn, key, consumer):
+    for info in conn.xinfo_consumers(stream_key(key), STREAM_GROUP):
+        if info["name"] == consumer:
+            return info["pending"]
+    return 0
+
+
+def stream_consumers(key):
+    """
+    消费组内各消费者的统计
+    :return: [{'name': 消费者, 'pending': 待确认数, 'idle': 空闲毫秒数}, ...]
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    skey = _stream_ensure_group(conn, key)
+    return [
+        {"name": info["name"], "pending": info["pending"], "idle": info["idle"]}
+        for info in conn.xinfo_consumers(skey, STREAM_GROUP)
+    ]
+
+
+async def async_pop_queue(key, timeout=10):
+    """出队（异步）"""
+    conn = get_async_conn()
+    if QUEUE_BACKEND == "stream":
+        skey = _stream_ensure_group(get_conn(), key)
+        data = await conn.xreadgroup(
+            STREAM_GROUP, STREAM_CONSUMER, {skey: ">"}, count=1, block=int(timeout * 1000), noack=True
+        )
+        if not data:
+            return None
+        msg_id, fields = data[0][1][0]
+        await conn.xdel(skey, msg_id)
+        return fields["value"]
+    if _use_fair():
+        script = conn.register_script(LUA_FAIR_POP)
+        args = [fair_user_key(key, ""), 1, FAIR_DEFAULT_WEIGHT, ""]
+        items = await script(keys=_fair_keys(key), args=args)
+        if not items:
+            await conn.brpop(_fair_signal_key(key), timeout=timeout)
+            items = await script(keys=_fair_keys(key), args=args)
+        return items[0] if items else None
+    if _use_shards():
+        # 分片可能分布在多个节点，在线程中复用同步实现
+        items = await asyncio.to_thread(_shard_pop, key, 1, timeout)
+        return items[0] if items else None
+    data = await conn.brpop(key, timeout=timeout)
+    if not data:
+        return None
+    return data[1]
+
+
+# ---------------- 延迟重试队列：有序集合按到期时间排序，到期后批量放回任务队列 ----------------
+
+# KEYS[1]: 延迟队列 KEYS[2]: 任务队列（列表或流）
+# ARGV[1]: 当前时间 ARGV[2]: 单次上限 ARGV[3]: 后端 list / stream
+LUA_PROMOTE_DUE = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, value in ipairs(due) do
+    if ARGV[3] == 'stream' then
+        redis.call('XADD', KEYS[2], '*', 'value', value)
+    else
+        redis.call('LPUSH', KEYS[2], value)
+    end
+    redis.call('ZREM', KEYS[1], value)
+end
+return #due
+"""
+
+
+def retry_key(key):
+    """延迟重试队列：member 为消息，score 为到期时间"""
+    return f"{key}:retry"
+
+
+def dead_letter_key(key):
+    """死信列表：超过最大重试次数的消息"""
+    return f"{key}:dead"
+
+
+def attempts_key(key):
+    """订单失败次数：订单编号 -> 次数"""
+    return f"{key}:attempts"
+
+
+def read_attempts(key, order_ids):
+    """读取订单失败次数，没有记录时为 0"""
+    if not order_ids:
+        return []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    return [int(count or 0) for count in conn.hmget(attempts_key(key), order_ids)]
+
+
+async def async_read_attempts(key, order_ids):
+    """读取订单失败次数（异步）"""
+    if not order_ids:
+        return []
+    return [int(count or 0) for count in await get_async_conn().hmget(attempts_key(key), order_ids)]
+
+
+def incr_attempts(key, order_ids):
+    """订单失败次数加一，返回加一后的次数列表"""
+    if not order_ids:
+        return []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    for order_id in order_ids:
+        pipe.hincrby(attempts_key(key), order_id, 1)
+    return pipe.execute()
+
+
+async def async_incr_attempts(key, order_ids):
+    """订单失败次数加一（异步）"""
+    if not order_ids:
+        return []
+    pipe = get_async_conn().pipeline(transaction=False)
+    for order_id in order_ids:
+        pipe.hincrby(attempts_key(key), order_id, 1)
+    return await pipe.execute()
+
+
+def clear_attempts(key, order_ids):
+    """清除订单失败次数"""
+    if not order_ids:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.hdel(attempts_key(key), *order_ids)
+
+
+async def async_clear_attempts(key, order_ids):
+    """清除订单失败次数（异步）"""
+    if not order_ids:
+        return
+    await get_async_conn().hdel(attempts_key(key), *order_ids)
+
+
+def schedule_retry(key, due_map):
+    """
+    加入延迟重试队列
+    :param due_map: {消息: 到期时间戳}
+    """
+    if not due_map:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.zadd(retry_key(key), due_map)
+
+
+async def async_schedule_retry(key, due_map):
+    """加入延迟重试队列（异步）"""
+    if not due_map:
+        return
+    await get_async_conn().zadd(retry_key(key), due_map)
+
+
+def dead_letter(key, values):
+    """加入死信列表"""
+    if not values:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.lpush(dead_letter_key(key), *values)
+
+
+async def async_dead_letter(key, values):
+    """加入死信列表（异步）"""
+    if not values:
+        return
+    await get_async_conn().lpush(dead_letter_key(key), *values)
+
+
+def promote_due_retries(key, limit=100):
+    """
+    把到期的重试消息放回任务队列（基础队列，fair 调度时优先出队，分片时即分片 0）
+    :return: 放回的消息个数
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_PROMOTE_DUE)
+    if QUEUE_BACKEND == "stream":
+        target = _stream_ensure_group(conn, key)
+    else:
+        target = key
+    total = 0
+    while True:
+        count = script(keys=[retry_key(key), target], args=[time.time(), limit, QUEUE_BACKEND])
+        total += count
+        if count < limit:
+            return total
+
+
+def replay_dead_letters(key, count=100):
+    """
+    把死信重新投递到任务队列，供人工处理后重放
+    :return: 重新投递的消息个数
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    for _ in range(count):
+        pipe.rpop(dead_letter_key(key))
+    values = [value for value in pipe.execute() if value is not None]
+    # 最终失败时写入了结束标记，清除后重放的消息才能被认领
+    refs = [ref for ref in map(_value_ref, values) if ref is not None]
+    if refs:
+        conn.delete(*[done_key(key, ref) for ref in refs])
+    push_queue_many(values, key)
+    return len(values)
+
+
+# ---------------- 去重：入队幂等 + 执行互斥 ----------------
+# 入队时登记任务（整单为订单编号，分块为 '订单编号:分块下标'，见 message.task_ref），已登记的任务不再重复入队；
+# 任务结束（成功或最终失败）、重复消息被跳过、订单不存在时注销，等待重试期间保持登记。
+# 执行前认领任务：认领键记录执行者，已被其它 worker 认领的任务延后重试，已结束的任务直接跳过；
+# 认领键带过期时间，执行者失联后自动失效。旧格式消息（仅订单标识）无法取得订单编号，不参与入队去重。
+
+# 登记任务，返回与 ARGV 一一对应的是否新登记（同一批次内重复的任务只有第一个为 1）
+# KEYS[1]: 已登记任务集合 ARGV: 任务标识
+LUA_MARK_QUEUED = """
+local added = {}
+for i, ref in ipairs(ARGV) do
+    added[i] = redis.call('SADD', KEYS[1], ref)
+end
+return added
+"""
+
+# 认领任务
+# KEYS[1]: 认领键 KEYS[2]: 结束标记 ARGV[1]: 执行者 ARGV[2]: 认领时长（毫秒）
+# 返回: -1 认领成功；0 任务已结束；大于 0 为其它执行者认领的剩余毫秒数
+LUA_CLAIM = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then
+    return math.max(redis.call('PTTL', KEYS[1]), 1)
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', tonumber(ARGV[2]))
+return -1
+"""
+
+# 结束任务：释放认领；done / dead 时写入结束标记并注销，drop 时只注销（重复消息），retry 时保持登记
+# KEYS[1]: 认领键 KEYS[2]: 结束标记 KEYS[3]: 已登记任务集合
+# ARGV[1]: 执行者 ARGV[2]: 任务标识 ARGV[3]: done / retry / dead / drop ARGV[4]: 结束标记的过期时间（秒）
+LUA_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+if ARGV[3] == 'done' or ARGV[3] == 'dead' then
+    redis.call('SET', KEYS[2], 1, 'EX', tonumber(ARGV[4]))
+end
+if ARGV[3] ~= 'retry' then
+    redis.call('SREM', KEYS[3], ARGV[2])
+end
+return 1
+"""
+
+
+def queued_key(key):
+    """已登记（在队列中、处理中或等待重试）的任务集合"""
+    return f"{key}:queued"
+
+
+def claim_key(key, ref):
+    """任务认领键，值为执行者"""
+    return f"{key}:claim:{ref}"
+
+
+def done_key(key, ref):
+    """任务结束标记（成功或最终失败），重放死信时清除"""
+    return f"{key}:done:{ref}"
+
+
+def _value_ref(value):
+    """消息对应的任务标识，旧格式消息（仅订单标识）返回 None"""
+    try:
+        task = message.decode_task(value)
+    except ValueError:
+        return None
+    if "id" not in task:
+        return None
+    return message.task_ref(task)
+
+
+def _mark_queued(conn, key, values, dedup):
+    """登记任务，dedup 时只返回新登记的消息"""
+    refs = [(value, _value_ref(value)) for value in values]
+    marked = [ref for _, ref in refs if ref is not None]
+    if not marked:
+        return values
+    added = dict(zip(marked, conn.register_script(LUA_MARK_QUEUED)(keys=[queued_key(key)], args=marked)))
+    if not dedup:
+        return values
+    result = []
+    for value, ref in refs:
+        if ref is None:
+            result.append(value)
+        elif added.get(ref):
+            result.append(value)
+            added[ref] = 0  # 同一批次内重复的消息只保留第一个
+    return result
+
+
+def claim_tasks(key, claims, ttl=600):
+    """
+    认领任务
+    :param claims: [(任务标识, 执行者), ...]，执行者应在每次执行时唯一，结束时用同一个值释放
+    :param ttl: 认领时长（秒），执行时间较长时需调用 extend_claims 续期
+    :return: 与 claims 一一对应的结果：True 认领成功；None 任务已结束，应跳过；数值为其它执行者认领的剩余秒数，应延后重试
+    """
+    if not claims:
+        return []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_CLAIM)
+    pipe = conn.pipeline(transaction=False)
+    for ref, holder in claims:
+        script(keys=[claim_key(key, ref), done_key(key, ref)], args=[holder, int(ttl * 1000)], client=pipe)
+    return list(map(_claim_result, pipe.execute()))
+
+
+async def async_claim_tasks(key, claims, ttl=600):
+    """认领任务（异步），参数与返回值同 claim_tasks"""
+    if not claims:
+        return []
+    conn = get_async_conn()
+    script = conn.register_script(LUA_CLAIM)
+    pipe = conn.pipeline(transaction=False)
+    for ref, holder in claims:
+        await script(keys=[claim_key(key, ref), done_key(key, ref)], args=[holder, int(ttl * 1000)], client=pipe)
+    return list(map(_claim_result, await pipe.execute()))
+
+
+def _claim_result(result):
+    if result < 0:
+        return True
+    if result == 0:
+        return None
+    return result / 1000
+
+
+def release_tasks(key, outcomes, done_ttl=86400):
+    """
+    结束任务
+    :param outcomes: [(任务标识, 执行者, done / retry / dead / drop), ...]
+    :param done_ttl: 结束标记的保留时间（秒），期间重复投递的消息会被跳过
+    """
+    if not outcomes:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_RELEASE)
+    pipe = conn.pipeline(transaction=False)
+    for ref, holder, outcome in outcomes:
+        script(
+            keys=[claim_key(key, ref), done_key(key, ref), queued_key(key)],
+            args=[holder, ref, outcome, done_ttl], client=pipe,
+        )
+    pipe.execute()
+
+
+async def async_release_tasks(key, outcomes, done_ttl=86400):
+    """结束任务（异步），参数同 release_tasks"""
+    if not outcomes:
+        return
+    conn = get_async_conn()
+    script = conn.register_script(LUA_RELEASE)
+    pipe = conn.pipeline(transaction=False)
+    for ref, holder, outcome in outcomes:
+        await script(
+            keys=[claim_key(key, ref), done_key(key, ref), queued_key(key)],
+            args=[holder, ref, outcome, done_ttl], client=pipe,
+        )
+    await pipe.execute()
+
+
+def reset_tasks(key, refs):
+    """清除任务的结束标记与认领（如订单在数据库中被改回待执行），之后的消息不再被跳过"""
+    if not refs:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.delete(*[done_key(key, ref) for ref in refs], *[claim_key(key, ref) for ref in refs])
+
+
+def _drop_claims(conn, key, values):
+    """删除消息对应任务的认领（不校验执行者），用于回收失联 worker 的消息"""
+    refs = [ref for ref in map(_value_ref, values) if ref is not None]
+    if refs:
+        conn.delete(*[claim_key(key, ref) for ref in refs])
+
+
+def forget_tasks(key, refs):
+    """注销不会再执行的任务（如订单已不存在），之后可以重新入队"""
+    if not refs:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.srem(queued_key(key), *refs)
+
+
+async def async_forget_tasks(key, refs):
+    """注销不会再执行的任务（异步）"""
+    if not refs:
+        return
+    await get_async_conn().srem(queued_key(key), *refs)
+
+
+def extend_claims(key, values, ttl=600):
+    """为处理中的消息续期认领（不校验执行者：进程池模式下由主进程为子进程续期）"""
+    refs = [ref for ref in map(_value_ref, values) if ref is not None]
+    if not refs:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    for ref in refs:
+        pipe.pexpire(claim_key(key, ref), int(ttl * 1000))
+    pipe.execute()
+
+
+# ---------------- 大订单分块：记录各分块的完成情况，全部结束后由最后一个分块回写父订单 ----------------
+
+# 初始化分块状态，已存在时（父订单被重复投递）返回已完成的分块
+# KEYS[1]: 分块状态哈希 KEYS[2]: 已完成分块集合 ARGV[1]: 分块总数
+LUA_CHUNK_INIT = """
+if redis.call('HSETNX', KEYS[1], 'total', ARGV[1]) == 1 then
+    return {}
+end
+return redis.call('SMEMBERS', KEYS[2])
+"""
+
+# 记录分块结束（成功或最终失败），同一分块重复记录以最后一次的结果为准
+# KEYS[1]: 分块状态哈希 KEYS[2]: 已完成分块集合 KEYS[3]: 失败分块集合 ARGV[1]: 分块下标 ARGV[2]: 是否成功 1 / 0
+# 返回: -1 表示仍有分块未结束，否则为失败的分块数。状态保留到父订单回写提交后由 clear_chunks 删除，
+# 回写失败时重新执行的分块可以再次拿到结果
+LUA_CHUNK_COMPLETE = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+redis.call('SADD', KEYS[2], ARGV[1])
+if ARGV[2] == '0' then
+    redis.call('SADD', KEYS[3], ARGV[1])
+else
+    redis.call('SREM', KEYS[3], ARGV[1])
+end
+if redis.call('SCARD', KEYS[2]) < tonumber(redis.call('HGET', KEYS[1], 'total')) then
+    return -1
+end
+return redis.call('SCARD', KEYS[3])
+"""
+
+
+def chunk_state_key(key, order_id):
+    """分块状态：total 分块总数"""
+    return f"{key}:chunks:{order_id}"
+
+
+def chunk_done_key(key, order_id):
+    """已结束的分块下标集合"""
+    return f"{key}:chunks:{order_id}:done"
+
+
+def chunk_failed_key(key, order_id):
+    """最终失败的分块下标集合"""
+    return f"{key}:chunks:{order_id}:failed"
+
+
+def _chunk_keys(key, order_id):
+    return [chunk_state_key(key, order_id), chunk_done_key(key, order_id), chunk_failed_key(key, order_id)]
+
+
+def init_chunks(key, order_id, chunks):
+    """
+    登记大订单的分块
+    :param chunks: 分块总数
+    :return: 需要入队的分块下标列表（重复投递时跳过已结束的分块）
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_CHUNK_INIT)
+    done = script(keys=_chunk_keys(key, order_id)[:2], args=[chunks])
+    done = {int(chunk) for chunk in done}
+    return [chunk for chunk in range(chunks) if chunk not in done]
+
+
+def complete_chunks(key, results):
+    """
+    批量记录分块结束，可重复调用：父订单回写失败时重放同一分块会再次返回父订单
+    :param results: [(订单编号, 分块下标, 是否成功), ...]
+    :return: (全部分块成功的订单编号列表, 存在失败分块的订单编号列表)，回写父订单后需调用 clear_chunks
+    """
+    if not results:
+        return [], []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_CHUNK_COMPLETE)
+    pipe = conn.pipeline(transaction=False)
+    for order_id, chunk, ok in results:
+        script(keys=_chunk_keys(key, order_id), args=[chunk, int(ok)], client=pipe)
+    # 同一父订单的多个分块在一批中结束时以最后一个结果为准
+    finished = {}
+    for (order_id, _, _), result in zip(results, pipe.execute()):
+        if result >= 0:
+            finished[order_id] = result
+    succeeded = [order_id for order_id, count in finished.items() if count == 0]
+    failed = [order_id for order_id, count in finished.items() if count > 0]
+    return succeeded, failed
+
+
+def clear_chunks(key, order_ids):
+    """父订单状态回写后删除分块状态"""
+    if not order_ids:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.delete(*[k for order_id in order_ids for k in _chunk_keys(key, order_id)])
+
+
+# ---------------- 订单进度：已完成单位数的计数器 + 按任务保存的检查点 ----------------
+# 进度计数器按订单记录（分块子任务累加到父订单），检查点按任务（整单或分块）记录已完成的单位数，
+# 两者在同一个事务中更新：检查点之后、崩溃之前完成的单位既不计入进度，也会在重新执行时补做。
+
+def progress_key(key, order_id):
+    """订单进度：已成功的单位数"""
+    return f"{key}:progress:{order_id}"
+
+
+def checkpoint_key(key, ref):
+    """任务检查点：任务已成功的单位数，ref 见 message.task_ref"""
+    return f"{key}:checkpoint:{ref}"
+
+
+def read_checkpoint(key, ref):
+    """读取任务检查点，没有时为 0"""
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    return int(conn.get(checkpoint_key(key, ref)) or 0)
+
+
+def read_checkpoints(key, refs):
+    """批量读取任务检查点，没有时为 0"""
+    if not refs:
+        return []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    return [int(done or 0) for done in conn.mget([checkpoint_key(key, ref) for ref in refs])]
+
+
+async def async_read_checkpoint(key, ref):
+    """读取任务检查点（异步）"""
+    return int(await get_async_conn().get(checkpoint_key(key, ref)) or 0)
+
+
+def save_progress(key, order_id, ref, units, done, ttl=86400):
+    """
+    累加订单进度并保存任务检查点
+    :param units: 本次新增的单位数
+    :param done: 任务累计完成的单位数（检查点）
+    :param ttl: 进度与检查点的过期时间（秒）
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=True)
+    pipe.incrby(progress_key(key, order_id), units)
+    pipe.expire(progress_key(key, order_id), ttl)
+    pipe.set(checkpoint_key(key, ref), done, ex=ttl)
+    pipe.execute()
+
+
+async def async_save_progress(key, order_id, ref, units, done, ttl=86400):
+    """累加订单进度并保存任务检查点（异步），参数同 save_progress"""
+    pipe = get_async_conn().pipeline(transaction=True)
+    pipe.incrby(progress_key(key, order_id), units)
+    pipe.expire(progress_key(key, order_id), ttl)
+    pipe.set(checkpoint_key(key, ref), done, ex=ttl)
+    await pipe.execute()
+
+
+def clear_checkpoints(key, refs):
+    """任务成功后删除检查点"""
+    if not refs:
+        return
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    conn.delete(*[checkpoint_key(key, ref) for ref in refs])
+
+
+async def async_clear_checkpoints(key, refs):
+    """任务成功后删除检查点（异步）"""
+    if not refs:
+        return
+    await get_async_conn().delete(*[checkpoint_key(key, ref) for ref in refs])
+
+
+def get_progress(key, order_ids):
+    """
+    批量读取订单进度，一次 MGET
+    :return: {订单编号: 已成功的单位数}
+    """
+    if not order_ids:
+        return {}
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    values = conn.mget([progress_key(key, order_id) for order_id in order_ids])
+    return {order_id: int(value or 0) for order_id, value in zip(order_ids, values)}
+
+
+# ---------------- 订单状态写缓冲：状态先写入 Redis 哈希，由刷新线程批量回写 MySQL ----------------
+# 同一订单多次变更只保留最新状态。刷新时把缓冲哈希原子地改名为刷新中哈希，回写数据库成功后删除；
+# 刷新中途崩溃时刷新中哈希保留在 Redis 中，下一次刷新（任意 worker）先重放它再取新的缓冲，按写入顺序生效。
+# 同一时刻只有一个刷新者（带过期时间的锁），避免旧批次覆盖新状态。
+
+# 取出待回写的批次：优先返回上次未完成的刷新中哈希
+# KEYS[1]: 缓冲哈希 KEYS[2]: 刷新中哈希
+LUA_STATUS_TAKE = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {}
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+# 结束刷新：仍持有锁时释放锁，回写成功时一并删除刷新中哈希
+# KEYS[1]: 刷新锁 KEYS[2]: 刷新中哈希 ARGV[1]: 锁标识 ARGV[2]: 是否已回写 1 / 0
+LUA_STATUS_FINISH = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '1' then
+    redis.call('DEL', KEYS[2])
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+
+def status_buffer_key(key):
+    """状态缓冲哈希：订单编号 -> 最新状态"""
+    return f"{key}:status"
+
+
+def status_flushing_key(key):
+    """正在回写的批次"""
+    return f"{key}:status:flushing"
+
+
+def status_lock_key(key):
+    """刷新锁"""
+    return f"{key}:status:lock"
+
+
+def buffer_status(key, status_map):
+    """
+    写入状态缓冲
+    :param status_map: {订单编号: 状态}
+    :return: 缓冲中的订单数，供调用方判断是否提前刷新
+    """
+    if not status_map:
+        return 0
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(status_buffer_key(key), mapping=status_map)
+    pipe.hlen(status_buffer_key(key))
+    return pipe.execute()[1]
+
+
+async def async_buffer_status(key, status_map):
+    """写入状态缓冲（异步）"""
+    if not status_map:
+        return 0
+    conn = get_async_conn()
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(status_buffer_key(key), mapping=status_map)
+    pipe.hlen(status_buffer_key(key))
+    return (await pipe.execute())[1]
+
+
+def take_status_batch(key, lock_ttl=30):
+    """
+    获取刷新锁并取出一批待回写的状态，回写完成后需调用 finish_status_batch
+    :param lock_ttl: 锁的过期时间（秒），刷新者崩溃后由其它 worker 接手
+    :return: (锁标识, {订单编号: 状态})，未获得锁或没有待回写的状态时返回 (None, {})
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    token = f"{STREAM_CONSUMER}:{time.time_ns()}"
+    if not conn.set(status_lock_key(key), token, nx=True, ex=lock_ttl):
+        return None, {}
+    try:
+        flat = conn.register_script(LUA_STATUS_TAKE)(keys=[status_buffer_key(key), status_flushing_key(key)])
+    except Exception:
+        finish_status_batch(key, token, applied=False)
+        raise
+    if not flat:
+        finish_status_batch(key, token, applied=False)
+        return None, {}
+    return token, dict(zip(flat[::2], flat[1::2]))
+
+
+def finish_status_batch(key, token, applied=True):
+    """
+    结束刷新
+    :param applied: 是否已回写数据库，False 时保留批次等待下次重放
+    :return: 锁是否仍由本次刷新持有（锁已过期时批次由接手的 worker 重放，回写是幂等的）
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    script = conn.register_script(LUA_STATUS_FINISH)
+    return bool(script(keys=[status_lock_key(key), status_flushing_key(key)], args=[token, int(applied)]))
+
+
+# ---------------- 准入控制：积压量缓存在 Redis 中，多个应用进程共享 ----------------
+
+# 进程内缓存：{键: (过期时间, 状态, 积压量)}，减少每个请求访问 Redis 的次数
+_admission_local = {}
+
+
+def admission_key(key):
+    """共享的准入状态，值为 '状态:积压量'"""
+    return f"{key}:admission"
+
+
+def admission_state(key, soft_watermark, hard_watermark, ttl=2, local_ttl=0.5):
+    """
+    根据队列积压量判断准入状态，结果在 Redis 中缓存 ttl 秒，供所有应用进程共享
+    :param soft_watermark: 软水位，超过后按用户限流
+    :param hard_watermark: 硬水位，超过后拒绝入队
+    :param ttl: 共享状态的有效期（秒）
+    :param local_ttl: 进程内缓存的有效期（秒）
+    :return: (状态, 积压量)，状态为 open / throttle / reject
+    """
+    now = time.monotonic()
+    cached = _admission_local.get(key)
+    if cached and cached[0] > now:
+        return cached[1], cached[2]
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    value = conn.get(admission_key(key))
+    if value:
+        state, depth = value.split(":")
+        depth = int(depth)
+    else:
+        depth = queue_length(key)
+        if depth >= hard_watermark:
+            state = "reject"
+        elif depth >= soft_watermark:
+            state = "throttle"
+        else:
+            state = "open"
+        conn.set(admission_key(key), f"{state}:{depth}", ex=ttl)
+    _admission_local[key] = (now + local_ttl, state, depth)
+    return state, depth
+
+
+def rate_limit(key, user_identity, limit, window):
+    """
+    固定窗口限流
+    :param limit: 窗口内允许的次数
+    :param window: 窗口长度（秒）
+    :return: (是否允许, 距窗口结束的秒数)
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    now = int(time.time())
+    window_start = now - now % window
+    counter = f"{key}:ratelimit:{user_identity}:{window_start}"
+    pipe = conn.pipeline(transaction=True)
+    pipe.incr(counter)
+    pipe.expire(counter, window)
+    count, _ = pipe.execute()
+    return count <= limit, window_start + window - now
+
+
+# ---------------- 队列快照：在 Redis 侧生成队列元素集合，用于成员判断 ----------------
+
+# 快照成员：JSON 数组消息（见 utils/message.py）记录订单编号与订单标识，旧格式消息原样记录
+LUA_SNAPSHOT_ADD = """
+local function snapshot_add(snapshot, item)
+    if string.sub(item, 1, 1) == '[' then
+        local ok, msg = pcall(cjson.decode, item)
+        if ok and type(msg) == 'table' and msg[2] ~= nil then
+            redis.call('SADD', snapshot, string.format('%d', msg[2]), tostring(msg[3]))
+            return
+        end
+    end
+    redis.call('SADD', snapshot, item)
+end
+"""
+
+# KEYS[1]: 列表 KEYS[2]: 快照集合 ARGV[1]: 起始下标 ARGV[2]: 块大小
+LUA_SNAPSHOT_LIST_CHUNK = LUA_SNAPSHOT_ADD + """
+local start = tonumber(ARGV[1])
+local items = redis.call('LRANGE', KEYS[1], start, start + tonumber(ARGV[2]) - 1)
+for _, item in ipairs(items) do
+    snapshot_add(KEYS[2], item)
+end
+return #items
+"""
+
+# KEYS[1]: 流 KEYS[2]: 快照集合 ARGV[1]: 起始消息编号（含 '(' 表示不含该编号） ARGV[2]: 块大小
+# 返回: {本块消息数, 本块最后一个消息编号}
+LUA_SNAPSHOT_STREAM_CHUNK = LUA_SNAPSHOT_ADD + """
+local entries = redis.call('XRANGE', KEYS[1], ARGV[1], '+', 'COUNT', tonumber(ARGV[2]))
+for _, entry in ipairs(entries) do
+    local fields = entry[2]
+    for i = 1, #fields, 2 do
+        if fields[i] == 'value' then
+            snapshot_add(KEYS[2], fields[i + 1])
+        end
+    end
+end
+if #entries == 0 then
+    return {0, ARGV[1]}
+end
+return {#entries, entries[#entries][1]}
+"""
+
+
+# KEYS[1]: 有序集合 KEYS[2]: 快照集合 ARGV[1]: 起始下标 ARGV[2]: 块大小
+LUA_SNAPSHOT_ZSET_CHUNK = LUA_SNAPSHOT_ADD + """
+local start = tonumber(ARGV[1])
+local items = redis.call('ZRANGE', KEYS[1], start, start + tonumber(ARGV[2]) - 1)
+for _, item in ipairs(items) do
+    snapshot_add(KEYS[2], item)
+end
+return #items
+"""
+
+
+def snapshot_queue(key, chunk_size=1000, ttl=3600):
+    """
+    分块把队列元素复制到 Redis 侧的临时集合，数据不经过 Python，每块一次往返
+    :param key: 队列名称
+    :param chunk_size: 每次复制的元素个数
+    :param ttl: 快照过期时间（秒），防止调用方异常退出后残留
+    :return: 快照集合的键名，使用完毕后应删除
+    """
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    snapshot = f"{key}:snapshot:{STREAM_CONSUMER}:{time.time_ns()}"
+    if QUEUE_BACKEND == "stream":
+        script = conn.register_script(LUA_SNAPSHOT_STREAM_CHUNK)
+        start = "-"
+        while True:
+            count, last_id = script(keys=[stream_key(key), snapshot], args=[start, chunk_size])
+            if count < chunk_size:
+                break
+            start = f"({last_id}"
+    else:
+        script = conn.register_script(LUA_SNAPSHOT_LIST_CHUNK)
+        for index, name in enumerate(queue_lists(key)):
+            if _use_shards() and shard_node(index) != 0:
+                _snapshot_remote_list(_shard_conn(index), name, snapshot, chunk_size)
+                continue
+            start = 0
+            while True:
+                count = script(keys=[name, snapshot], args=[start, chunk_size])
+                # 并发 LPUSH 只会让下标右移、重复读取，不会遗漏
+                start += count
+                if count < chunk_size:
+                    break
+    # 等待重试的订单同样视为已在队列中
+    script = conn.register_script(LUA_SNAPSHOT_ZSET_CHUNK)
+    start = 0
+    while True:
+        count = script(keys=[retry_key(key), snapshot], args=[start, chunk_size])
+        start += count
+        if count < chunk_size:
+            break
+    conn.expire(snapshot, ttl)
+    return snapshot
+
+
+def _snapshot_members(item):
+    """与 LUA_SNAPSHOT_ADD 一致的快照成员"""
+    try:
+        task = message.decode_task(item)
+    except ValueError:
+        return [item]
+    if not task["version"]:
+        return [item]
+    return [str(task["id"]), str(task["order_identity"])]
+
+
+def _snapshot_remote_list(conn, name, snapshot, chunk_size):
+    """其它节点上的分片无法在脚本中写入默认节点的快照集合，分块读取后写入"""
+    primary = redis.Redis(connection_pool=RedisPool.get_instance())
+    start = 0
+    while True:
+        items = conn.lrange(name, start, start + chunk_size - 1)
+        members = [member for item in items for member in _snapshot_members(item)]
+        if members:
+            primary.sadd(snapshot, *members)
+        start += len(items)
+        if len(items) < chunk_size:
+            break
+
+
+def set_contains(name, values):
+    """
+    批量判断元素是否在集合中
+    :return: 与 values 一一对应的布尔值列表
+    """
+    if not values:
+        return []
+    conn = redis.Redis(connection_pool=RedisPool.get_instance())
+    pipe = conn.pipeline(transaction=False)
+    for value in values:
+        pipe.sismember(name, value)
+    return [bool(item) for item in pipe.execute()]
+
+
 def list_iter(name):
     """
     redis 列表增量迭代器
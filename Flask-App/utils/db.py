@@ -11,60 +11,664 @@ Description:
 
 Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
 """
+import os
+import re
+import json
+import time
+import bisect
 import pymysql
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 from pymysql import cursors
 from dbutils.pooled_db import PooledDB
 
+# 配置来源：环境变量优先，其次为 MYSQL_CONFIG_FILE 指向的 JSON 文件（键名与环境变量相同），最后为默认值
+def _load_config_file() -> dict:
+    path = os.environ.get("MYSQL_CONFIG_FILE")
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"MySQL 配置文件需为 JSON 对象: {path}")
+    return {str(name): str(value) for name, value in data.items()}
+
+
+_CONFIG = {**_load_config_file(), **os.environ}
+
+
+def _bool(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(value)
+
+
+def _setting(name, default, cast=str, minimum=None, maximum=None):
+    """读取并校验一项配置，值不合法时抛出 ValueError（启动即失败，避免带着错误配置运行）"""
+    raw = _CONFIG.get(name)
+    if raw is None:
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        raise ValueError(f"配置 {name} 的值不合法: {raw!r}") from None
+    if minimum is not None and value < minimum:
+        raise ValueError(f"配置 {name} 不能小于 {minimum}: {value}")
+    if maximum is not None and value > maximum:
+        raise ValueError(f"配置 {name} 不能大于 {maximum}: {value}")
+    return value
+
+
+# MySQL 连接信息（同步连接池与异步连接池共用）
+MYSQL_CONN_PARAMS = {
+    'host': _setting("MYSQL_HOST", "127.0.0.1"),
+    'port': _setting("MYSQL_PORT", 3306, int, 1, 65535),
+    'user': _setting("MYSQL_USER", "root"),
+    'password': _setting("MYSQL_PASSWORD", "root"),
+    'charset': _setting("MYSQL_CHARSET", "utf8"),
+    'db': _setting("MYSQL_DB", "flask-app"),
+}
+
+# 连接池配置
+MYSQL_POOL_PARAMS = {
+    'maxconnections': _setting("MYSQL_POOL_MAX_CONNECTIONS", 10, int, 0),  # 最大连接数，0 表示不限
+    'mincached': _setting("MYSQL_POOL_MIN_CACHED", 2, int, 0),  # 启动时创建的空闲连接数
+    'maxcached': _setting("MYSQL_POOL_MAX_CACHED", 5, int, 0),  # 最大空闲链接数，0 表示不限
+    'maxusage': _setting("MYSQL_POOL_MAX_USAGE", 0, int, 0),  # 单个连接最多使用次数，超过后重建，0 表示不限
+    'blocking': _setting("MYSQL_POOL_BLOCKING", True, _bool),  # 全部占用时是否阻塞等待，False 时直接报错
+    'ping': _setting("MYSQL_POOL_PING", 0, int, 0, 7),  # 链接可用检测：1 取出时，2 创建游标时，4 执行时（可组合）
+}
+# 健康检查：取出连接时先 ping，MySQL 重启等原因断开的连接会被自动重建
+MYSQL_POOL_HEALTH_CHECK = _setting("MYSQL_POOL_HEALTH_CHECK", False, _bool)
+if MYSQL_POOL_HEALTH_CHECK:
+    MYSQL_POOL_PARAMS['ping'] |= 1
+POOL_WAIT_WARN_SECONDS = _setting("MYSQL_POOL_WAIT_WARN_SECONDS", 1.0, float, 0)  # 取连接等待超过该值时打印告警，0 表示不告警
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)  # 取连接等待时间的分桶（秒）
+
+
+def _validate_pool_params(params):
+    maxconnections, mincached, maxcached = params['maxconnections'], params['mincached'], params['maxcached']
+    if maxcached and mincached > maxcached:
+        raise ValueError(f"MYSQL_POOL_MIN_CACHED({mincached}) 不能大于 MYSQL_POOL_MAX_CACHED({maxcached})")
+    if maxconnections and mincached > maxconnections:
+        raise ValueError(f"MYSQL_POOL_MIN_CACHED({mincached}) 不能大于 MYSQL_POOL_MAX_CONNECTIONS({maxconnections})")
+    if maxconnections and maxcached > maxconnections:
+        raise ValueError(f"MYSQL_POOL_MAX_CACHED({maxcached}) 不能大于 MYSQL_POOL_MAX_CONNECTIONS({maxconnections})")
+
+
+_validate_pool_params(MYSQL_POOL_PARAMS)
+
+
+# ---------------- 连接池统计：在用/空闲/等待数、取连接等待分布、连接创建与关闭次数 ----------------
+
+class PoolStats:
+    """连接池统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.waiters = 0  # 正在取连接的线程数（连接池已满时即为阻塞等待的线程数）
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.wait_buckets = [0] * (len(POOL_WAIT_BUCKETS) + 1)
+        self.created = 0
+        self.closed = 0
+        self.observers = []  # 取连接后的回调 observer(等待时间)，供指标模块接入
+
+    def enter_wait(self):
+        with self._lock:
+            self.waiters += 1
+
+    def leave_wait(self, elapsed: float | None):
+        """:param elapsed: 等待时间，取连接失败时为 None"""
+        with self._lock:
+            self.waiters -= 1
+            if elapsed is None:
+                return
+            self.checkouts += 1
+            self.wait_seconds += elapsed
+            self.max_wait_seconds = max(self.max_wait_seconds, elapsed)
+            self.wait_buckets[bisect.bisect_left(POOL_WAIT_BUCKETS, elapsed)] += 1
+        for observer in self.observers:
+            observer(elapsed)
+
+    def count(self, created: int = 0, closed: int = 0):
+        with self._lock:
+            self.created += created
+            self.closed += closed
+
+
+POOL_STATS = PoolStats()
+
+
+class _TrackedConnection(pymysql.connections.Connection):
+    """统计关闭次数的连接（连接池在空闲连接超出上限、重建失效连接时关闭连接）"""
+
+    def close(self):
+        if not getattr(self, "_close_counted", False):
+            self._close_counted = True
+            POOL_STATS.count(closed=1)
+        super().close()
+
+
+def _connect(*args, **kwargs):
+    """连接池的 creator：创建连接并计数"""
+    conn = _TrackedConnection(*args, **kwargs)
+    POOL_STATS.count(created=1)
+    return conn
+
+
+_connect.dbapi = pymysql  # 连接池据此判断线程安全级别与可重试的异常类型
+
 MYSQL_CONN_POOL = PooledDB(
-    creator=pymysql,
-    maxconnections=10,
-    mincached=2,
-    maxcached=5,  # 最大空闲链接数
-    blocking=True,  # 全部占用时是否阻塞等待
+    creator=_connect,
     setsession=[],
-    ping=0, # 链接可用检测
-    host="127.0.0.1", port=3306, user="root", passwd="root", charset="utf8", db="flask-app"
+    **MYSQL_POOL_PARAMS,
+    **MYSQL_CONN_PARAMS
 )
 
+
+def pool_stats() -> dict:
+    """
+    连接池统计快照
+    :return: {max_connections, in_use, idle, waiters, checkouts, wait_seconds, max_wait_seconds,
+              wait_histogram: [(上界, 次数), ...], created, closed}
+    """
+    with POOL_STATS._lock:
+        snapshot = {
+            "max_connections": MYSQL_POOL_PARAMS['maxconnections'],
+            # PooledDB 没有公开的统计接口，在用与空闲数读取其内部计数
+            "in_use": getattr(MYSQL_CONN_POOL, "_connections", None),
+            "idle": len(getattr(MYSQL_CONN_POOL, "_idle_cache", ())),
+            "waiters": POOL_STATS.waiters,
+            "checkouts": POOL_STATS.checkouts,
+            "wait_seconds": POOL_STATS.wait_seconds,
+            "max_wait_seconds": POOL_STATS.max_wait_seconds,
+            "wait_histogram": list(zip(POOL_WAIT_BUCKETS + (float("inf"),), POOL_STATS.wait_buckets)),
+            "created": POOL_STATS.created,
+            "closed": POOL_STATS.closed,
+        }
+    return snapshot
+
+
+def health_check() -> tuple[bool, str]:
+    """取一个连接执行 select 1，用于就绪检查；健康检查模式下失效的连接会在取出时被重建"""
+    started = time.perf_counter()
+    try:
+        fetch_one("select 1 as `ok`", None)
+    except Exception as e:
+        return False, f"MySQL 不可用: {e}"
+    return True, f"MySQL 正常({(time.perf_counter() - started) * 1000:.1f}ms)"
+
+
+# 批量写入配置
+MYSQL_MAX_ALLOWED_PACKET = None  # 单条语句的最大字节数，None 时首次批量写入从服务端读取 @@max_allowed_packet
+BULK_PACKET_RATIO = 0.9  # 实际使用的比例，为协议头留出余量
+BULK_MAX_ROWS = 5000  # 单条语句（即单次提交）的最大行数
+
+# 流式读取配置
+FETCH_CHUNK_SIZE = 1000  # fetch_chunks 每次产出的行数
+
+# 查询统计配置
+SLOW_QUERY_SECONDS = _setting("DB_SLOW_QUERY_SECONDS", 0.5, float, 0)  # 超过该耗时的语句记录慢查询日志，0 表示不记录
+QUERY_STATS_MAX_STATEMENTS = 200  # 最多分别统计的语句数，超出的归入 "other"
+QUERY_STATS_SQL_PREFIX = 2048  # 归一化时只取语句前缀（批量写入的语句可能很长）
+
+
+# ---------------- 查询统计：按归一化语句统计耗时与行数，记录取连接等待与慢查询 ----------------
+
+_NORMALIZE_RULES = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),  # 字符串字面量
+    (re.compile(r"'(?:[^'\\]|\\.)*\\?$"), "?"),  # 截断在字面量中间时剩下的未闭合部分
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),  # 数字字面量
+    (re.compile(r"%s"), "?"),  # 参数占位符
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),  # IN 列表、VALUES 行
+    (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...)"),  # 多行 VALUES
+    (re.compile(r"(?:when \? then \? ?)+", re.IGNORECASE), "when ? then ? "),  # 批量更新的 CASE 分支
+]
+
+
+def normalize_sql(sql: str) -> str:
+    """归一化语句：去掉字面量与参数，合并 IN 列表与多行 VALUES，用作统计维度与慢查询日志（不含参数值）"""
+    return _normalize_prefix(sql[:QUERY_STATS_SQL_PREFIX])
+
+
+@lru_cache(maxsize=1024)
+def _normalize_prefix(statement: str) -> str:
+    """按截断后的前缀缓存，缓存占用有上限"""
+    for pattern, replacement in _NORMALIZE_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def _redact(param) -> str:
+    """参数脱敏：只保留类型"""
+    if param is None:
+        return "[]"
+    values = param.values() if isinstance(param, dict) else param
+    return "[" + ", ".join(type(value).__name__ for value in values) + "]"
+
+
+class QueryStats:
+    """查询统计，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.observers = []  # 每条语句执行后的回调 observer(归一化语句, 耗时, 是否出错)，供指标模块接入
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}  # 归一化语句 -> [次数, 出错次数, 总耗时, 最大耗时, 行数]
+            self._slow = 0
+
+    def record(self, statement: str, elapsed: float, rows: int = 0, error: bool = False):
+        with self._lock:
+            entry = self._statements.get(statement)
+            if entry is None:
+                key = "other" if len(self._statements) >= QUERY_STATS_MAX_STATEMENTS else statement
+                entry = self._statements.get(key)
+                if entry is None:
+                    entry = self._statements[key] = [0, 0, 0.0, 0.0, 0]
+            entry[0] += 1
+            entry[1] += int(error)
+            entry[2] += elapsed
+            entry[3] = max(entry[3], elapsed)
+            entry[4] += max(rows, 0)
+        for observer in self.observers:
+            observer(statement, elapsed, error)
+
+    def add_rows(self, statement: str, rows: int):
+        with self._lock:
+            entry = self._statements.get(statement) or self._statements.get("other")
+            if entry is not None:
+                entry[4] += rows
+
+    def record_slow(self):
+        with self._lock:
+            self._slow += 1
+
+    def snapshot(self) -> dict:
+        """
+        :return: {"statements": [{statement, calls, errors, seconds, max_seconds, rows}, ...]（按总耗时降序）,
+                  "slow_queries": 慢查询次数}
+        """
+        with self._lock:
+            statements = [
+                {"statement": statement, "calls": calls, "errors": errors, "seconds": seconds,
+                 "max_seconds": max_seconds, "rows": rows}
+                for statement, (calls, errors, seconds, max_seconds, rows) in self._statements.items()
+            ]
+            slow = self._slow
+        statements.sort(key=lambda item: item["seconds"], reverse=True)
+        return {
+            "statements": statements,
+            "slow_queries": slow,
+        }
+
+
+QUERY_STATS = QueryStats()
+
+
+def query_stats() -> dict:
+    """查询统计快照，供指标服务读取"""
+    return QUERY_STATS.snapshot()
+
+
+def _log_slow_query(statement: str, param, elapsed: float):
+    print(f"慢查询({elapsed * 1000:.1f}ms): {statement} 参数类型={_redact(param)}")
+
+
+def _checkout():
+    """从连接池取连接，记录等待时间；连接池已满而阻塞较久时告警（默认配置下没有超时，会一直等待）"""
+    started = time.perf_counter()
+    POOL_STATS.enter_wait()
+    elapsed = None
+    try:
+        conn = MYSQL_CONN_POOL.connection()
+        elapsed = time.perf_counter() - started
+    finally:
+        POOL_STATS.leave_wait(elapsed)
+    if POOL_WAIT_WARN_SECONDS and elapsed >= POOL_WAIT_WARN_SECONDS:
+        print(f"等待数据库连接 {elapsed:.2f}s，连接池可能已满(max={MYSQL_POOL_PARAMS['maxconnections']})，"
+              f"可调大 MYSQL_POOL_MAX_CONNECTIONS")
+    return conn
+
+
+def _timed_execute(cursor, sql, param=None, many=False):
+    """
+    执行语句并记录耗时与行数（查询为结果行数，写入为影响行数，流式游标在读取结束后补记）
+    :param many: 为 True 时 param 为参数列表，使用 executemany
+    """
+    statement = normalize_sql(sql)
+    started = time.perf_counter()
+    try:
+        if many:
+            cursor.executemany(sql, param)
+        else:
+            cursor.execute(sql, param)
+    except Exception:
+        QUERY_STATS.record(statement, time.perf_counter() - started, error=True)
+        raise
+    elapsed = time.perf_counter() - started
+    # 流式游标执行后的 rowcount 为 -1（无符号表示）
+    rows = cursor.rowcount if 0 <= cursor.rowcount < 2 ** 63 else 0
+    QUERY_STATS.record(statement, elapsed, rows)
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        QUERY_STATS.record_slow()
+        _log_slow_query(statement, param if not many else None, elapsed)
+    return cursor
+
 def fetch_one(sql, param) -> dict | None:
-    conn = MYSQL_CONN_POOL.connection()
+    conn = _checkout()
     cursor = conn.cursor(cursors.DictCursor)
-    cursor.execute(sql, param)
+    _timed_execute(cursor, sql, param)
     result = cursor.fetchone()
     cursor.close()
     conn.close()    # 将连接反还回给连接池
     return result
 
 def fetch_all(sql, param) -> list[dict] | None:
-    conn = MYSQL_CONN_POOL.connection()
+    conn = _checkout()
     cursor = conn.cursor(cursors.DictCursor)
-    cursor.execute(sql, param)
+    _timed_execute(cursor, sql, param)
     result = cursor.fetchall()
     cursor.close()
     conn.close()
     return result
 
+def fetch_chunks(sql, param, chunk_size=FETCH_CHUNK_SIZE, row_type="dict"):
+    """
+    服务端游标（SSCursor）流式读取，每次产出最多 chunk_size 行，内存占用与结果集大小无关
+    读取期间独占一个连接；调用方提前退出（break / 生成器被回收）时，游标关闭会读完剩余结果（不构造行对象），
+    连接随后归还连接池。需要尽快释放时可用 contextlib.closing 包裹生成器
+    读取期间 MySQL 一直保持查询打开：只适合逐块处理时不做其它慢 I/O 的场景（如导出），
+    块之间需要访问 Redis 等外部服务时改用按主键分页的短查询（见 worker.init_task_queue）
+    :param row_type: dict: 字典；tuple: 元组；namedtuple: 按列名访问的具名元组，比字典省内存
+    """
+    if row_type not in ("dict", "tuple", "namedtuple"):
+        raise ValueError(f"不支持的行类型: {row_type}")
+    conn = _checkout()
+    cursor = conn.cursor(cursors.SSDictCursor if row_type == "dict" else cursors.SSCursor)
+    streamed = 0
+    try:
+        _timed_execute(cursor, sql, param)
+        row_class = None
+        if row_type == "namedtuple":
+            row_class = namedtuple("Row", [column[0] for column in cursor.description], rename=True)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            streamed += len(rows)
+            yield list(map(row_class._make, rows)) if row_class else list(rows)
+    finally:
+        QUERY_STATS.add_rows(normalize_sql(sql), streamed)
+        cursor.close()
+        conn.close()
+
+def fetch_iter(sql, param, chunk_size=FETCH_CHUNK_SIZE, row_type="dict"):
+    """逐行迭代的 fetch_chunks"""
+    for rows in fetch_chunks(sql, param, chunk_size, row_type):
+        yield from rows
+
 def insert_one(sql, param):
-    conn = MYSQL_CONN_POOL.connection()
+    conn = _checkout()
     cursor = conn.cursor(cursors.DictCursor)
-    cursor.execute(sql, param)
+    _timed_execute(cursor, sql, param)
     conn.commit()
     cursor.close()
     conn.close()
     return cursor.lastrowid
 
 def update_one(sql, param):
-    conn = MYSQL_CONN_POOL.connection()
+    conn = _checkout()
     cursor = conn.cursor(cursors.DictCursor)
-    cursor.execute(sql, param)
+    _timed_execute(cursor, sql, param)
     conn.commit()
     cursor.close()
     conn.close()
 
 def delete_one(sql, param):
-    conn = MYSQL_CONN_POOL.connection()
+    conn = _checkout()
     cursor = conn.cursor(cursors.DictCursor)
-    cursor.execute(sql, param)
+    _timed_execute(cursor, sql, param)
     conn.commit()
     cursor.close()
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+# ---------------- 批量写入：按 max_allowed_packet 拆分为多条语句，每条语句提交一次 ----------------
+
+def _quote(name):
+    return f"`{name}`"
+
+
+def _packet_limit(cursor) -> int:
+    """单条语句可用的字节数，首次调用时从服务端读取 max_allowed_packet"""
+    global MYSQL_MAX_ALLOWED_PACKET
+    if MYSQL_MAX_ALLOWED_PACKET is None:
+        _timed_execute(cursor, "select @@max_allowed_packet as `packet`")
+        MYSQL_MAX_ALLOWED_PACKET = int(cursor.fetchone()["packet"])
+    return int(MYSQL_MAX_ALLOWED_PACKET * BULK_PACKET_RATIO)
+
+
+def _split_rows(cursor, render, rows, overhead, max_rows):
+    """
+    渲染每一行并按语句大小与行数拆分
+    :param render: render(cursor, row) -> (渲染结果, 字节数)
+    :param overhead: 语句中与行数无关部分的字节数
+    :return: [[渲染结果, ...], ...]
+    """
+    limit = _packet_limit(cursor) - overhead
+    chunks, chunk, size = [], [], 0
+    for row in rows:
+        rendered, length = render(cursor, row)
+        if chunk and (size + length > limit or len(chunk) >= max_rows):
+            chunks.append(chunk)
+            chunk, size = [], 0
+        chunk.append(rendered)
+        size += length
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def _render_values(columns):
+    template = "(" + ",".join(["%s"] * len(columns)) + ")"
+
+    def render(cursor, row):
+        rendered = cursor.mogrify(template, list(row))
+        return rendered, len(rendered.encode("utf-8")) + 1
+
+    return render
+
+
+def _execute_chunks(statements) -> tuple[int, list]:
+    """
+    逐条执行语句，每条提交一次；出错时回滚当前语句，之前的语句已提交
+    :param statements: 生成器，接收游标，产出完整的 SQL
+    :return: (影响行数, 自增编号列表)
+    """
+    conn = _checkout()
+    cursor = conn.cursor(cursors.DictCursor)
+    rowcount, ids = 0, []
+    try:
+        for sql in statements(cursor):
+            try:
+                _timed_execute(cursor, sql)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            rowcount += cursor.rowcount
+            if cursor.lastrowid:
+                ids.extend(range(cursor.lastrowid, cursor.lastrowid + cursor.rowcount))
+    finally:
+        cursor.close()
+        conn.close()
+    return rowcount, ids
+
+
+def insert_many(table, columns, rows, max_rows=None) -> tuple[int, list]:
+    """
+    多行 VALUES 批量插入
+    :param table: 表名
+    :param columns: 列名列表
+    :param rows: 与 columns 对应的值序列列表
+    :param max_rows: 单条语句的最大行数，默认 BULK_MAX_ROWS
+    :return: (插入行数, 自增编号列表)，多行 INSERT 为 simple insert，同一语句分配的自增编号连续
+    """
+    prefix = f"insert into {_quote(table)} ({','.join(map(_quote, columns))}) values "
+
+    def statements(cursor):
+        for chunk in _split_rows(cursor, _render_values(columns), rows, len(prefix), max_rows or BULK_MAX_ROWS):
+            yield prefix + ",".join(chunk)
+
+    return _execute_chunks(statements)
+
+
+def upsert_many(table, columns, rows, update_columns=None, max_rows=None) -> int:
+    """
+    多行 VALUES 批量插入，主键或唯一键冲突时更新
+    :param update_columns: 冲突时更新的列，默认为 columns 全部
+    :return: 影响行数（MySQL 约定：新插入计 1，更新计 2，值未变化计 0）
+    """
+    prefix = f"insert into {_quote(table)} ({','.join(map(_quote, columns))}) values "
+    suffix = " on duplicate key update " + ",".join(
+        f"{_quote(column)}=values({_quote(column)})" for column in (update_columns or columns)
+    )
+
+    def statements(cursor):
+        overhead = len(prefix) + len(suffix)
+        for chunk in _split_rows(cursor, _render_values(columns), rows, overhead, max_rows or BULK_MAX_ROWS):
+            yield prefix + ",".join(chunk) + suffix
+
+    return _execute_chunks(statements)[0]
+
+
+def update_many(table, key, columns, rows, max_rows=None) -> int:
+    """
+    按主键批量更新不同的值：每个分块一条 UPDATE ... CASE 语句
+    （pymysql 的 executemany 只会合并 INSERT/REPLACE，UPDATE 仍是逐行往返）
+    :param key: 定位行的列名，一般为主键
+    :param columns: 要更新的列名列表
+    :param rows: (key 的值, columns 对应的值...) 列表
+    :return: 影响行数
+    """
+    def render(cursor, row):
+        key_value, *values = row
+        cases = [cursor.mogrify("when %s then %s", [key_value, value]) for value in values]
+        literal = cursor.mogrify("%s", [key_value])
+        return (cases, literal), sum(len(case.encode("utf-8")) + 1 for case in cases) + len(literal.encode("utf-8")) + 1
+
+    skeleton = (f"update {_quote(table)} set "
+                + ",".join(f"{_quote(column)}=case {_quote(key)}  end" for column in columns)
+                + f" where {_quote(key)} in ()")
+
+    def statements(cursor):
+        for chunk in _split_rows(cursor, render, rows, len(skeleton.encode("utf-8")), max_rows or BULK_MAX_ROWS):
+            assignments = ",".join(
+                f"{_quote(column)}=case {_quote(key)} {' '.join(cases[index] for cases, _ in chunk)} end"
+                for index, column in enumerate(columns)
+            )
+            yield (f"update {_quote(table)} set {assignments} "
+                   f"where {_quote(key)} in ({','.join(literal for _, literal in chunk)})")
+
+    return _execute_chunks(statements)[0]
+
+
+# ---------------- 事务：多条语句共用一个连接，统一提交 ----------------
+
+class Transaction:
+    """
+    一个连接上的事务，方法与模块级函数同名同参（可用 (tx or db).update_one(...) 的方式复用同一段代码），
+    第一条语句执行时才从连接池取连接，没有执行语句的事务不占用连接
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._cursor = None
+        self._savepoints = 0
+
+    def _get_cursor(self):
+        if self._conn is None:
+            self._conn = _checkout()
+            self._conn.begin()
+            self._cursor = self._conn.cursor(cursors.DictCursor)
+        return self._cursor
+
+    def _execute(self, sql, param):
+        return _timed_execute(self._get_cursor(), sql, param)
+
+    def fetch_one(self, sql, param) -> dict | None:
+        return self._execute(sql, param).fetchone()
+
+    def fetch_all(self, sql, param) -> list[dict] | None:
+        return self._execute(sql, param).fetchall()
+
+    def insert_one(self, sql, param):
+        return self._execute(sql, param).lastrowid
+
+    def update_one(self, sql, param):
+        return self._execute(sql, param).rowcount
+
+    def delete_one(self, sql, param):
+        return self._execute(sql, param).rowcount
+
+    def execute_many(self, sql, params) -> int:
+        """executemany：INSERT/REPLACE 会被 pymysql 合并为多行语句"""
+        if not params:
+            return 0
+        return _timed_execute(self._get_cursor(), sql, params, many=True).rowcount
+
+    @contextmanager
+    def savepoint(self):
+        """
+        保存点：块内出错时只回滚到保存点，异常继续抛出，由调用方决定是否让整个事务失败
+        with tx.savepoint(): ...
+        """
+        self._savepoints += 1
+        name = f"sp_{self._savepoints}"
+        self._execute(f"savepoint {name}", None)
+        try:
+            yield self
+        except Exception:
+            _timed_execute(self._cursor, f"rollback to savepoint {name}")
+            raise
+        _timed_execute(self._cursor, f"release savepoint {name}")
+
+    def _finish(self, commit: bool):
+        if self._conn is None:
+            return
+        try:
+            if commit:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self._cursor.close()
+            self._conn.close()
+            self._conn = self._cursor = None
+
+
+@contextmanager
+def transaction():
+    """
+    事务：块内的语句共用一个连接，正常退出时提交一次，异常时回滚
+    with db.transaction() as tx:
+        order = tx.fetch_one("select ... for update", [...])
+        tx.update_one("update ...", [...])
+    注意块内调用模块级函数（db.update_one 等）仍会使用另外的连接，不属于该事务
+    """
+    tx = Transaction()
+    try:
+        yield tx
+    except BaseException:
+        tx._finish(commit=False)
+        raise
+    tx._finish(commit=True)
@@ -0,0 +1,78 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-09-21 15:02:18 @PyCharm
+Description: 
+任务队列消息格式：生产者（Flask-app / worker 对账）与 worker 共用
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import json
+
+# 消息版本号，字段增减时递增，并在 decode_task 中兼容旧版本
+TASK_MESSAGE_VERSION = 1
+# v1 字段顺序，消息以 JSON 数组存储：[版本号, id, order_identity, url, count, user_identity]
+TASK_MESSAGE_FIELDS = ("id", "order_identity", "url", "count", "user_identity")
+# v2 为大订单的分块子任务，在 v1 之后追加分块下标与分块总数，count 为该分块的数量
+TASK_CHUNK_VERSION = 2
+TASK_CHUNK_FIELDS = TASK_MESSAGE_FIELDS + ("chunk", "chunks")
+
+
+def encode_task(order) -> str:
+    """
+    订单编码为队列消息
+    :param order: 订单字典，或带有同名属性的对象（Order 模型实例、db.fetch_chunks 的具名元组行），需包含 TASK_MESSAGE_FIELDS 中的字段，包含 chunk 字段时编码为分块子任务
+    :return: 紧凑的 JSON 数组字符串（Redis 连接池开启了 decode_responses，消息需为文本）
+    """
+    if isinstance(order, dict):
+        if is_chunk(order):
+            version, fields = TASK_CHUNK_VERSION, TASK_CHUNK_FIELDS
+        else:
+            version, fields = TASK_MESSAGE_VERSION, TASK_MESSAGE_FIELDS
+        values = [order[field] for field in fields]
+    else:
+        version = TASK_MESSAGE_VERSION
+        values = [getattr(order, field) for field in TASK_MESSAGE_FIELDS]
+    return json.dumps([version, *values], ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_task(raw) -> dict:
+    """
+    解析队列消息，兼容旧格式（仅订单编号或订单标识）
+    :param raw: 队列中取出的元素
+    :return: {'version': 版本号, 'id': ..., 'order_identity': ..., ...}，
+             旧格式只包含 id 或 order_identity 其中之一，version 为 0
+    """
+    raw = str(raw)
+    if raw.startswith("["):
+        data = json.loads(raw)
+        version = data[0]
+        if version == 1:
+            return {"version": version, **dict(zip(TASK_MESSAGE_FIELDS, data[1:]))}
+        if version == 2:
+            return {"version": version, **dict(zip(TASK_CHUNK_FIELDS, data[1:]))}
+        raise ValueError(f"不支持的消息版本: {version}")
+    if raw.isdigit():
+        return {"version": 0, "id": int(raw)}
+    return {"version": 0, "order_identity": raw}
+
+
+def is_complete(task: dict) -> bool:
+    """消息是否携带了执行订单所需的全部字段，无需再查询数据库"""
+    return all(field in task for field in TASK_MESSAGE_FIELDS)
+
+
+def is_chunk(task: dict) -> bool:
+    """是否为大订单的分块子任务"""
+    return "chunk" in task
+
+
+def task_ref(task: dict) -> str:
+    """任务标识，用于记录失败次数：整单为订单编号，分块为 '订单编号:分块下标'"""
+    if is_chunk(task):
+        return f"{task['id']}:{task['chunk']}"
+    return str(task["id"])
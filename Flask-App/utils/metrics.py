@@ -0,0 +1,309 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-09-23 20:41:06 @PyCharm
+Description:
+轻量指标收集，输出 Prometheus 文本格式（不依赖 prometheus_client）
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import time
+import bisect
+import inspect
+import threading
+from collections import deque
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 默认的耗时分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """[(后缀, 标签值, 额外标签, 值), ...]"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, values, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, values, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [("_total", key, None, value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值，也可以在采集时通过回调函数取值"""
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """采集时调用 function() 取值（仅用于无标签的指标）"""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            return [("", (), None, self._function())]
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # 标签值 -> [各桶计数, 总和, 总数]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, **labels):
+        """计时上下文管理器"""
+        return _Timer(self, labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    result.append(("_bucket", key, ("le", _format_value(bound)), cumulative))
+                result.append(("_sum", key, None, total))
+                result.append(("_count", key, None, count))
+        return result
+
+
+class CallbackMetric(_Metric):
+    """采集时由回调函数提供全部样本，适合读取其它模块维护的统计（如 db.query_stats()）"""
+
+    def __init__(self, name, documentation, type_name, labelnames, function):
+        """
+        :param type_name: counter / gauge
+        :param function: function() -> [(标签值元组, 值), ...]
+        """
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self._function = function
+
+    def samples(self):
+        suffix = "_total" if self.type_name == "counter" else ""
+        return [(suffix, values, None, value) for values, value in self._function()]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+        return False
+
+
+class RateMeter:
+    """滑动窗口内的事件速率（次/秒）"""
+
+    def __init__(self, window=60):
+        self.window = window
+        self._events = deque()
+        self._lock = threading.Lock()
+
+    def mark(self, count=1):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append((now, count))
+            self._trim(now)
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return sum(count for _, count in self._events) / self.window
+
+    def _trim(self, now):
+        while self._events and self._events[0][0] < now - self.window:
+            self._events.popleft()
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, type_name, labelnames, function):
+        return self.register(CallbackMetric(name, documentation, type_name, labelnames, function))
+
+    def render(self):
+        """Prometheus 文本格式，采集回调出错时跳过该指标"""
+        with self._lock:
+            metrics = list(self._metrics)
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception as e:
+                parts.append(f"# {metric.name} 采集失败: {e}")
+        return "\n".join(parts) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def instrument(module, names, histogram: Histogram, label="op"):
+    """
+    为模块中的函数加上耗时统计：替换模块属性，通过 module.func 调用的地方都会被统计
+    :param module: 模块对象，如 utils.db
+    :param names: 函数名列表
+    :param histogram: 耗时直方图，需有且仅有一个标签 label
+    """
+    for name in names:
+        func = getattr(module, name)
+        if getattr(func, "__instrumented__", False):
+            continue
+
+        def make_wrapper(func, name):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with histogram.time(**{label: name}):
+                        return await func(*args, **kwargs)
+            else:
+                @wraps(func)
+                def wrapper(*args, **kwargs):
+                    with histogram.time(**{label: name}):
+                        return func(*args, **kwargs)
+            wrapper.__instrumented__ = True
+            return wrapper
+
+        setattr(module, name, make_wrapper(func, name))
+
+
+def start_http_server(port, addr="127.0.0.1", registry=REGISTRY):
+    """
+    在后台线程中启动指标 HTTP 服务，GET /metrics 返回 Prometheus 文本格式
+    :return: ThreadingHTTPServer 实例，调用 shutdown() 停止
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # 屏蔽每次采集的访问日志
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
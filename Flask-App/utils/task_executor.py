@@ -0,0 +1,511 @@
+"""
+Author: HDJ @https://github.com/Goodnameisfordoggy
+Time@IDE: 2025-09-26 19:52:37 @PyCharm
+Description:
+订单执行器：sleep 为占位实现；http 对订单的 url 发起 count 次请求（长连接复用 + 按目标主机限制并发），
+同时提供线程版（http.client）与 asyncio 版（asyncio 流，供异步 worker 使用）
+本地压测可用 python -m utils.task_executor --stub-port 8000 启动一个替身 HTTP 服务
+				|   早岁已知世事艰，仍许飞鸿荡云间；
+				|   曾恋嘉肴香绕案，敲键弛张荡波澜。
+				|
+				|   功败未成身无畏，坚持未果心不悔；
+				|   皮囊终作一抔土，独留屎山贯寰宇。
+
+Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
+"""
+import ssl
+import time
+import queue
+import asyncio
+import argparse
+import threading
+import http.client
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+# http 执行器配置
+HTTP_TIMEOUT = 10  # 单次请求的连接与读取超时（秒）
+HTTP_HOST_CONCURRENCY = 8  # 同一目标主机同时进行的请求数上限（本进程内所有订单共享）
+HTTP_MAX_IDLE_PER_HOST = 8  # 每个目标主机保留的空闲长连接数
+HTTP_MAX_WORKERS = 32  # 发起请求的线程数
+HTTP_MAX_FAILURE_RATIO = 0.0  # 失败请求占比超过该值时订单视为失败
+HTTP_USER_AGENT = "Flask-App-worker"
+
+# sleep 执行器配置
+SLEEP_SECONDS = 5  # 占位实现：每个订单的耗时（秒）
+
+# 可复用长连接时，连接已被服务端关闭会抛出的异常，换新连接重试一次
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+_ASYNC_STALE_CONNECTION_ERRORS = _STALE_CONNECTION_ERRORS + (asyncio.IncompleteReadError,)
+
+
+class ExecutionResult:
+    """一个订单的执行结果"""
+
+    def __init__(self, requested: int):
+        self.requested = requested
+        self.succeeded = 0
+        self.failed = 0
+        self.statuses = Counter()  # HTTP 状态码 / 异常类型 -> 次数
+        self.elapsed = 0.0
+
+    def record(self, outcome, ok: bool):
+        self.statuses[outcome] += 1
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    @property
+    def ok(self) -> bool:
+        if not self.requested:
+            return True
+        return self.failed / self.requested <= HTTP_MAX_FAILURE_RATIO
+
+    def __repr__(self):
+        return (f"ExecutionResult(requested={self.requested}, succeeded={self.succeeded}, failed={self.failed}, "
+                f"statuses={dict(self.statuses)}, elapsed={self.elapsed:.3f}s)")
+
+
+class SleepExecutor:
+    """占位执行器：不发起请求，按固定耗时模拟"""
+
+    def __init__(self, seconds: float = SLEEP_SECONDS):
+        self.seconds = seconds
+
+    def execute(self, url: str, count: int, progress=None) -> ExecutionResult:
+        result = ExecutionResult(count)
+        time.sleep(self.seconds)
+        result.succeeded = count
+        result.elapsed = self.seconds
+        if progress is not None and count:
+            progress(count)
+        return result
+
+    async def execute_async(self, url: str, count: int, progress=None) -> ExecutionResult:
+        result = ExecutionResult(count)
+        await asyncio.sleep(self.seconds)
+        result.succeeded = count
+        result.elapsed = self.seconds
+        if progress is not None and count:
+            progress(count)
+        return result
+
+    def close(self):
+        pass
+
+    async def close_async(self):
+        pass
+
+
+class HostPool:
+    """
+    单个目标主机的长连接池，并发数受信号量限制
+    名额由提交请求的一方在提交前占用（acquire），请求结束后释放（release），
+    请求线程本身不会在名额上等待，慢主机因此不会占满共享的请求线程
+    """
+
+    def __init__(self, scheme: str, host: str, port: int | None, max_concurrency: int, max_idle: int, timeout: float):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """占用一个并发名额"""
+        return self._slots.acquire(blocking)
+
+    def release(self):
+        self._slots.release()
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _take(self):
+        with self._lock:
+            return self._idle.pop() if self._idle else None
+
+    def _give_back(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method: str, path: str, headers: dict) -> int:
+        """
+        发起一次请求并读完响应体，连接可复用时放回连接池（调用方需已占用并发名额）
+        :return: HTTP 状态码
+        """
+        conn = self._take()
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect()
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            # 空闲期间被服务端关闭的长连接，换新连接重试一次
+            conn = self._connect()
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+        try:
+            response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._give_back(conn)
+        return response.status
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+
+class AsyncHostPool:
+    """
+    单个目标主机的 asyncio 长连接池（HTTP/1.1 keep-alive），并发数受信号量限制。
+    连接与信号量绑定创建它的事件循环，只能在同一个事件循环内使用
+    """
+
+    def __init__(self, scheme: str, host: str, port: int | None, max_concurrency: int, max_idle: int, timeout: float):
+        self.scheme = scheme
+        self.host = host
+        self.port = port or (443 if scheme == "https" else 80)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._idle = deque()
+
+    async def _connect(self):
+        ssl_context = ssl.create_default_context() if self.scheme == "https" else None
+        return await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout)
+
+    @staticmethod
+    def _close(conn):
+        conn[1].close()
+
+    async def request(self, method: str, path: str, headers: dict) -> int:
+        """
+        发起一次请求并读完响应体，连接可复用时放回连接池
+        :return: HTTP 状态码
+        """
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = await self._connect()
+            try:
+                status, keep_alive = await asyncio.wait_for(self._round_trip(conn, method, path, headers), self.timeout)
+            except _ASYNC_STALE_CONNECTION_ERRORS:
+                self._close(conn)
+                if not reused:
+                    raise
+                # 空闲期间被服务端关闭的长连接，换新连接重试一次
+                conn = await self._connect()
+                try:
+                    status, keep_alive = await asyncio.wait_for(
+                        self._round_trip(conn, method, path, headers), self.timeout
+                    )
+                except BaseException:
+                    self._close(conn)
+                    raise
+            except BaseException:
+                self._close(conn)
+                raise
+            if keep_alive and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+            else:
+                self._close(conn)
+            return status
+
+    @staticmethod
+    async def _round_trip(conn, method: str, path: str, headers: dict) -> tuple[int, bool]:
+        """
+        写出请求并读完响应（Content-Length / chunked / 读到连接关闭）
+        :return: (HTTP 状态码, 连接是否可复用)
+        """
+        reader, writer = conn
+        lines = [f"{method} {path} HTTP/1.1"] + [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        try:
+            version, status = status_line.split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(status_line.decode("latin-1", "replace").strip()) from None
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        connection = response_headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == b"HTTP/1.1" else connection == "keep-alive"
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return status, keep_alive
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip() or b"0", 16)
+                if not size:
+                    # 跳过 trailer，直到空行
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                await reader.readexactly(size + 2)
+        elif "content-length" in response_headers:
+            await reader.readexactly(int(response_headers["content-length"]))
+        else:
+            await reader.read()
+            keep_alive = False
+        return status, keep_alive
+
+    def close(self):
+        while self._idle:
+            self._close(self._idle.pop())
+
+
+class HttpExecutor:
+    """
+    对订单的 url 发起 count 次 GET 请求：
+    - 同一主机的连接按 HostPool 复用（HTTP/1.1 keep-alive）
+    - 同一主机的并发请求数受 host_concurrency 限制，多个订单共享该上限；
+      名额在提交到请求线程之前占用，主机之间互不阻塞
+    - 2xx/3xx 计为成功，其余状态码与异常（含超时）计为失败
+    execute 在请求线程中发起请求；execute_async 在调用方的事件循环中发起请求（asyncio 流，不占用线程），
+    两者各自维护连接池与并发上限
+    """
+
+    def __init__(self, timeout: float = HTTP_TIMEOUT, host_concurrency: int = HTTP_HOST_CONCURRENCY,
+                 max_idle_per_host: int = HTTP_MAX_IDLE_PER_HOST, max_workers: int = HTTP_MAX_WORKERS,
+                 observer=None):
+        """
+        :param observer: 每次请求结束后的回调 observer(host, outcome, elapsed)，用于指标统计
+        """
+        self.timeout = timeout
+        self.host_concurrency = host_concurrency
+        self.max_idle_per_host = max_idle_per_host
+        self.observer = observer
+        self._pools = {}
+        self._async_pools = {}
+        self._lock = threading.Lock()
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http-executor")
+
+    def _pool(self, scheme: str, netloc: str, host: str, port: int | None) -> HostPool:
+        with self._lock:
+            pool = self._pools.get((scheme, netloc))
+            if pool is None:
+                pool = self._pools[(scheme, netloc)] = HostPool(
+                    scheme, host, port, self.host_concurrency, self.max_idle_per_host, self.timeout
+                )
+            return pool
+
+    def _async_pool(self, scheme: str, netloc: str, host: str, port: int | None) -> AsyncHostPool:
+        pool = self._async_pools.get((scheme, netloc))
+        if pool is None:
+            pool = self._async_pools[(scheme, netloc)] = AsyncHostPool(
+                scheme, host, port, self.host_concurrency, self.max_idle_per_host, self.timeout
+            )
+        return pool
+
+    @staticmethod
+    def _target(url: str):
+        """
+        解析订单的 url
+        :return: (scheme, netloc, host, port, 请求路径, 请求头)，url 不合法时返回 None
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            return None
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        headers = {"Host": parts.netloc, "User-Agent": HTTP_USER_AGENT}
+        return parts.scheme, parts.netloc, parts.hostname, parts.port, path, headers
+
+    def _request_once(self, pool: HostPool, path: str, headers: dict, done: queue.SimpleQueue):
+        started = time.perf_counter()
+        try:
+            status = pool.request("GET", path, headers)
+            outcome, ok = status, 200 <= status < 400
+        except Exception as e:
+            outcome, ok = type(e).__name__, False
+        finally:
+            pool.release()
+        if self.observer is not None:
+            self.observer(pool.host, outcome, time.perf_counter() - started)
+        done.put((outcome, ok))
+
+    def execute(self, url: str, count: int, progress=None) -> ExecutionResult:
+        """
+        :param progress: 每个请求成功后在调用线程中回调 progress(1)，用于记录进度
+        """
+        result = ExecutionResult(count)
+        started = time.perf_counter()
+        target = self._target(url)
+        if target is None:
+            result.statuses["InvalidURL"] = count
+            result.failed = count
+            return result
+        *address, path, headers = target
+        pool = self._pool(*address)
+        done = queue.SimpleQueue()
+        submitted = finished = 0
+        while finished < count:
+            # 有名额就继续提交；本订单已有请求在途时不在名额上等待，先处理完成的结果
+            if submitted < count and pool.acquire(blocking=submitted == finished):
+                try:
+                    self._threads.submit(self._request_once, pool, path, headers, done)
+                except Exception:
+                    pool.release()
+                    raise
+                submitted += 1
+                continue
+            outcome, ok = done.get()
+            finished += 1
+            result.record(outcome, ok)
+            if ok and progress is not None:
+                progress(1)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    async def _request_once_async(self, pool: AsyncHostPool, path: str, headers: dict):
+        started = time.perf_counter()
+        try:
+            status = await pool.request("GET", path, headers)
+            outcome, ok = status, 200 <= status < 400
+        except Exception as e:
+            outcome, ok = type(e).__name__, False
+        if self.observer is not None:
+            self.observer(pool.host, outcome, time.perf_counter() - started)
+        return outcome, ok
+
+    async def execute_async(self, url: str, count: int, progress=None) -> ExecutionResult:
+        """
+        execute 的 asyncio 版本：请求在当前事件循环中并发进行，同一主机的并发数受 host_concurrency 限制
+        :param progress: 每个请求成功后回调 progress(1)（在事件循环中调用）
+        """
+        result = ExecutionResult(count)
+        started = time.perf_counter()
+        target = self._target(url)
+        if target is None:
+            result.statuses["InvalidURL"] = count
+            result.failed = count
+            return result
+        *address, path, headers = target
+        pool = self._async_pool(*address)
+        # 只保持 host_concurrency 个请求协程，避免大订单一次创建 count 个协程
+        pending = set()
+        submitted = 0
+        try:
+            while submitted < count or pending:
+                while submitted < count and len(pending) < self.host_concurrency:
+                    pending.add(asyncio.create_task(self._request_once_async(pool, path, headers)))
+                    submitted += 1
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    outcome, ok = future.result()
+                    result.record(outcome, ok)
+                    if ok and progress is not None:
+                        progress(1)
+        finally:
+            # 被取消时不留下游离的请求
+            for future in pending:
+                future.cancel()
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def close(self):
+        self._threads.shutdown(wait=True)
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools.clear()
+
+    async def close_async(self):
+        """关闭 asyncio 连接池，需在创建连接的事件循环关闭前调用"""
+        for pool in self._async_pools.values():
+            pool.close()
+        self._async_pools.clear()
+
+
+EXECUTORS = {
+    "sleep": SleepExecutor,
+    "http": HttpExecutor,
+}
+
+
+def create_executor(name: str, **options):
+    """按名称创建执行器"""
+    if name not in EXECUTORS:
+        raise ValueError(f"不支持的执行器: {name}，可选 {list(EXECUTORS)}")
+    return EXECUTORS[name](**options)
+
+
+def serve_stub(port: int, addr: str = "127.0.0.1", delay: float = 0.0, status: int = 200):
+    """
+    在后台线程中启动替身 HTTP 服务：支持 keep-alive，按固定延迟返回固定状态码
+    :return: ThreadingHTTPServer 实例，调用 shutdown() 停止
+    """
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            body = b"ok"
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-http", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="替身 HTTP 服务，用于本地验证 http 执行器")
+    parser.add_argument("--stub-port", type=int, default=8000, help="监听端口")
+    parser.add_argument("--delay", type=float, default=0.0, help="每个请求的响应延迟（秒）")
+    parser.add_argument("--status", type=int, default=200, help="返回的状态码")
+    args = parser.parse_args()
+    stub = serve_stub(args.stub_port, delay=args.delay, status=args.status)
+    print(f"替身 HTTP 服务已启动: http://127.0.0.1:{args.stub_port}/ delay={args.delay} status={args.status}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -11,68 +11,1353 @@ Description:
 
 Copyright (c) 2024-2025 by HDJ, All Rights Reserved.
 """
+import os
+import math
 import time
+import random
+import socket
+import signal
+import uuid
+import asyncio
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 
-from utils import db, cache
+from utils import db, aiodb, cache, message, metrics, task_executor
 
 # 需要连接 Flask-app 的 redis
 cache.start_redis_service()
 
+# 工作池配置
+WORKER_MODE = "single"  # single: 单订单串行，thread: 线程池，process: 进程池，async: 事件循环，batch: 批量出队
+WORKER_CONCURRENCY = 4  # 同时执行的订单数
+ASYNC_CONCURRENCY = 200  # async 模式下同时执行的订单数
+BATCH_SIZE = 50  # batch 模式下单次出队的最大订单数
+WORKER_MAX_INFLIGHT = None  # 最大在途订单数（执行中 + 等待执行），None 时取并发数的 2 倍
+WORKER_POP_TIMEOUT = 1  # 工作池出队的阻塞时间（秒），决定了响应退出信号的速度
+WORKER_ERROR_BACKOFF = 1  # 处理循环出现异常（如 Redis/MySQL 不可用）后的等待时间（秒）
+
+# 订单执行器：sleep: 占位实现，http: 对订单的 url 发起 count 次请求（见 utils/task_executor.py）
+TASK_EXECUTOR = os.environ.get("TASK_EXECUTOR", "sleep")  # 通过环境变量传给进程池子进程
+
+# 进度配置：执行中每完成一定单位数或经过一定时间保存一次检查点
+PROGRESS_CHECKPOINT_UNITS = 10  # 检查点间隔（单位数）
+PROGRESS_CHECKPOINT_SECONDS = 2  # 检查点间隔（秒）
+PROGRESS_TTL = 86400  # 进度与检查点的过期时间（秒）
+
+# 可靠队列配置
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # worker 标识，对应 Redis 中的处理中列表
+VISIBILITY_TIMEOUT = 60  # 租约时长（秒），worker 失去响应超过该时长后订单会被放回队列
+REAPER_INTERVAL = 10  # 心跳、续约与回收的间隔（秒）
+
+# 失败重试配置
+RETRY_MAX_ATTEMPTS = 5  # 单个订单最多执行次数，超过后标记为失败并进入死信列表
+RETRY_BASE_DELAY = 5  # 首次重试的退避上限（秒），之后每次翻倍
+RETRY_MAX_DELAY = 600  # 退避上限（秒）
+RETRY_PROMOTE_INTERVAL = 1  # 检查到期重试的间隔（秒）
+RETRY_PROMOTE_BATCH = 100  # 单次放回队列的最大消息数
+
+# 去重配置
+CLAIM_TTL = 600  # 认领时长（秒），可靠队列模式下由回收器续期
+DONE_TTL = 86400  # 结束标记（成功或最终失败）的保留时间（秒），期间重复投递的消息直接跳过
+
+# 大订单分块配置：count 超过阈值的订单拆分为固定大小的分块子任务，由多个 worker 并行处理
+CHUNK_THRESHOLD = 500  # 超过该数量的订单才拆分，0 表示不拆分
+CHUNK_SIZE = 100  # 单个分块的数量
+
+# 状态写缓冲配置（write-behind）：状态变更先写入 Redis，由刷新线程批量回写 MySQL，数据库中的状态最多延迟一个刷新间隔
+WRITE_BEHIND = os.environ.get("WORKER_WRITE_BEHIND") == "1"  # 通过环境变量传给进程池子进程
+WRITE_BEHIND_INTERVAL = 1  # 刷新间隔（秒）
+WRITE_BEHIND_BATCH = 1000  # 缓冲达到该数量时提前刷新（进程池子进程没有刷新线程，由写入的子进程直接回写）
+WRITE_BEHIND_CHUNK = 1000  # 单条 UPDATE 最多更新的订单数（同时受 max_allowed_packet 限制）
+WRITE_BEHIND_LOCK_TTL = 30  # 刷新锁的过期时间（秒）
+
+# 合并执行配置（batch 模式，--coalesce 开启）
+COALESCE_WINDOW = 0.5  # 收集批次的时间窗口（秒），窗口内 url 与 count 相同的订单只执行一次
+
+# 启动对账配置
+RECONCILE_CHUNK_SIZE = 1000  # 每次扫描的订单数
+RECONCILE_CHECKPOINT_KEY = "task_queue:reconcile:checkpoint"  # 该编号及之前的订单在上次对账时都已不是待执行状态
+
+# 指标配置
+METRICS_ADDR = "127.0.0.1"  # 指标 HTTP 服务仅监听本地，由本机的采集器拉取
+METRICS_PORT = 9100  # 指标 HTTP 端口，0 表示不启动
+
+# 指标：thread/async/batch 模式下完整统计；process 模式下 DB/Redis 调用发生在子进程中，仅统计主进程的出队与回收调用
+QUEUE_LENGTH = metrics.REGISTRY.gauge("worker_task_queue_length", "task_queue 中待处理的订单数")
+INFLIGHT_ORDERS = metrics.REGISTRY.gauge("worker_inflight_orders", "本 worker 的在途订单数")
+ORDERS_TOTAL = metrics.REGISTRY.counter("worker_orders", "本 worker 处理完成的订单数", ["result"])
+ORDERS_PER_SECOND = metrics.REGISTRY.gauge("worker_orders_per_second", "最近 60 秒的订单处理速率")
+TASK_DURATION = metrics.REGISTRY.histogram(
+    "worker_task_duration_seconds", "订单处理耗时（出队后到回写状态）", ["result"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 7.5, 10, 15, 30, 60, 120, 300),
+)
+DB_CALL_DURATION = metrics.REGISTRY.histogram("worker_db_call_duration_seconds", "MySQL 语句耗时（op 为语句类型）", ["op"])
+AIODB_CALL_DURATION = metrics.REGISTRY.histogram(
+    "worker_aiodb_call_duration_seconds", "异步 worker 的 aiodb 调用耗时（含取连接，op 为函数名）", ["op"]
+)
+REDIS_CALL_DURATION = metrics.REGISTRY.histogram("worker_redis_call_duration_seconds", "Redis 调用耗时", ["op"])
+HTTP_REQUESTS = metrics.REGISTRY.counter("worker_http_requests", "http 执行器发起的请求数", ["outcome"])
+HTTP_REQUEST_DURATION = metrics.REGISTRY.histogram("worker_http_request_duration_seconds", "http 执行器单次请求耗时")
+COALESCED_ORDERS = metrics.REGISTRY.counter("worker_coalesced_orders", "合并执行时复用其它订单结果的订单数")
+
+
+def _db_statement_samples(field: str):
+    return lambda: [((item["statement"],), item[field]) for item in db.query_stats()["statements"]]
+
+
+# 按归一化语句统计的 MySQL 查询（参数已去除，语句数量有上限）
+DB_STATEMENT_CALLS = metrics.REGISTRY.callback(
+    "worker_db_statement_calls", "语句执行次数", "counter", ["statement"], _db_statement_samples("calls")
+)
+DB_STATEMENT_ERRORS = metrics.REGISTRY.callback(
+    "worker_db_statement_errors", "语句执行出错次数", "counter", ["statement"], _db_statement_samples("errors")
+)
+DB_STATEMENT_SECONDS = metrics.REGISTRY.callback(
+    "worker_db_statement_seconds", "语句累计耗时（秒）", "counter", ["statement"], _db_statement_samples("seconds")
+)
+DB_STATEMENT_ROWS = metrics.REGISTRY.callback(
+    "worker_db_statement_rows", "语句返回或影响的累计行数", "counter", ["statement"], _db_statement_samples("rows")
+)
+
+
+def _db_pool_sample(field: str):
+    return lambda: [((), db.pool_stats()[field] or 0)]
+
+
+# MySQL 连接池
+DB_POOL_IN_USE = metrics.REGISTRY.callback(
+    "worker_db_pool_in_use", "在用连接数", "gauge", [], _db_pool_sample("in_use")
+)
+DB_POOL_IDLE = metrics.REGISTRY.callback(
+    "worker_db_pool_idle", "空闲连接数", "gauge", [], _db_pool_sample("idle")
+)
+DB_POOL_WAITERS = metrics.REGISTRY.callback(
+    "worker_db_pool_waiters", "正在取连接的线程数", "gauge", [], _db_pool_sample("waiters")
+)
+DB_POOL_CREATED = metrics.REGISTRY.callback(
+    "worker_db_pool_connections_created", "创建的连接数", "counter", [], _db_pool_sample("created")
+)
+DB_POOL_CLOSED = metrics.REGISTRY.callback(
+    "worker_db_pool_connections_closed", "关闭的连接数", "counter", [], _db_pool_sample("closed")
+)
+DB_POOL_WAIT = metrics.REGISTRY.histogram(
+    "worker_db_pool_wait_seconds", "从连接池取连接的等待时间", buckets=db.POOL_WAIT_BUCKETS
+)
+DB_SLOW_QUERIES = metrics.REGISTRY.callback(
+    "worker_db_slow_queries", "慢查询次数", "counter", [], lambda: [((), db.query_stats()["slow_queries"])]
+)
+_orders_rate = metrics.RateMeter(60)
+
+# 退出标记：收到 SIGTERM/SIGINT 后不再出队，等待在途订单处理完成
+_stop_event = threading.Event()
+# 订单执行器实例，每个进程在首次执行订单时创建
+_task_executor = None
+_task_executor_lock = threading.Lock()
+# 状态写缓冲：提前刷新通知与刷新线程的退出标记
+_status_flush_event = threading.Event()
+_status_flusher_stop = threading.Event()
+_status_flusher = None
+# 全量补齐：启动时清除检查点，并清除扫描到的待执行订单的结束标记与认领（订单可能被改回待执行）
+_full_reconcile = False
+
+def _observe_db_statement(statement: str, elapsed: float, error: bool):
+    """语句级耗时：模块级函数、批量写入与事务内的语句都会经过 db 的统一执行入口"""
+    DB_CALL_DURATION.observe(elapsed, op=statement.split(" ", 1)[0].lower())
+
+
+def setup_metrics(port: int = METRICS_PORT):
+    """为 DB/Redis 调用加上耗时统计，并启动指标 HTTP 服务"""
+    db.QUERY_STATS.observers.append(_observe_db_statement)
+    metrics.instrument(aiodb, ["fetch_one", "fetch_all", "insert_one", "update_one", "delete_one"], AIODB_CALL_DURATION)
+    metrics.instrument(cache, [
+        "push_queue", "push_queue_many", "pop_queue", "pop_queue_batch", "pop_queue_reliable", "ack_queue",
+        "extend_lease", "heartbeat", "requeue_expired", "requeue_dead_workers", "read_attempts", "incr_attempts",
+        "clear_attempts", "schedule_retry", "dead_letter", "promote_due_retries", "async_pop_queue",
+        "buffer_status", "async_buffer_status", "take_status_batch", "finish_status_batch",
+        "init_chunks", "complete_chunks", "clear_chunks", "read_checkpoint", "read_checkpoints", "save_progress",
+        "clear_checkpoints",
+        "claim_tasks", "release_tasks", "extend_claims", "reset_tasks",
+    ], REDIS_CALL_DURATION)
+    QUEUE_LENGTH.set_function(lambda: cache.queue_length("task_queue"))
+    db.POOL_STATS.observers.append(DB_POOL_WAIT.observe)
+    ORDERS_PER_SECOND.set_function(_orders_rate.rate)
+    if not port:
+        return None
+    try:
+        server = metrics.start_http_server(port, METRICS_ADDR)
+    except OSError as e:
+        print(f"指标服务启动失败（端口 {port}）: {e}")
+        return None
+    print(f"指标服务已启动: http://{METRICS_ADDR}:{port}/metrics")
+    return server
+
+
+def _task_started(count: int = 1) -> float:
+    INFLIGHT_ORDERS.inc(count)
+    return time.perf_counter()
+
+
+def _task_finished(started: float, succeeded: int, failed: int = 0):
+    """记录订单处理结果，批量处理时每个订单按整批耗时计"""
+    elapsed = time.perf_counter() - started
+    INFLIGHT_ORDERS.dec(succeeded + failed)
+    for result, count in (("success", succeeded), ("failed", failed)):
+        if not count:
+            continue
+        ORDERS_TOTAL.inc(count, result=result)
+        for _ in range(count):
+            TASK_DURATION.observe(elapsed, result=result)
+    _orders_rate.mark(succeeded + failed)
+
+
 def init_task_queue():
     """
-    初始化任务队列
-    :return:
+    初始化任务队列：按主键分块扫描待执行订单，与 Redis 侧的队列快照比对，补齐队列中缺失的订单。
+    检查点只推进到最早一个仍待执行的订单之前：检查点之前的订单在扫描时都已不是待执行状态，
+    重启后从检查点开始扫描，仍待执行（含等待重试）的订单每次都会重新比对，不会因检查点被跳过；
+    代价是长期停留在待执行状态的订单会使检查点停在它之前
+    :return: 补入队列的订单数
     """
-    # 1.获取数据库中的待执行订单
-    data: list[dict] = db.fetch_all("select id from `order` where `status`=1", [])
-    db_id_set = {item['id'] for item in data}
-
-    # 2.获取 redis 中的待执行订单
+    # 0.先重放状态缓冲（含上次崩溃遗留的批次），避免已处理的订单因数据库状态滞后被重新补入队列
+    flush_status_updates()
     conn = cache.get_conn()
-    total_count = conn.llen("task_queue")
-    cache_id_list = conn.lrange("task_queue", 0, total_count)
-    cache_id_set = set(cache_id_list)
+    last_id = int(conn.get(RECONCILE_CHECKPOINT_KEY) or 0)
+    # 没有待执行订单时检查点推进到扫描开始时的最大编号，之后新建的订单留给下次扫描
+    max_id = db.fetch_one("select max(`id`) as `max_id` from `order`", [])["max_id"] or last_id
+    first_pending = None
+    # 1.生成 redis 中待执行订单的快照（Redis 侧集合）
+    snapshot = cache.snapshot_queue("task_queue", RECONCILE_CHUNK_SIZE)
+    pushed = 0
+    try:
+        while True:
+            # 2.按主键分块获取数据库中的待执行订单（每块一次短查询：块之间要访问 Redis，不长时间占用连接与服务端游标）
+            rows: list[dict] = db.fetch_all(
+                "select `id`, `order_identity`, `url`, `count`, `user_identity` from `order` "
+                "where `status`=1 and `id`>%s order by `id` limit %s",
+                [last_id, RECONCILE_CHUNK_SIZE]
+            )
+            if not rows:
+                break
+            if _full_reconcile:
+                reset_pending_tasks(rows)
+            # 3.数据库中有的，而 redis 中没有的，向 redis 队列中添加（快照中包含消息对应的订单编号与订单标识）
+            in_queue_by_id = cache.set_contains(snapshot, [row["id"] for row in rows])
+            in_queue_by_identity = cache.set_contains(snapshot, [row["order_identity"] for row in rows])
+            task_needed_push = [
+                message.encode_task(row) for row, by_id, by_identity in zip(rows, in_queue_by_id, in_queue_by_identity)
+                if not by_id and not by_identity
+            ]
+            # 以数据库为准：登记过但不在快照中的订单（如入队前崩溃）同样补入
+            cache.push_queue_many(task_needed_push, "task_queue", dedup=False)
+            pushed += len(task_needed_push)
+            if first_pending is None:
+                first_pending = rows[0]["id"]
+            last_id = rows[-1]["id"]
+            if len(rows) < RECONCILE_CHUNK_SIZE:
+                break
+    finally:
+        conn.delete(snapshot)
+    # 4.保存检查点：停在最早一个待执行订单之前
+    checkpoint = max_id if first_pending is None else min(first_pending - 1, max_id)
+    conn.set(RECONCILE_CHECKPOINT_KEY, checkpoint)
+    print(f"任务队列初始化完成: 补入 {pushed} 个订单，检查点 id={checkpoint}")
+    return pushed
+
+
+def enable_full_reconcile():
+    """清除检查点，下次初始化时重新扫描整张表，并重置扫描到的待执行订单"""
+    global _full_reconcile
+    _full_reconcile = True
+    cache.get_conn().delete(RECONCILE_CHECKPOINT_KEY)
+
+
+def reset_pending_tasks(rows: list[dict]):
+    """
+    清除待执行订单（含大订单的各分块）的结束标记与认领，以及遗留的分块状态，
+    被改回待执行的订单重新入队后不会被当作重复消息跳过
+    """
+    refs, split_ids = [], []
+    for row in rows:
+        refs.append(message.task_ref(row))
+        if should_split(row):
+            split_ids.append(row["id"])
+            refs += [message.task_ref({**row, "chunk": chunk}) for chunk in range(math.ceil(row["count"] / CHUNK_SIZE))]
+    cache.reset_tasks("task_queue", refs)
+    cache.clear_chunks("task_queue", split_ids)
 
-    # 3.数据库中有的，而 redis 中没有的，向 redis 队列中添加
-    id_needed_push = set(db_id_set - cache_id_set)
-    if id_needed_push:
-        conn.lpush("task_queue", *id_needed_push)
 
 def update_order_status(status: int, order_id: int):
+    if WRITE_BEHIND:
+        return _buffer_status({order_id: status})
     db.update_one(
         "update `order` set `status`=%s where `id`=%s",
         [status, order_id]
     )
 
 
-def process_task(order_id: int):
-    """根据订单编号处理订单"""
-    print(f"已拿到订单: {order_id}")
-    # 1.在数据库中检查订单是否存在
-    order = db.fetch_one("select * from `order` where `id`=%s", [order_id])
+def fetch_orders(values: list, field: str = "id") -> list[dict]:
+    """
+    一次查询取出多个订单
+    :param values: 订单编号或订单标识列表
+    :param field: id / order_identity
+    """
+    if not values:
+        return []
+    placeholders = ",".join(["%s"] * len(values))
+    return db.fetch_all(f"select * from `order` where `{field}` in ({placeholders})", list(values))
+
+
+def load_task(raw) -> dict | None:
+    """解析队列消息，完整消息直接使用，旧格式（仅订单编号或标识）回查数据库"""
+    task = message.decode_task(raw)
+    if message.is_complete(task):
+        return task
+    if "id" in task:
+        return db.fetch_one("select * from `order` where `id`=%s", [task["id"]])
+    return db.fetch_one("select * from `order` where `order_identity`=%s", [task["order_identity"]])
+
+
+def load_tasks(raws: list) -> list[dict]:
+    """批量解析队列消息，旧格式消息按订单编号、订单标识各一次查询补齐"""
+    tasks = [message.decode_task(raw) for raw in raws]
+    orders = [task for task in tasks if message.is_complete(task)]
+    legacy = [task for task in tasks if not message.is_complete(task)]
+    orders.extend(fetch_orders([task["id"] for task in legacy if "id" in task]))
+    orders.extend(fetch_orders([task["order_identity"] for task in legacy if "id" not in task], "order_identity"))
+    return orders
+
+
+def update_orders_status(status: int, order_ids: list, tx: db.Transaction | None = None):
+    """
+    一条 UPDATE 更新多个订单的状态
+    :param tx: 所在的事务，None 时单独提交
+    """
+    if not order_ids:
+        return
+    if WRITE_BEHIND:
+        return _buffer_status({order_id: status for order_id in order_ids})
+    _write_orders_status(status, order_ids, tx)
+
+
+def _write_orders_status(status: int, order_ids: list, tx: db.Transaction | None = None):
+    placeholders = ",".join(["%s"] * len(order_ids))
+    (tx or db).update_one(
+        f"update `order` set `status`=%s where `id` in ({placeholders})",
+        [status, *order_ids]
+    )
+
+
+def _write_status_map(status_map: dict):
+    """不同订单写入不同状态：每 WRITE_BEHIND_CHUNK 个订单一条 UPDATE ... CASE 语句"""
+    db.update_many("order", "id", ["status"], list(status_map.items()), WRITE_BEHIND_CHUNK)
+
+
+def enable_write_behind():
+    """开启状态写缓冲，进程池子进程通过环境变量继承"""
+    global WRITE_BEHIND
+    WRITE_BEHIND = True
+    os.environ["WORKER_WRITE_BEHIND"] = "1"
+
+
+def _buffer_status(status_map: dict):
+    if cache.buffer_status("task_queue", status_map) < WRITE_BEHIND_BATCH:
+        return
+    if _status_flusher is not None:
+        _status_flush_event.set()
+        return
+    # 本进程没有刷新线程（进程池子进程）：缓冲超过阈值时直接回写，其它进程正在回写时立即返回
+    try:
+        flush_status_updates()
+    except Exception as e:
+        print(f"状态回写异常: {e}")
+
+
+def flush_status_updates() -> int:
+    """
+    把状态缓冲批量回写数据库（多个状态合并在同一条 UPDATE 中），直到缓冲为空或其它 worker 正在刷新
+    :return: 回写的订单数
+    """
+    total = 0
+    while True:
+        token, status_map = cache.take_status_batch("task_queue", WRITE_BEHIND_LOCK_TTL)
+        if token is None:
+            return total
+        applied = False
+        try:
+            _write_status_map({int(order_id): int(status) for order_id, status in status_map.items()})
+            applied = True
+        finally:
+            cache.finish_status_batch("task_queue", token, applied)
+        total += len(status_map)
+
+
+def _status_flusher_loop():
+    """刷新线程：按时间间隔或缓冲数量触发回写"""
+    while not _status_flusher_stop.is_set():
+        _status_flush_event.wait(WRITE_BEHIND_INTERVAL)
+        _status_flush_event.clear()
+        try:
+            flush_status_updates()
+        except Exception as e:
+            print(f"状态回写异常: {e}")
+
+
+def start_status_flusher():
+    global _status_flusher
+    if not WRITE_BEHIND:
+        return None
+    _status_flusher = threading.Thread(target=_status_flusher_loop, name="status-flusher", daemon=True)
+    _status_flusher.start()
+    return _status_flusher
+
+
+def stop_status_flusher():
+    """在途订单排空后调用：停止刷新线程并回写剩余的状态"""
+    if _status_flusher is None:
+        return
+    _status_flusher_stop.set()
+    _status_flush_event.set()
+    _status_flusher.join()
+    flushed = flush_status_updates()
+    print(f"状态缓冲已回写: {flushed} 个订单")
+
+
+def set_task_executor(name: str):
+    """选择订单执行器，进程池子进程通过环境变量继承"""
+    global TASK_EXECUTOR
+    if name not in task_executor.EXECUTORS:
+        raise ValueError(f"不支持的执行器: {name}")
+    TASK_EXECUTOR = name
+    os.environ["TASK_EXECUTOR"] = name
+
+
+def _observe_http_request(host: str, outcome, elapsed: float):
+    HTTP_REQUESTS.inc(outcome=outcome)
+    HTTP_REQUEST_DURATION.observe(elapsed)
+
+
+def get_task_executor():
+    global _task_executor
+    with _task_executor_lock:
+        if _task_executor is None:
+            options = {"observer": _observe_http_request} if TASK_EXECUTOR == "http" else {}
+            _task_executor = task_executor.create_executor(TASK_EXECUTOR, **options)
+        return _task_executor
+
+
+class ProgressTracker:
+    """
+    任务执行进度：成功的单位数累加到订单进度，并按单位数或时间间隔保存检查点；
+    任务重新执行时（回收、失败重试）从检查点继续，只执行剩余的单位
+    """
+
+    def __init__(self, order: dict):
+        self.order_id = order["id"]
+        self.ref = message.task_ref(order)
+        self.count = order["count"]
+        self.done = cache.read_checkpoint("task_queue", self.ref)
+        self._pending = 0
+        self._saved_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        return max(self.count - self.done, 0)
+
+    def advance(self, units: int = 1):
+        with self._lock:
+            self.done += units
+            self._pending += units
+            if (self._pending >= PROGRESS_CHECKPOINT_UNITS
+                    or time.monotonic() - self._saved_at >= PROGRESS_CHECKPOINT_SECONDS):
+                self._save()
+
+    def _save(self):
+        if self._pending:
+            cache.save_progress("task_queue", self.order_id, self.ref, self._pending, self.done, PROGRESS_TTL)
+            self._pending = 0
+        self._saved_at = time.monotonic()
+
+    def finish(self, success: bool):
+        """保存剩余进度；成功时删除检查点，失败时保留供重试继续"""
+        with self._lock:
+            self._save()
+        if success:
+            cache.clear_checkpoints("task_queue", [self.ref])
+
+
+def execute_order(order: dict) -> bool:
+    """执行订单任务，返回是否成功"""
+    print("处理订单: ", order)
+    tracker = ProgressTracker(order)
+    if tracker.done:
+        print(f"订单{order['id']}从检查点继续: 已完成 {tracker.done}/{tracker.count}")
+    result = get_task_executor().execute(order["url"], tracker.remaining, tracker.advance)
+    tracker.finish(result.ok)
+    print(f"订单{order['id']}执行结果: {result}")
+    return result.ok
+
+
+def _safe_execute_order(order: dict) -> bool:
+    """执行订单，异常视为失败"""
+    try:
+        return execute_order(order)
+    except Exception as e:
+        print(f"订单{order['id']}处理异常: {e}")
+        return False
+
+
+def retry_delay(attempt: int) -> float:
+    """第 attempt 次失败后的重试延迟：指数退避 + 全抖动，避免同一批失败订单同时重试"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def plan_retries(orders: list[dict]):
+    """
+    按失败次数（含本次）把失败订单（或分块）分为等待重试与最终失败，只读取 Redis，
+    订单状态提交后再由 schedule_retries 写入
+    :return: (等待重试的订单列表, 最终失败的订单列表)
+    """
+    attempts = cache.read_attempts("task_queue", [message.task_ref(order) for order in orders])
+    return _sort_retries(orders, attempts)
+
+
+def schedule_retries(retry: list[dict], dead: list[dict]):
+    """订单状态提交后处理失败订单：等待重试的失败次数加一并加入延迟重试队列，最终失败的进入死信列表"""
+    attempts = cache.incr_attempts("task_queue", [message.task_ref(order) for order in retry])
+    cache.schedule_retry("task_queue", _retry_due_map(retry, attempts))
+    cache.dead_letter("task_queue", [message.encode_task(order) for order in dead])
+    cache.clear_attempts("task_queue", [message.task_ref(order) for order in dead])
+
+
+def _sort_retries(orders: list[dict], attempts: list[int]):
+    """
+    按已记录的失败次数分组，本次失败后达到最大次数的为最终失败
+    :return: (等待重试的订单列表, 最终失败的订单列表)
+    """
+    retry, dead = [], []
+    for order, attempt in zip(orders, attempts):
+        (retry if attempt + 1 < RETRY_MAX_ATTEMPTS else dead).append(order)
+    return retry, dead
+
+
+def _retry_due_map(orders: list[dict], attempts: list[int]) -> dict:
+    """{消息: 重试时间}"""
+    return {message.encode_task(order): time.time() + retry_delay(attempt) for order, attempt in zip(orders, attempts)}
+
+
+def claim_orders(orders: list[dict]) -> list[dict]:
+    """
+    执行前认领订单（或分块）：已结束的重复消息直接跳过并注销登记，正在被其它 worker 执行的延后到认领过期后重试
+    :return: 认领成功的订单，订单中记录本次认领的执行者，结束时用于释放
+    """
+    results = cache.claim_tasks("task_queue", _new_claims(orders), CLAIM_TTL)
+    claimed, skipped, deferred = _sort_claims(orders, results)
+    cache.schedule_retry("task_queue", deferred)
+    release_orders(skipped)
+    return claimed
+
+
+def _new_claims(orders: list[dict]) -> list[tuple[str, str]]:
+    """为每个订单生成本次执行的认领标识，记录在订单中"""
+    for order in orders:
+        order["claim"] = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+    return [(message.task_ref(order), order["claim"]) for order in orders]
+
+
+def _sort_claims(orders: list[dict], results: list):
+    """
+    按认领结果分组
+    :return: (认领成功的订单列表, [(重复消息的订单, "drop"), ...], {延后重试的消息: 重试时间})
+    """
+    claimed, skipped, deferred = [], [], {}
+    for order, result in zip(orders, results):
+        if result is True:
+            claimed.append(order)
+        elif result is None:
+            skipped.append((order, "drop"))
+            print(f"订单{message.task_ref(order)}已结束，跳过重复消息")
+        else:
+            deferred[message.encode_task(order)] = time.time() + result
+            print(f"订单{message.task_ref(order)}正在被其它 worker 处理，{result:.0f} 秒后重试")
+    return claimed, skipped, deferred
+
+
+def release_orders(outcomes: list[tuple[dict, str]]):
+    """
+    释放认领
+    :param outcomes: [(订单, done / retry / dead / drop), ...]
+    """
+    cache.release_tasks("task_queue", _release_items(outcomes), DONE_TTL)
+
+
+def _release_items(outcomes: list[tuple[dict, str]]) -> list[tuple]:
+    return [(message.task_ref(order), order["claim"], outcome) for order, outcome in outcomes if "claim" in order]
+
+
+def forget_missing_orders(raws: list, orders: list[dict]):
+    """订单已不存在的消息不会再执行：注销其入队登记"""
+    cache.forget_tasks("task_queue", _missing_refs(raws, orders))
+
+
+def _missing_refs(raws: list, orders: list[dict]) -> list[str]:
+    found = {message.task_ref(order) for order in orders}
+    tasks = [message.decode_task(raw) for raw in raws]
+    return list({message.task_ref(task) for task in tasks if "id" in task} - found)
+
+
+def abandon_orders(orders: list[dict]):
+    """处理中途出现异常：按等待重试释放认领，放回队列的消息可以立即被重新认领"""
+    try:
+        release_orders([(order, "retry") for order in orders])
+    except Exception as e:
+        print(f"释放认领失败: {e}")
+
+
+def requeue_messages(raws: list, error: Exception, backoff: bool = True):
+    """
+    处理循环出现异常：打印错误并把已出队的消息放回队列，避免订单丢失。
+    已结束的订单在重新出队时会被结束标记跳过
+    :param backoff: 是否等待 WORKER_ERROR_BACKOFF，执行器回调中调用时为 False，不阻塞回调线程
+    """
+    print(f"订单处理异常: {error}，{len(raws)} 条消息放回队列")
+    try:
+        cache.push_queue_many(raws, "task_queue", dedup=False)
+    except Exception as e:
+        print(f"消息放回队列失败: {e}，丢失的消息: {raws}")
+    if backoff:
+        _stop_event.wait(WORKER_ERROR_BACKOFF)
+
+
+def _order_ids(orders: list[dict]) -> list:
+    """整单（非分块）的订单编号"""
+    return [order["id"] for order in orders if not message.is_chunk(order)]
+
+
+def finish_orders(orders: list[dict], results: list[bool]):
+    """
+    按执行结果回写订单状态：成功 -> 3；失败且可重试 -> 1（等待重试）；失败且超过最大次数 -> 4。
+    分块只记录完成情况，父订单的全部分块结束后回写：全部成功 -> 3，存在最终失败的分块 -> 4；
+    等待重试的分块不影响父订单状态（保持处理中）
+    :return: (成功数, 失败数)
+    """
+    succeeded = [order for order, ok in zip(orders, results) if ok]
+    failed = [order for order, ok in zip(orders, results) if not ok]
+    retry, dead = plan_retries(failed) if failed else ([], [])
+    # 分块结束的记录可以重放，父订单状态提交后才删除分块状态
+    chunk_results = [(order["id"], order["chunk"], True) for order in succeeded if message.is_chunk(order)]
+    chunk_results += [(order["id"], order["chunk"], False) for order in dead if message.is_chunk(order)]
+    done_ids, failed_ids = cache.complete_chunks("task_queue", chunk_results)
+    # 全部状态变更在一个事务中写入：一次取连接、一次提交；
+    # 提交成功后再写重试队列、失败次数并释放认领，事务失败时整批可以重新执行
+    with db.transaction() as tx:
+        update_orders_status(3, _order_ids(succeeded) + done_ids, tx)
+        update_orders_status(1, _order_ids(retry), tx)
+        update_orders_status(4, _order_ids(dead) + failed_ids, tx)
+    schedule_retries(retry, dead)
+    cache.clear_attempts("task_queue", [message.task_ref(order) for order in succeeded])
+    cache.clear_chunks("task_queue", done_ids + failed_ids)
+    release_orders(
+        [(order, "done") for order in succeeded] + [(order, "retry") for order in retry]
+        + [(order, "dead") for order in dead]
+    )
+    return len(succeeded), len(failed)
+
+
+def should_split(order: dict) -> bool:
+    """是否需要拆分为分块子任务"""
+    return bool(CHUNK_THRESHOLD) and not message.is_chunk(order) and order["count"] > CHUNK_THRESHOLD
+
+
+def split_order(order: dict) -> int:
+    """
+    把大订单拆分为分块子任务入队，父订单标记为处理中，由最后结束的分块回写最终状态
+    :return: 入队的分块数（父订单被重复投递时跳过已结束的分块）
+    """
+    chunks = math.ceil(order["count"] / CHUNK_SIZE)
+    update_order_status(2, order["id"])
+    pending = cache.init_chunks("task_queue", order["id"], chunks)
+    raws = [
+        message.encode_task({
+            **order, "count": min(CHUNK_SIZE, order["count"] - chunk * CHUNK_SIZE), "chunk": chunk, "chunks": chunks,
+        })
+        for chunk in pending
+    ]
+    cache.push_queue_many(raws, "task_queue")
+    release_orders([(order, "done")])
+    print(f"订单{order['id']}已拆分: {chunks} 个分块，入队 {len(raws)} 个")
+    return len(raws)
+
+
+def process_task(raw):
+    """根据队列消息处理订单"""
+    print(f"已拿到订单: {raw}")
+    # 1.解析消息，旧格式消息在数据库中检查订单是否存在
+    order = load_task(raw)
     if not order:
+        forget_missing_orders([raw], [])
         return False, "订单不存在"
-    # 2.更新订单状态：处理中
-    update_order_status(2, order["id"])
-    # 3.处理订单
+    # 2.认领订单，重复消息跳过或延后
+    if not claim_orders([order]):
+        return True, "重复消息，已跳过"
+    try:
+        # 3.大订单拆分为分块子任务
+        if should_split(order):
+            split_order(order)
+            return True, "订单已拆分"
+        # 4.更新订单状态：处理中（分块的父订单在拆分时已标记）
+        if not message.is_chunk(order):
+            update_order_status(2, order["id"])
+        # 5.处理订单
+        success = _safe_execute_order(order)
+
+        # 6.更新订单状态：成功/失败（失败时按退避策略重试）
+        finish_orders([order], [success])
+    except Exception:
+        abandon_orders([order])
+        raise
+
+    return success, "订单已处理" if success else "订单处理失败"
+
+
+def _retry_scheduler_loop():
+    """重试调度：定期把到期的重试订单批量放回任务队列"""
+    while not _stop_event.wait(RETRY_PROMOTE_INTERVAL):
+        try:
+            promoted = cache.promote_due_retries("task_queue", RETRY_PROMOTE_BATCH)
+            if promoted:
+                print(f"重试订单已放回队列: {promoted} 个")
+        except Exception as e:
+            print(f"重试调度异常: {e}")
+
+
+def start_retry_scheduler():
+    thread = threading.Thread(target=_retry_scheduler_loop, name="retry-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+def work_key(order: dict) -> tuple:
+    """工作键：url 与 count 相同的订单执行内容相同"""
+    return order["url"], order["count"]
+
+
+def coalesce_orders(orders: list[dict]) -> list[list[dict]]:
+    """
+    按工作键分组。分块各自成组（同一父订单的分块工作键相同，但执行的是不同的部分）；
+    有检查点的订单也各自成组（从检查点继续时只执行剩余部分，结果不能代表完整执行）
+    :return: [[订单, ...], ...]，每组由第一个订单代表执行
+    """
+    checkpoints = cache.read_checkpoints("task_queue", [message.task_ref(order) for order in orders])
+    groups = {}
+    for index, (order, done) in enumerate(zip(orders, checkpoints)):
+        key = ("alone", index) if message.is_chunk(order) or done else work_key(order)
+        groups.setdefault(key, []).append(order)
+    return list(groups.values())
+
+
+def execute_coalesced(orders: list[dict], executor: ThreadPoolExecutor):
+    """
+    合并执行：每组只执行第一个订单，结果同步给组内其它订单
+    :return: (重新排列后的订单列表, 与之一一对应的执行结果)
+    """
+    groups = coalesce_orders(orders)
+    leader_results = list(executor.map(_safe_execute_order, [group[0] for group in groups]))
+    ordered, results = [], []
+    for group, success in zip(groups, leader_results):
+        if len(group) > 1:
+            print(f"合并执行: 订单{group[0]['id']}的结果同步给 {len(group) - 1} 个相同订单")
+            COALESCED_ORDERS.inc(len(group) - 1)
+        ordered.extend(group)
+        results.extend([success] * len(group))
+    return ordered, results
+
+
+def process_batch(raws: list, executor: ThreadPoolExecutor, coalesce: bool = False):
+    """
+    批量处理订单：旧格式消息一次查询补齐，一条 UPDATE 标记为处理中，执行完成后按结果分组回写
+    :param raws: 队列消息列表
+    :param executor: 执行订单任务的线程池
+    :param coalesce: 是否合并执行批次内工作键相同的订单
+    :return: (成功数, 失败数)
+    """
+    print(f"已拿到订单: {len(raws)} 个")
+    # 1.解析消息，旧格式消息一次查询检查订单是否存在
+    orders = load_tasks(raws)
+    if len(orders) < len(raws):
+        print(f"订单不存在: {len(raws) - len(orders)} 个")
+        forget_missing_orders(raws, orders)
+    # 2.批量认领，重复消息跳过或延后
+    loaded = len(orders)
+    orders = claim_orders(orders)
+    skipped = loaded - len(orders)
+    claimed = list(orders)
+    try:
+        # 3.大订单拆分为分块子任务
+        split = [order for order in orders if should_split(order)]
+        for order in split:
+            split_order(order)
+        orders = [order for order in orders if not should_split(order)]
+        if not orders:
+            return len(split) + skipped, 0
+        # 4.一条 UPDATE 更新订单状态：处理中
+        update_orders_status(2, _order_ids(orders))
+        # 5.并发处理订单，合并执行时相同的订单只执行一次
+        if coalesce:
+            orders, results = execute_coalesced(orders, executor)
+        else:
+            results = list(executor.map(_safe_execute_order, orders))
+        # 6.按结果分组更新订单状态：成功/失败
+        succeeded, failed = finish_orders(orders, results)
+    except Exception:
+        abandon_orders(claimed)
+        raise
+    return succeeded + len(split) + skipped, failed
+
+
+def collect_batch(batch_size: int, window: float = 0) -> list:
+    """
+    出队一个批次：取到第一批消息后，在 window 秒内继续出队直到凑满 batch_size
+    :param window: 收集时间窗口（秒），0 表示只出队一次
+    """
+    raws = cache.pop_queue_batch("task_queue", batch_size, WORKER_POP_TIMEOUT)
+    if not raws or not window:
+        return raws
+    deadline = time.monotonic() + window
+    while len(raws) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        raws += cache.pop_queue_batch("task_queue", batch_size - len(raws), remaining)
+    return raws
+
+
+def run_batch(batch_size: int = BATCH_SIZE, concurrency: int = WORKER_CONCURRENCY, coalesce: bool = False):
+    """
+    批量模式：单次 Redis 往返取出最多 batch_size 个订单，批量查询与更新状态，适合队列积压时使用
+    :param batch_size: 单次出队的最大订单数
+    :param concurrency: 批次内同时执行的订单数
+    :param coalesce: 合并执行：在 COALESCE_WINDOW 内收集批次，url 与 count 相同的订单只执行一次
+    :return:
+    """
+    init_task_queue()
+    start_retry_scheduler()
+    start_status_flusher()
+
+    _install_stop_handlers()
+
+    print(f"批量 worker 已启动: batch_size={batch_size} concurrency={concurrency} coalesce={coalesce}")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="order-worker") as executor:
+        while not _stop_event.is_set():
+            try:
+                raws = collect_batch(batch_size, COALESCE_WINDOW if coalesce else 0)
+            except Exception as e:
+                print(f"出队异常: {e}")
+                _stop_event.wait(WORKER_ERROR_BACKOFF)
+                continue
+            if not raws:
+                continue
+            started = _task_started(len(raws))
+            succeeded, failed = 0, 0
+            try:
+                succeeded, failed = process_batch(raws, executor, coalesce)
+                print(f"批次处理结束: 成功 {succeeded} 失败 {failed}")
+            except Exception as e:
+                requeue_messages(raws, e)
+            finally:
+                # 未找到的订单计为失败
+                _task_finished(started, succeeded, len(raws) - succeeded)
+    stop_status_flusher()
+    print("批量 worker 已退出")
+
+
+async def update_order_status_async(status: int, order_id: int):
+    if WRITE_BEHIND:
+        if await cache.async_buffer_status("task_queue", {order_id: status}) >= WRITE_BEHIND_BATCH:
+            _status_flush_event.set()
+        return
+    await aiodb.update_one(
+        "update `order` set `status`=%s where `id`=%s",
+        [status, order_id]
+    )
+
+
+async def load_task_async(raw) -> dict | None:
+    """load_task 的异步版本"""
+    task = message.decode_task(raw)
+    if message.is_complete(task):
+        return task
+    if "id" in task:
+        return await aiodb.fetch_one("select * from `order` where `id`=%s", [task["id"]])
+    return await aiodb.fetch_one("select * from `order` where `order_identity`=%s", [task["order_identity"]])
+
+
+async def claim_orders_async(orders: list[dict]) -> list[dict]:
+    """claim_orders 的异步版本"""
+    results = await cache.async_claim_tasks("task_queue", _new_claims(orders), CLAIM_TTL)
+    claimed, skipped, deferred = _sort_claims(orders, results)
+    await cache.async_schedule_retry("task_queue", deferred)
+    await release_orders_async(skipped)
+    return claimed
+
+
+async def release_orders_async(outcomes: list[tuple[dict, str]]):
+    """release_orders 的异步版本"""
+    await cache.async_release_tasks("task_queue", _release_items(outcomes), DONE_TTL)
+
+
+async def abandon_orders_async(orders: list[dict]):
+    """abandon_orders 的异步版本"""
+    try:
+        await release_orders_async([(order, "retry") for order in orders])
+    except Exception as e:
+        print(f"释放认领失败: {e}")
+
+
+async def plan_retries_async(orders: list[dict]):
+    """plan_retries 的异步版本"""
+    attempts = await cache.async_read_attempts("task_queue", [message.task_ref(order) for order in orders])
+    return _sort_retries(orders, attempts)
+
+
+async def schedule_retries_async(retry: list[dict], dead: list[dict]):
+    """schedule_retries 的异步版本"""
+    attempts = await cache.async_incr_attempts("task_queue", [message.task_ref(order) for order in retry])
+    await cache.async_schedule_retry("task_queue", _retry_due_map(retry, attempts))
+    await cache.async_dead_letter("task_queue", [message.encode_task(order) for order in dead])
+    await cache.async_clear_attempts("task_queue", [message.task_ref(order) for order in dead])
+
+
+class AsyncProgressTracker:
+    """
+    ProgressTracker 的异步版本：advance 在事件循环中调用，检查点由后台任务保存，同一时刻最多一个保存在进行，
+    保存期间累加的单位数留到下一次保存
+    """
+
+    def __init__(self, order: dict, done: int):
+        self.order_id = order["id"]
+        self.ref = message.task_ref(order)
+        self.count = order["count"]
+        self.done = done
+        self._pending = 0
+        self._saved_at = time.monotonic()
+        self._saving = None
+
+    @classmethod
+    async def create(cls, order: dict):
+        return cls(order, await cache.async_read_checkpoint("task_queue", message.task_ref(order)))
+
+    @property
+    def remaining(self) -> int:
+        return max(self.count - self.done, 0)
+
+    def advance(self, units: int = 1):
+        self.done += units
+        self._pending += units
+        if self._saving is None and (self._pending >= PROGRESS_CHECKPOINT_UNITS
+                                     or time.monotonic() - self._saved_at >= PROGRESS_CHECKPOINT_SECONDS):
+            self._saving = asyncio.create_task(self._save())
+
+    async def _save(self):
+        units, done = self._pending, self.done
+        self._pending = 0
+        try:
+            await cache.async_save_progress("task_queue", self.order_id, self.ref, units, done, PROGRESS_TTL)
+        except Exception as e:
+            # 保存失败不影响执行，单位数留到下一次保存
+            self._pending += units
+            print(f"订单{self.order_id}保存进度失败: {e}")
+        finally:
+            self._saved_at = time.monotonic()
+            self._saving = None
+
+    async def finish(self, success: bool):
+        """保存剩余进度；成功时删除检查点，失败时保留供重试继续"""
+        if self._saving is not None:
+            await self._saving
+        if self._pending:
+            await cache.async_save_progress(
+                "task_queue", self.order_id, self.ref, self._pending, self.done, PROGRESS_TTL
+            )
+            self._pending = 0
+        if success:
+            await cache.async_clear_checkpoints("task_queue", [self.ref])
+
+
+async def _safe_execute_order_async(order: dict) -> bool:
+    """_safe_execute_order 的异步版本"""
     print("处理订单: ", order)
-    time.sleep(5)
+    try:
+        executor = get_task_executor()
+        tracker = await AsyncProgressTracker.create(order)
+        if tracker.done:
+            print(f"订单{order['id']}从检查点继续: 已完成 {tracker.done}/{tracker.count}")
+        if hasattr(executor, "execute_async"):
+            result = await executor.execute_async(order["url"], tracker.remaining, tracker.advance)
+        else:
+            # 没有异步实现的执行器放到线程中执行，进度回调转回事件循环
+            loop = asyncio.get_running_loop()
+            result = await asyncio.to_thread(
+                executor.execute, order["url"], tracker.remaining,
+                lambda units: loop.call_soon_threadsafe(tracker.advance, units)
+            )
+        await tracker.finish(result.ok)
+        print(f"订单{order['id']}执行结果: {result}")
+        return result.ok
+    except Exception as e:
+        print(f"订单{order['id']}处理异常: {e}")
+        return False
+
+
+async def process_task_async(raw):
+    """
+    根据队列消息处理订单（异步版本，状态流转与 process_task 保持一致）
+    认领、进度、重试与释放都使用异步 Redis；只有大订单拆分与分块结束（需要汇总父订单）放到线程中复用同步实现
+    """
+    print(f"已拿到订单: {raw}")
+    # 1.解析消息，旧格式消息在数据库中检查订单是否存在
+    order = await load_task_async(raw)
+    if not order:
+        await cache.async_forget_tasks("task_queue", _missing_refs([raw], []))
+        return False, "订单不存在"
+    # 2.认领订单，重复消息跳过或延后
+    if not await claim_orders_async([order]):
+        return True, "重复消息，已跳过"
+    try:
+        # 3.大订单拆分为分块子任务
+        if should_split(order):
+            await asyncio.to_thread(split_order, order)
+            return True, "订单已拆分"
+        # 4.更新订单状态：处理中（分块的父订单在拆分时已标记）
+        if not message.is_chunk(order):
+            await update_order_status_async(2, order["id"])
+        # 5.处理订单
+        success = await _safe_execute_order_async(order)
 
-    # 4.更新订单状态：成功/失败
-    update_order_status(3, order["id"])
+        # 6.更新订单状态：成功/失败（失败时按退避策略重试）
+        if message.is_chunk(order):
+            await asyncio.to_thread(finish_orders, [order], [success])
+        elif success:
+            await update_order_status_async(3, order["id"])
+            await cache.async_clear_attempts("task_queue", [message.task_ref(order)])
+            await release_orders_async([(order, "done")])
+        else:
+            retry, dead = await plan_retries_async([order])
+            await update_order_status_async(1 if retry else 4, order["id"])
+            await schedule_retries_async(retry, dead)
+            await release_orders_async([(order, "retry" if retry else "dead")])
+    except Exception:
+        await abandon_orders_async([order])
+        raise
 
-    return True, "订单已处理"
+    return success, "订单已处理" if success else "订单处理失败"
 
 
 def run():
     init_task_queue()
+    start_retry_scheduler()
+    start_status_flusher()
 
-    while True:
-        order_id = cache.pop_queue("task_queue", 10)
-        if not order_id:
+    _install_stop_handlers()
+
+    while not _stop_event.is_set():
+        try:
+            raw = cache.pop_queue("task_queue", 10)
+        except Exception as e:
+            print(f"出队异常: {e}")
+            _stop_event.wait(WORKER_ERROR_BACKOFF)
+            continue
+        if not raw:
             continue
-        process_task(order_id)
+        started = _task_started()
+        success = False
+        try:
+            success, msg = process_task(raw)
+        except Exception as e:
+            requeue_messages([raw], e)
+        finally:
+            _task_finished(started, int(success), int(not success))
+    stop_status_flusher()
+
+
+def _handle_stop_signal(signum, frame):
+    """退出信号处理：仅设置退出标记，由主循环负责排空在途订单"""
+    print(f"收到退出信号({signum})，停止接收新订单，等待在途订单处理完成...")
+    _stop_event.set()
+
+
+def _stop_signals():
+    """退出信号：Windows 下 supervisor 通过 CTRL_BREAK_EVENT（SIGBREAK）通知 worker 退出"""
+    signals = [signal.SIGTERM, signal.SIGINT]
+    if hasattr(signal, "SIGBREAK"):
+        signals.append(signal.SIGBREAK)
+    return signals
+
+
+def _install_stop_handlers():
+    for signum in _stop_signals():
+        signal.signal(signum, _handle_stop_signal)
+
+
+def _ignore_stop_signals():
+    """进程池子进程初始化：忽略退出信号，由主进程统一排空"""
+    for signum in _stop_signals():
+        signal.signal(signum, signal.SIG_IGN)
+
+
+def _reaper_loop(stop_event: threading.Event, inflight_values: set, lock: threading.Lock):
+    """
+    回收器：刷新心跳，为在途订单续约，并把租约到期或失联 worker 的订单放回队列
+    """
+    while True:
+        try:
+            cache.heartbeat("task_queue", WORKER_ID, REAPER_INTERVAL * 3)
+            with lock:
+                values = list(inflight_values)
+            cache.extend_lease("task_queue", WORKER_ID, values, VISIBILITY_TIMEOUT)
+            cache.extend_claims("task_queue", values, CLAIM_TTL)
+            expired = cache.requeue_expired("task_queue", visibility_timeout=VISIBILITY_TIMEOUT)
+            orphaned = cache.requeue_dead_workers("task_queue")
+            if expired or orphaned:
+                print(f"回收订单: 租约到期 {expired} 个，失联 worker {orphaned} 个")
+        except Exception as e:
+            print(f"回收器异常: {e}")
+        if stop_event.wait(REAPER_INTERVAL):
+            return
+
+
+def _create_executor(mode: str, concurrency: int):
+    """
+    根据模式创建执行器
+    :param mode: thread / process
+    :param concurrency: 并发数
+    :return: Executor
+    """
+    if mode == "thread":
+        return ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="order-worker")
+    if mode == "process":
+        # 使用 spawn：子进程重新导入模块并创建自己的 MySQL/Redis 连接池，避免 fork 后共享连接
+        return ProcessPoolExecutor(
+            max_workers=concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_ignore_stop_signals,
+        )
+    raise ValueError(f"不支持的工作池模式: {mode}")
+
+
+def run_pool(mode: str = "thread", concurrency: int = WORKER_CONCURRENCY, max_inflight: int | None = WORKER_MAX_INFLIGHT,
+             reliable: bool = False):
+    """
+    工作池模式：同时处理多个订单
+    :param mode: thread: 线程池，process: 进程池
+    :param concurrency: 同时执行的订单数
+    :param max_inflight: 最大在途订单数，达到上限后暂停出队，避免订单积压在本地
+    :param reliable: 是否使用可靠队列（处理中列表 + 租约 + 确认），worker 中途退出时订单不会丢失
+    :return:
+    """
+    if max_inflight is None:
+        max_inflight = concurrency * 2
+    max_inflight = max(max_inflight, concurrency)
+
+    init_task_queue()
+    start_retry_scheduler()
+    start_status_flusher()
+
+    _install_stop_handlers()
+
+    executor = _create_executor(mode, concurrency)
+    inflight = threading.BoundedSemaphore(max_inflight)
+    # 可靠队列：记录在途订单用于续约，回收器在排空完成后才停止
+    inflight_values = set()
+    inflight_lock = threading.Lock()
+    reaper_stop = threading.Event()
+    reaper = None
+    if reliable:
+        reaper = threading.Thread(
+            target=_reaper_loop, args=(reaper_stop, inflight_values, inflight_lock), daemon=True
+        )
+        reaper.start()
+
+    def submit(raw):
+        started = _task_started()
+
+        def on_done(future: Future):
+            success, finished = False, False
+            try:
+                success, msg = future.result()
+                finished = True
+                print(f"订单处理结束: {success} {msg}")
+            except Exception as e:
+                if reliable:
+                    print(f"订单处理异常: {e}")
+                else:
+                    requeue_messages([raw], e, backoff=False)
+            try:
+                _task_finished(started, int(success), int(not success))
+                if reliable:
+                    with inflight_lock:
+                        inflight_values.discard(raw)
+                    # 只确认正常结束的订单（最终状态已写入数据库）；异常时保留在处理中列表，
+                    # 不再续约，租约到期后由回收器放回队列
+                    if finished:
+                        cache.ack_queue("task_queue", WORKER_ID, raw)
+            except Exception as e:
+                print(f"确认订单失败: {e}")
+            finally:
+                inflight.release()
+
+        executor.submit(process_task, raw).add_done_callback(on_done)
+
+    print(f"工作池已启动: mode={mode} concurrency={concurrency} max_inflight={max_inflight} reliable={reliable}")
+    try:
+        while not _stop_event.is_set():
+            # 1.等待在途名额，已满时不再出队
+            if not inflight.acquire(timeout=WORKER_POP_TIMEOUT):
+                continue
+            # 2.出队，超时后回到循环开头检查退出标记
+            try:
+                if reliable:
+                    raw = cache.pop_queue_reliable("task_queue", WORKER_ID, WORKER_POP_TIMEOUT, VISIBILITY_TIMEOUT)
+                else:
+                    raw = cache.pop_queue("task_queue", WORKER_POP_TIMEOUT)
+            except Exception as e:
+                print(f"出队异常: {e}")
+                inflight.release()
+                _stop_event.wait(WORKER_ERROR_BACKOFF)
+                continue
+            if not raw:
+                inflight.release()
+                continue
+            if reliable:
+                with inflight_lock:
+                    inflight_values.add(raw)
+            # 3.提交到执行器
+            submit(raw)
+    finally:
+        # 排空：等待所有已提交的订单处理完成
+        executor.shutdown(wait=True)
+        stop_status_flusher()
+        if reliable:
+            reaper_stop.set()
+            reaper.join()
+            cache.unregister_worker("task_queue", WORKER_ID)
+        print("工作池已退出")
+
+
+async def _async_main(concurrency: int):
+    """事件循环主协程：单个出队循环 + 信号量限制同时执行的订单数"""
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def handle(raw):
+        started = _task_started()
+        success = False
+        try:
+            success, msg = await process_task_async(raw)
+            print(f"订单处理结束: {success} {msg}")
+        except Exception as e:
+            # 消息放回队列，不阻塞事件循环
+            await asyncio.to_thread(requeue_messages, [raw], e, False)
+        finally:
+            _task_finished(started, int(success), int(not success))
+            slots.release()
+
+    try:
+        while not _stop_event.is_set():
+            # 1.等待空位
+            await slots.acquire()
+            if _stop_event.is_set():
+                slots.release()
+                break
+            # 2.出队，超时后回到循环开头检查退出标记
+            try:
+                raw = await cache.async_pop_queue("task_queue", WORKER_POP_TIMEOUT)
+            except Exception as e:
+                print(f"出队异常: {e}")
+                slots.release()
+                await asyncio.sleep(WORKER_ERROR_BACKOFF)
+                continue
+            if not raw:
+                slots.release()
+                continue
+            # 3.创建任务，保留引用避免被回收
+            task = asyncio.create_task(handle(raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        # 排空：等待所有在途订单处理完成后再关闭连接池
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(_task_executor, "close_async"):
+            await _task_executor.close_async()
+        await aiodb.AioMySQLPool.close()
+        await cache.AsyncRedisPool.close()
+
+
+def run_async(concurrency: int = ASYNC_CONCURRENCY):
+    """
+    asyncio 模式：在一个事件循环内同时处理大量订单，适合以 I/O 为主的订单
+    :param concurrency: 同时执行的订单数
+    :return:
+    """
+    init_task_queue()
+    start_retry_scheduler()
+    start_status_flusher()
+
+    _install_stop_handlers()
+
+    print(f"异步 worker 已启动: concurrency={concurrency}")
+    asyncio.run(_async_main(concurrency))
+    stop_status_flusher()
+    print("异步 worker 已退出")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="订单处理 worker")
+    parser.add_argument("--mode", choices=["single", "thread", "process", "async", "batch"], default=WORKER_MODE,
+                        help="执行模式")
+    parser.add_argument("-c", "--concurrency", type=int, default=None,
+                        help=f"同时执行的订单数，默认 thread/process: {WORKER_CONCURRENCY}，async: {ASYNC_CONCURRENCY}")
+    parser.add_argument("--max-inflight", type=int, default=WORKER_MAX_INFLIGHT,
+                        help="最大在途订单数")
+    parser.add_argument("--reliable", action="store_true",
+                        help="thread/process 模式下使用可靠队列（处理中列表 + 租约 + 确认）")
+    parser.add_argument("--full-reconcile", action="store_true",
+                        help="忽略检查点，启动时重新扫描全部待执行订单并清除它们的结束标记与认领"
+                             "（检查点只会停在最早的待执行订单之前，通常不需要；用于数据库中的订单被改回待执行状态之后）")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="batch 模式下单次出队的最大订单数")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help="指标 HTTP 端口（Prometheus 文本格式），0 表示不启动")
+    parser.add_argument("--executor", choices=list(task_executor.EXECUTORS), default=TASK_EXECUTOR,
+                        help="订单执行器")
+    parser.add_argument("--write-behind", action="store_true",
+                        help="状态变更先写入 Redis，批量回写 MySQL")
+    parser.add_argument("--coalesce", action="store_true",
+                        help="batch 模式下合并执行时间窗口内 url 与 count 相同的订单")
+    parser.add_argument("--shards", type=lambda value: [int(index) for index in value.split(",")], default=None,
+                        help="负责的队列分片下标，逗号分隔（QUEUE_SHARDS > 1 时生效），默认按 worker 标识哈希分配")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    args = parse_args()
+    if args.full_reconcile:
+        enable_full_reconcile()
+    cache.set_home_shards(args.shards)
+    set_task_executor(args.executor)
+    if args.write_behind:
+        enable_write_behind()
+    if args.coalesce and args.mode != "batch":
+        print("提示: --coalesce 仅在 batch 模式下生效")
+    setup_metrics(args.metrics_port)
+    if args.mode == "single":
+        run()
+    elif args.mode == "async":
+        run_async(args.concurrency or ASYNC_CONCURRENCY)
+    elif args.mode == "batch":
+        run_batch(args.batch_size, args.concurrency or WORKER_CONCURRENCY, args.coalesce)
+    else:
+        run_pool(args.mode, args.concurrency or WORKER_CONCURRENCY, args.max_inflight, args.reliable)
\ No newline at end of file